@@ -149,6 +149,11 @@ build_kernel() {
     ./scripts/config --set-val CONFIG_VIRTIO_RING y
     ./scripts/config --set-val CONFIG_VIRTIO_CONSOLE y
     ./scripts/config --set-val CONFIG_SCSI_VIRTIO y
+    ./scripts/config --set-val CONFIG_VIRTIO_BALLOON y
+    ./scripts/config --set-val CONFIG_VSOCKETS y
+    ./scripts/config --set-val CONFIG_VIRTIO_VSOCKETS y
+    # Reseeds the RNG when Firecracker restores a snapshot (clones diverge)
+    ./scripts/config --set-val CONFIG_VMGENID y
     
     # Root filesystem support
     ./scripts/config --set-val CONFIG_DEVTMPFS y
@@ -173,6 +178,7 @@ build_kernel() {
     ./scripts/config --set-val CONFIG_EXT4_FS_POSIX_ACL y
     ./scripts/config --set-val CONFIG_EXT4_FS_SECURITY y
     ./scripts/config --set-val CONFIG_FS_POSIX_ACL y
+    ./scripts/config --set-val CONFIG_OVERLAY_FS y
     
     # Critical drivers for block device detection
     ./scripts/config --set-val CONFIG_BLK_DEV_LOOP y
@@ -6,6 +6,7 @@
 set -e  # Exit immediately if a command exits with a non-zero status
 
 # Variables
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 ROOTFS_DIR="debian-rootfs"
 ROOTFS_IMAGE="firecracker-rootfs.ext4"
 IMAGE_SIZE="2048"  # Size in MB (2GB)
@@ -167,47 +168,61 @@ auto eth0
 iface eth0 inet dhcp
 EOF
     
+    # Network, hostname and job parameters come from MMDS at boot (mmds-init),
+    # so the same image serves every VM; overlay-init lets VMs share it read-only
+    install -m 0755 "$SCRIPT_DIR/mmds-init.sh" "$ROOTFS_DIR/usr/local/sbin/mmds-init"
+    install -m 0755 "$SCRIPT_DIR/overlay-init.sh" "$ROOTFS_DIR/sbin/overlay-init"
+    mkdir -p "$ROOTFS_DIR/overlay" "$ROOTFS_DIR/mnt/rom"
+
+    # Clones re-run mmds-init when the host connects to vsock port 1025 after
+    # resuming them (tools/vm_clone.py)
+    mkdir -p "$ROOTFS_DIR/etc/systemd/system/sockets.target.wants"
+    cat > "$ROOTFS_DIR/etc/systemd/system/sandbox-reidentify.socket" << EOF
+[Unit]
+Description=Re-identify this VM from MMDS on request of the host
+
+[Socket]
+ListenStream=vsock::1025
+Accept=yes
+
+[Install]
+WantedBy=sockets.target
+EOF
+    cat > "$ROOTFS_DIR/etc/systemd/system/sandbox-reidentify@.service" << EOF
+[Unit]
+Description=Re-identify this VM from MMDS
+
+[Service]
+ExecStart=/usr/local/sbin/mmds-init
+StandardInput=socket
+StandardOutput=socket
+StandardError=journal
+EOF
+    ln -sf "/etc/systemd/system/sandbox-reidentify.socket" "$ROOTFS_DIR/etc/systemd/system/sockets.target.wants/sandbox-reidentify.socket"
+
     # Create rc.local for network setup
     cat > "$ROOTFS_DIR/etc/rc.local" << EOF
 #!/bin/sh
-# Configure network interface
-ip addr add 192.168.1.2/24 dev eth0
-ip link set eth0 up
-ip route add default via 192.168.1.1
-
-# Configure DNS
-cat > /etc/resolv.conf << DNS_EOF
-nameserver 1.1.1.1
-nameserver 8.8.8.8
-DNS_EOF
+# Configure network, hostname and DNS from the VM's metadata
+/usr/local/sbin/mmds-init
 
 # Enable IP forwarding for better connectivity
 echo 1 > /proc/sys/net/ipv4/ip_forward
 
-# Wait for network to be ready
-sleep 2
-
-# Test network connectivity and retry if needed
+# Wait for the gateway to answer before reporting ready
+GATEWAY=\$(ip route show default | awk '{print \$3; exit}')
 for i in \$(seq 1 5); do
-    if ping -c 1 -W 1 8.8.8.8 >/dev/null 2>&1; then
+    if ping -c 1 -W 1 "\$GATEWAY" >/dev/null 2>&1; then
         echo "Network is up and running!"
         break
     fi
-    echo "Retrying network setup (attempt \$i)..."
-    ip link set eth0 down
+    echo "Waiting for network (attempt \$i)..."
     sleep 1
-    ip link set eth0 up
-    # Check if IP is already assigned before adding it
-    if ! ip addr show dev eth0 | grep -q "192.168.1.2"; then
-        ip addr add 192.168.1.2/24 dev eth0
-    fi
-    # Check if default route exists before adding it
-    if ! ip route show | grep -q "default via 192.168.1.1"; then
-        ip route add default via 192.168.1.1
-    fi
-    sleep 2
 done
 
+# Tell the host the guest is usable (picked up by tools/vm_ready.py)
+echo "firecracker-sandbox: ready" > /dev/console
+
 exit 0
 EOF
     
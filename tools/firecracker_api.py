@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import http.client
+from typing import Optional, Dict, Any, List, Callable
+
+DEFAULT_API_SOCKET = "/tmp/firecracker.socket"
+
+class Colors:
+    HEADER = '\033[95m'
+    OKBLUE = '\033[94m'
+    OKCYAN = '\033[96m'
+    OKGREEN = '\033[92m'
+    WARNING = '\033[93m'
+    FAIL = '\033[91m'
+    ENDC = '\033[0m'
+    BOLD = '\033[1m'
+    UNDERLINE = '\033[4m'
+
+def print_color(message: str, color: str) -> None:
+    """Print colored message to terminal."""
+    print(f"{color}{message}{Colors.ENDC}")
+
+class FirecrackerAPIError(Exception):
+    """Raised when the Firecracker API answers with a non-2xx status."""
+
+    def __init__(self, method: str, path: str, status: int, fault: str):
+        super().__init__(f"{method} {path} failed with HTTP {status}: {fault}")
+        self.method = method
+        self.path = path
+        self.status = status
+        self.fault = fault
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP/1.1 connection to a Unix domain socket instead of a TCP host."""
+
+    def __init__(self, socket_path: str, timeout: float = 10.0):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+class FirecrackerClient:
+    """
+    Client for the Firecracker REST API served on the VMM's API socket.
+
+    A single keep-alive connection is opened lazily and reused for every
+    request, so a pause/snapshot/resume sequence costs three round trips on
+    one socket instead of three process spawns and three connects.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_API_SOCKET, timeout: float = 10.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._conn: Optional[UnixHTTPConnection] = None
+
+    def __enter__(self) -> "FirecrackerClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the underlying connection, if any."""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _connection(self) -> UnixHTTPConnection:
+        if self._conn is None:
+            self._conn = UnixHTTPConnection(self.socket_path, self.timeout)
+        return self._conn
+
+    def request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        """
+        Send one API request and return the decoded JSON response body.
+
+        Args:
+            method: HTTP method (GET, PUT, PATCH)
+            path: API path such as '/vm' or '/snapshot/create'
+            body: JSON-serialisable request body
+        Returns:
+            The parsed response body, or None for empty (204) responses
+        Raises:
+            FirecrackerAPIError: if the API rejects the request
+        """
+        payload = json.dumps(body) if body is not None else None
+        headers = {"Accept": "application/json"}
+        if payload is not None:
+            headers["Content-Type"] = "application/json"
+
+        for attempt in range(2):
+            conn = self._connection()
+            reused = conn.sock is not None
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+                break
+            except (BrokenPipeError, ConnectionResetError, http.client.RemoteDisconnected):
+                # The VMM dropped an idle keep-alive connection before reading
+                # our request; reconnect once, but never replay on a fresh socket.
+                self.close()
+                if not reused or attempt:
+                    raise
+            except Exception:
+                self.close()
+                raise
+
+        if response.will_close:
+            self.close()
+
+        decoded = None
+        if data:
+            try:
+                decoded = json.loads(data)
+            except ValueError:
+                decoded = data.decode(errors="replace")
+
+        if response.status >= 300:
+            fault = decoded.get("fault_message", "") if isinstance(decoded, dict) else str(decoded or "")
+            raise FirecrackerAPIError(method, path, response.status, fault)
+        return decoded
+
+    # Instance information
+
+    def describe_instance(self) -> Dict[str, Any]:
+        """GET / - instance id, state and VMM version."""
+        return self.request("GET", "/")
+
+    def get_vm_config(self) -> Dict[str, Any]:
+        """GET /vm/config - full effective VM configuration."""
+        return self.request("GET", "/vm/config")
+
+    # Pre-boot configuration
+
+    def get_machine_config(self) -> Dict[str, Any]:
+        """GET /machine-config."""
+        return self.request("GET", "/machine-config")
+
+    def put_machine_config(
+        self,
+        vcpu_count: int,
+        mem_size_mib: int,
+        smt: Optional[bool] = None,
+        track_dirty_pages: Optional[bool] = None,
+        huge_pages: Optional[str] = None
+    ) -> None:
+        """PUT /machine-config."""
+        body: Dict[str, Any] = {"vcpu_count": vcpu_count, "mem_size_mib": mem_size_mib}
+        if smt is not None:
+            body["smt"] = smt
+        if track_dirty_pages is not None:
+            body["track_dirty_pages"] = track_dirty_pages
+        if huge_pages is not None:
+            body["huge_pages"] = huge_pages
+        self.request("PUT", "/machine-config", body)
+
+    def put_boot_source(self, kernel_image_path: str, boot_args: Optional[str] = None, initrd_path: Optional[str] = None) -> None:
+        """PUT /boot-source."""
+        body: Dict[str, Any] = {"kernel_image_path": kernel_image_path}
+        if boot_args is not None:
+            body["boot_args"] = boot_args
+        if initrd_path is not None:
+            body["initrd_path"] = initrd_path
+        self.request("PUT", "/boot-source", body)
+
+    def put_drive(
+        self,
+        drive_id: str,
+        path_on_host: str,
+        is_root_device: bool = False,
+        is_read_only: bool = False,
+        rate_limiter: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """PUT /drives/{drive_id}."""
+        body: Dict[str, Any] = {
+            "drive_id": drive_id,
+            "path_on_host": path_on_host,
+            "is_root_device": is_root_device,
+            "is_read_only": is_read_only
+        }
+        if rate_limiter is not None:
+            body["rate_limiter"] = rate_limiter
+        self.request("PUT", f"/drives/{drive_id}", body)
+
+    def patch_drive(self, drive_id: str, path_on_host: Optional[str] = None, rate_limiter: Optional[Dict[str, Any]] = None) -> None:
+        """PATCH /drives/{drive_id} - swap the backing file or update limits on a running VM."""
+        body: Dict[str, Any] = {"drive_id": drive_id}
+        if path_on_host is not None:
+            body["path_on_host"] = path_on_host
+        if rate_limiter is not None:
+            body["rate_limiter"] = rate_limiter
+        self.request("PATCH", f"/drives/{drive_id}", body)
+
+    def put_network_interface(
+        self,
+        iface_id: str,
+        host_dev_name: str,
+        guest_mac: Optional[str] = None,
+        rx_rate_limiter: Optional[Dict[str, Any]] = None,
+        tx_rate_limiter: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """PUT /network-interfaces/{iface_id}."""
+        body: Dict[str, Any] = {"iface_id": iface_id, "host_dev_name": host_dev_name}
+        if guest_mac is not None:
+            body["guest_mac"] = guest_mac
+        if rx_rate_limiter is not None:
+            body["rx_rate_limiter"] = rx_rate_limiter
+        if tx_rate_limiter is not None:
+            body["tx_rate_limiter"] = tx_rate_limiter
+        self.request("PUT", f"/network-interfaces/{iface_id}", body)
+
+    def patch_network_interface(
+        self,
+        iface_id: str,
+        rx_rate_limiter: Optional[Dict[str, Any]] = None,
+        tx_rate_limiter: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """PATCH /network-interfaces/{iface_id} - update limits on a running VM."""
+        body: Dict[str, Any] = {"iface_id": iface_id}
+        if rx_rate_limiter is not None:
+            body["rx_rate_limiter"] = rx_rate_limiter
+        if tx_rate_limiter is not None:
+            body["tx_rate_limiter"] = tx_rate_limiter
+        self.request("PATCH", f"/network-interfaces/{iface_id}", body)
+
+    def put_vsock(self, guest_cid: int, uds_path: str, vsock_id: Optional[str] = None) -> None:
+        """PUT /vsock."""
+        body: Dict[str, Any] = {"guest_cid": guest_cid, "uds_path": uds_path}
+        if vsock_id is not None:
+            body["vsock_id"] = vsock_id
+        self.request("PUT", "/vsock", body)
+
+    def put_balloon(self, amount_mib: int = 0, deflate_on_oom: bool = True, stats_polling_interval_s: int = 1) -> None:
+        """PUT /balloon - attach a balloon device before boot."""
+        self.request("PUT", "/balloon", {
+            "amount_mib": amount_mib,
+            "deflate_on_oom": deflate_on_oom,
+            "stats_polling_interval_s": stats_polling_interval_s
+        })
+
+    def get_balloon(self) -> Dict[str, Any]:
+        """GET /balloon - current balloon target."""
+        return self.request("GET", "/balloon")
+
+    def patch_balloon(self, amount_mib: int) -> None:
+        """PATCH /balloon - inflate or deflate the balloon of a running VM."""
+        self.request("PATCH", "/balloon", {"amount_mib": amount_mib})
+
+    def get_balloon_stats(self) -> Dict[str, Any]:
+        """GET /balloon/statistics - guest memory statistics (needs a stats polling interval)."""
+        return self.request("GET", "/balloon/statistics")
+
+    def patch_balloon_stats(self, stats_polling_interval_s: int) -> None:
+        """PATCH /balloon/statistics - change how often the guest reports statistics."""
+        self.request("PATCH", "/balloon/statistics", {"stats_polling_interval_s": stats_polling_interval_s})
+
+    def put_mmds_config(self, network_interfaces: List[str], version: str = "V2", ipv4_address: Optional[str] = None) -> None:
+        """PUT /mmds/config - expose the metadata store on these interfaces (pre-boot only)."""
+        body: Dict[str, Any] = {"version": version, "network_interfaces": network_interfaces}
+        if ipv4_address is not None:
+            body["ipv4_address"] = ipv4_address
+        self.request("PUT", "/mmds/config", body)
+
+    def put_mmds(self, data: Dict[str, Any]) -> None:
+        """PUT /mmds - replace the whole metadata store."""
+        self.request("PUT", "/mmds", data)
+
+    def patch_mmds(self, data: Dict[str, Any]) -> None:
+        """PATCH /mmds - merge `data` into the metadata store (JSON merge patch)."""
+        self.request("PATCH", "/mmds", data)
+
+    def get_mmds(self) -> Dict[str, Any]:
+        """GET /mmds."""
+        return self.request("GET", "/mmds") or {}
+
+    def put_logger(self, log_path: str, level: str = "Info") -> None:
+        """PUT /logger."""
+        self.request("PUT", "/logger", {"log_path": log_path, "level": level})
+
+    # Actions and VM state
+
+    def start_instance(self) -> None:
+        """PUT /actions InstanceStart."""
+        self.request("PUT", "/actions", {"action_type": "InstanceStart"})
+
+    def send_ctrl_alt_del(self) -> None:
+        """PUT /actions SendCtrlAltDel - ask the guest to shut down cleanly (x86_64 only)."""
+        self.request("PUT", "/actions", {"action_type": "SendCtrlAltDel"})
+
+    def flush_metrics(self) -> None:
+        """PUT /actions FlushMetrics."""
+        self.request("PUT", "/actions", {"action_type": "FlushMetrics"})
+
+    def pause(self) -> None:
+        """PATCH /vm Paused."""
+        self.request("PATCH", "/vm", {"state": "Paused"})
+
+    def resume(self) -> None:
+        """PATCH /vm Resumed."""
+        self.request("PATCH", "/vm", {"state": "Resumed"})
+
+    # Snapshots
+
+    def create_snapshot(self, snapshot_path: str, mem_file_path: str, snapshot_type: str = "Full") -> None:
+        """PUT /snapshot/create - the VM must be paused."""
+        self.request("PUT", "/snapshot/create", {
+            "snapshot_type": snapshot_type,
+            "snapshot_path": snapshot_path,
+            "mem_file_path": mem_file_path
+        })
+
+    def load_snapshot(
+        self,
+        snapshot_path: str,
+        mem_file_path: Optional[str] = None,
+        mem_backend: Optional[Dict[str, str]] = None,
+        enable_diff_snapshots: bool = False,
+        resume_vm: bool = False,
+        network_overrides: Optional[List[Dict[str, str]]] = None
+    ) -> None:
+        """
+        PUT /snapshot/load - only valid on a freshly started, unconfigured VMM.
+
+        Args:
+            snapshot_path: Path to the VM state file
+            mem_file_path: Path to the guest memory file (File backend shorthand)
+            mem_backend: Explicit backend, e.g. {"backend_type": "Uffd", "backend_path": sock}
+            enable_diff_snapshots: Keep dirty page tracking enabled after the load
+            resume_vm: Resume the guest as soon as the load completes
+            network_overrides: Host taps replacing the snapshot's, e.g.
+                [{"iface_id": "eth0", "host_dev_name": "tap7"}] (Firecracker >= 1.12)
+        """
+        body: Dict[str, Any] = {
+            "snapshot_path": snapshot_path,
+            "enable_diff_snapshots": enable_diff_snapshots,
+            "resume_vm": resume_vm
+        }
+        if mem_backend is not None:
+            body["mem_backend"] = mem_backend
+        elif mem_file_path is not None:
+            body["mem_backend"] = {"backend_type": "File", "backend_path": mem_file_path}
+        else:
+            raise ValueError("load_snapshot needs either mem_file_path or mem_backend")
+        if network_overrides:
+            body["network_overrides"] = network_overrides
+        self.request("PUT", "/snapshot/load", body)
+
+    def snapshot(
+        self,
+        snapshot_path: str,
+        mem_file_path: str,
+        snapshot_type: str = "Full",
+        while_paused: Optional[Callable[[], None]] = None,
+        resume: bool = True
+    ) -> float:
+        """
+        Pause, snapshot and resume the VM over the same connection.
+
+        `while_paused` runs after the snapshot is written and before the VM
+        resumes, e.g. to capture disks in the same state as memory. The VM
+        is resumed even if the snapshot fails. With `resume` False a VM
+        snapshotted successfully stays paused, so it can be stopped in
+        exactly the state that was saved.
+
+        Returns:
+            float: Seconds the guest spent paused (until the snapshot was written, if left paused)
+        """
+        self.pause()
+        paused_at = time.monotonic()
+        saved = False
+        try:
+            self.create_snapshot(snapshot_path, mem_file_path, snapshot_type)
+            if while_paused:
+                while_paused()
+            saved = True
+        finally:
+            if resume or not saved:
+                self.resume()
+        return time.monotonic() - paused_at
+
+def wait_for_api_socket(socket_path: str, timeout: float = 5.0, interval: float = 0.005) -> bool:
+    """Wait until the API socket exists and accepts connections."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(socket_path)
+                return True
+            except OSError:
+                pass
+            finally:
+                probe.close()
+        time.sleep(interval)
+    return False
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Talk to a running Firecracker VMM through its API socket",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "--socket",
+        default=os.environ.get("FC_API_SOCKET", DEFAULT_API_SOCKET),
+        help="Path to the Firecracker API socket"
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=10.0,
+        help="Per-request timeout in seconds"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("describe", help="Show instance id, state and VMM version")
+    sub.add_parser("config", help="Show the effective VM configuration")
+    sub.add_parser("pause", help="Pause the VM")
+    sub.add_parser("resume", help="Resume the VM")
+    sub.add_parser("ctrl-alt-del", help="Send Ctrl+Alt+Del to the guest")
+
+    snap = sub.add_parser("snapshot", help="Pause, snapshot and resume the VM")
+    snap.add_argument("--snapshot-path", required=True, help="Where to write the VM state file")
+    snap.add_argument("--mem-file", required=True, help="Where to write the guest memory file")
+    snap.add_argument("--type", default="Full", choices=["Full", "Diff"], help="Snapshot type")
+
+    load = sub.add_parser("load-snapshot", help="Load a snapshot into a fresh VMM")
+    load.add_argument("--snapshot-path", required=True, help="VM state file")
+    load.add_argument("--mem-file", required=True, help="Guest memory file")
+    load.add_argument("--resume", action="store_true", help="Resume the VM after loading")
+
+    raw = sub.add_parser("request", help="Send an arbitrary API request")
+    raw.add_argument("method", choices=["GET", "PUT", "PATCH"], help="HTTP method")
+    raw.add_argument("path", help="API path, e.g. /machine-config")
+    raw.add_argument("body", nargs="?", help="JSON request body")
+
+    args = parser.parse_args()
+
+    try:
+        with FirecrackerClient(args.socket, timeout=args.timeout) as client:
+            if args.command == "describe":
+                print(json.dumps(client.describe_instance(), indent=2))
+            elif args.command == "config":
+                print(json.dumps(client.get_vm_config(), indent=2))
+            elif args.command == "pause":
+                client.pause()
+                print_color("VM paused.", Colors.OKGREEN)
+            elif args.command == "resume":
+                client.resume()
+                print_color("VM resumed.", Colors.OKGREEN)
+            elif args.command == "ctrl-alt-del":
+                client.send_ctrl_alt_del()
+                print_color("Ctrl+Alt+Del sent to the guest.", Colors.OKGREEN)
+            elif args.command == "snapshot":
+                paused = client.snapshot(
+                    os.path.abspath(args.snapshot_path),
+                    os.path.abspath(args.mem_file),
+                    args.type
+                )
+                print_color(f"{args.type} snapshot created; guest paused for {paused * 1000:.1f} ms.", Colors.OKGREEN)
+            elif args.command == "load-snapshot":
+                client.load_snapshot(
+                    os.path.abspath(args.snapshot_path),
+                    mem_file_path=os.path.abspath(args.mem_file),
+                    resume_vm=args.resume
+                )
+                print_color("Snapshot loaded.", Colors.OKGREEN)
+            elif args.command == "request":
+                body = json.loads(args.body) if args.body else None
+                result = client.request(args.method, args.path, body)
+                if result is not None:
+                    print(json.dumps(result, indent=2))
+    except FirecrackerAPIError as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+    except OSError as e:
+        print_color(f"Error: cannot reach Firecracker API at {args.socket}: {e}", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
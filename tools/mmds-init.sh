@@ -0,0 +1,73 @@
+#!/bin/sh
+# Configure this VM from the Firecracker metadata service (MMDS).
+#
+# Installed as /usr/local/sbin/mmds-init by create-matching-rootfs.sh and run
+# from /etc/rc.local. The launcher publishes hostname, address and job
+# parameters per VM (tools/vm_mmds.py), so one image serves every VM. Without
+# metadata the single-VM defaults used by `make net-up` apply.
+#
+# VMs cloned from one snapshot (tools/vm_clone.py) resume with identical
+# state. The host runs this script again in each clone through the
+# sandbox-reidentify vsock socket, after publishing a new MAC, machine-id and
+# entropy for it.
+
+MMDS=169.254.169.254
+IFACE=eth0
+VM_HOSTNAME=firecracker-vm
+ADDRESS=192.168.1.2/24
+GATEWAY=192.168.1.1
+DNS="1.1.1.1 8.8.8.8"
+
+ip link set "$IFACE" up
+ip route add "$MMDS" dev "$IFACE" 2>/dev/null
+
+TOKEN=$(curl -sf -m 2 -X PUT "http://$MMDS/latest/api/token" -H "X-metadata-token-ttl-seconds: 60")
+
+mmds() {
+    curl -sf -m 2 -H "X-metadata-token: $TOKEN" "http://$MMDS/sandbox/$1"
+}
+
+mkdir -p /run/sandbox
+: > /run/sandbox/job.env
+if [ -n "$TOKEN" ] && value=$(mmds hostname) && [ -n "$value" ]; then
+    VM_HOSTNAME=$value
+    ADDRESS=$(mmds network/address)
+    GATEWAY=$(mmds network/gateway)
+    DNS=$(mmds network/dns)
+    MAC=$(mmds network/mac)
+    MACHINE_ID=$(mmds machine-id)
+    ENTROPY=$(mmds entropy)
+    for key in $(mmds job); do
+        printf "%s='%s'\n" "$key" "$(mmds "job/$key" | sed "s/'/'\\\\''/g")" >> /run/sandbox/job.env
+    done
+    echo "mmds-init: configured $VM_HOSTNAME ($ADDRESS) from MMDS" > /dev/console
+else
+    echo "mmds-init: no metadata, using $ADDRESS" > /dev/console
+fi
+
+hostname "$VM_HOSTNAME"
+echo "$VM_HOSTNAME" > /etc/hostname
+sed -i "s/^127\.0\.1\.1.*/127.0.1.1       $VM_HOSTNAME/" /etc/hosts
+
+if [ -n "$ENTROPY" ]; then
+    echo "$ENTROPY" > /dev/urandom
+fi
+if [ -n "$MACHINE_ID" ]; then
+    echo "$MACHINE_ID" > /etc/machine-id
+fi
+if [ -n "$MAC" ] && [ "$(cat "/sys/class/net/$IFACE/address")" != "$MAC" ]; then
+    ip link set "$IFACE" down
+    ip link set "$IFACE" address "$MAC"
+    ip link set "$IFACE" up
+fi
+
+ip addr flush dev "$IFACE" scope global
+ip addr add "$ADDRESS" dev "$IFACE"
+ip route replace default via "$GATEWAY"
+
+: > /etc/resolv.conf
+for server in $DNS; do
+    echo "nameserver $server" >> /etc/resolv.conf
+done
+
+echo "$VM_HOSTNAME $ADDRESS"
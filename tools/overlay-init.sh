@@ -0,0 +1,14 @@
+#!/bin/sh
+# Boot a read-only root image with a tmpfs overlay on top.
+#
+# Installed as /sbin/overlay-init by create-matching-rootfs.sh. The launcher
+# boots with `ro init=/sbin/overlay-init real_init=<init>` when VMs share one
+# root image (vm_launcher.py up --shared-rootfs); guest writes land in RAM
+# and the image on the host is never modified.
+
+set -e
+mount -t tmpfs -o noatime,mode=0755 tmpfs /overlay
+mkdir -p /overlay/root /overlay/work
+mount -t overlay overlay -o noatime,lowerdir=/,upperdir=/overlay/root,workdir=/overlay/work /mnt
+pivot_root /mnt /mnt/rom
+exec "${real_init:-/sbin/init}" "$@"
@@ -40,6 +40,9 @@ echo "Using $MAIN_IF as the main network interface."
 iptables -t nat -A POSTROUTING -o "$MAIN_IF" -j MASQUERADE
 iptables -A FORWARD -i tap0 -o "$MAIN_IF" -j ACCEPT
 iptables -A FORWARD -i "$MAIN_IF" -o tap0 -j ACCEPT
+# Per-VM taps leased by vm_netlease.py (fctap0, fctap1, ...)
+iptables -A FORWARD -i fctap+ -o "$MAIN_IF" -j ACCEPT
+iptables -A FORWARD -i "$MAIN_IF" -o fctap+ -j ACCEPT
 
 echo "Network setup complete!"
 echo "Firecracker VM should now have internet access."
@@ -48,3 +51,5 @@ echo "  ip link delete tap0"
 echo "  iptables -t nat -D POSTROUTING -o $MAIN_IF -j MASQUERADE"
 echo "  iptables -D FORWARD -i tap0 -o $MAIN_IF -j ACCEPT"
 echo "  iptables -D FORWARD -i $MAIN_IF -o tap0 -j ACCEPT"
+echo "  iptables -D FORWARD -i fctap+ -o $MAIN_IF -j ACCEPT"
+echo "  iptables -D FORWARD -i $MAIN_IF -o fctap+ -j ACCEPT"
@@ -5,6 +5,11 @@
 
 set -e
 
+SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+API_SOCKET="${API_SOCKET:-/tmp/firecracker.socket}"
+DAEMON_SOCKET="${FC_DAEMON_SOCKET:-/tmp/firecracker-sandbox.sock}"
+FC_API="python3 $SCRIPT_DIR/firecracker_api.py --socket $API_SOCKET"
+
 # Colors for output
 RED='\033[0;31m'
 GREEN='\033[0;32m'
@@ -22,6 +27,9 @@ show_help() {
     echo "  stop        Stop the VM"
     echo "  restart     Restart the VM"
     echo "  status      Check VM status"
+    echo "  pause       Pause the running VM"
+    echo "  resume      Resume a paused VM"
+    echo "  info        Show instance state via the API socket"
     echo "  rebuild     Rebuild the rootfs and restart VM"
     echo "  network     Setup networking"
     echo "  help        Show this help message"
@@ -50,14 +58,19 @@ start_vm() {
     # Setup networking
     setup_network
     
+    # Refuse to start when the guest does not fit in host memory
+    if ! python3 "$SCRIPT_DIR/vm_admission.py" check --config vm-config.json --socket "$API_SOCKET" ${QUEUE:+--queue}; then
+        return 1
+    fi
+
     # Start VM
     echo -e "${GREEN}Launching VM...${NC}"
-    firecracker --api-sock /tmp/firecracker.socket --config-file vm-config.json &
-    
-    # Wait a moment for VM to start
-    sleep 2
+    rm -f firecracker-console.log
+    firecracker --api-sock "$API_SOCKET" --config-file vm-config.json > firecracker-console.log 2>&1 &
+    local fc_pid=$!
     
-    if is_vm_running; then
+    # Wait until the guest reports ready on its console
+    if python3 "$SCRIPT_DIR/vm_ready.py" --console firecracker-console.log --pid "$fc_pid" --timeout "${READY_TIMEOUT:-60}"; then
         echo -e "${GREEN}VM started successfully!${NC}"
     else
         echo -e "${RED}Failed to start VM.${NC}"
@@ -74,10 +87,10 @@ stop_vm() {
     fi
     
     echo -e "${GREEN}Stopping VM...${NC}"
-    pkill -f "firecracker" || true
+    python3 "$SCRIPT_DIR/vm_teardown.py" --socket "$API_SOCKET" --timeout "${SHUTDOWN_TIMEOUT:-10}" || true
     
     # Clean up socket
-    rm -f /tmp/firecracker.socket
+    rm -f "$API_SOCKET"
     
     echo -e "${GREEN}VM stopped.${NC}"
 }
@@ -125,7 +138,9 @@ rebuild_vm() {
 
 # Function to check VM status
 check_status() {
-    if is_vm_running; then
+    if [ -S "$DAEMON_SOCKET" ]; then
+        python3 "$SCRIPT_DIR/vm_daemon.py" --socket "$DAEMON_SOCKET" list
+    elif is_vm_running; then
         echo -e "${GREEN}VM Status: Running${NC}"
         echo "Process info:"
         ps aux | grep "[f]irecracker"
@@ -134,6 +149,15 @@ check_status() {
     fi
 }
 
+# Function to pause, resume or describe the VM through its API socket
+api_call() {
+    if ! is_vm_running; then
+        echo -e "${YELLOW}No VM is currently running.${NC}"
+        return 1
+    fi
+    $FC_API "$@"
+}
+
 # Main execution
 case "$1" in
     start)
@@ -150,6 +174,15 @@ case "$1" in
     status)
         check_status
         ;;
+    pause)
+        api_call pause
+        ;;
+    resume)
+        api_call resume
+        ;;
+    info)
+        api_call describe
+        ;;
     rebuild)
         rebuild_vm
         ;;
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import fcntl
+import argparse
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any
+
+from firecracker_api import Colors, print_color, FirecrackerClient, FirecrackerAPIError, DEFAULT_API_SOCKET
+from vm_teardown import discover_firecracker
+from vm_hugepages import configured_memory
+from vm_balloon import read_meminfo
+
+DEFAULT_STATE_PATH = os.environ.get("FC_ADMISSION_STATE", "/tmp/firecracker-admission.json")
+
+class AdmissionError(Exception):
+    """Raised when a VM would push the host past its memory budget."""
+
+@dataclass
+class AdmissionPolicy:
+    """
+    Host memory budget for VMs.
+
+    Guest memory may be overcommitted by `overcommit_ratio` (guests rarely
+    touch all of it, and balloons give idle memory back). VMM overhead and
+    the page cache each VM needs for its disk and kernel are real memory
+    and are never overcommitted. `host_reserve_mib` is kept for the host.
+    """
+    overcommit_ratio: float = 1.0
+    host_reserve_mib: int = 1024
+    vmm_overhead_mib: int = 32
+    page_cache_mib: int = 64
+    reservation_ttl: float = 120.0
+
+    @classmethod
+    def from_env(cls) -> "AdmissionPolicy":
+        """Policy from FC_OVERCOMMIT, FC_HOST_RESERVE_MIB, FC_VMM_OVERHEAD_MIB and FC_PAGE_CACHE_MIB."""
+        policy = cls()
+        policy.overcommit_ratio = float(os.environ.get("FC_OVERCOMMIT", policy.overcommit_ratio))
+        policy.host_reserve_mib = int(os.environ.get("FC_HOST_RESERVE_MIB", policy.host_reserve_mib))
+        policy.vmm_overhead_mib = int(os.environ.get("FC_VMM_OVERHEAD_MIB", policy.vmm_overhead_mib))
+        policy.page_cache_mib = int(os.environ.get("FC_PAGE_CACHE_MIB", policy.page_cache_mib))
+        return policy
+
+@dataclass
+class Headroom:
+    """Where the host stands against the budget, in MiB."""
+    host_total_mib: int
+    host_available_mib: int
+    vms: int
+    pending: int
+    committed_guest_mib: int
+    fixed_overhead_mib: int
+    guest_capacity_mib: int
+    headroom_mib: int
+    overcommit_ratio: float
+
+def _config_file(pid: int) -> Optional[str]:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            argv = [a.decode(errors="replace") for a in f.read().split(b"\0")]
+    except OSError:
+        return None
+    for i, arg in enumerate(argv[:-1]):
+        if arg == "--config-file":
+            return argv[i + 1]
+    return None
+
+def _vm_memory(pid: int, api_socket: Optional[str]) -> Optional[int]:
+    """Guest memory of a running firecracker, from its config file or its API."""
+    config = _config_file(pid)
+    if config:
+        try:
+            cwd = os.readlink(f"/proc/{pid}/cwd")
+            with open(os.path.join(cwd, config)) as f:
+                return configured_memory(json.load(f))
+        except (OSError, ValueError):
+            pass
+    if api_socket and os.path.exists(api_socket):
+        try:
+            with FirecrackerClient(api_socket, timeout=1.0) as client:
+                return int(client.get_machine_config()["mem_size_mib"])
+        except (OSError, FirecrackerAPIError, KeyError):
+            pass
+    return None
+
+class AdmissionController:
+    """
+    Decides whether another VM fits in host memory.
+
+    Running VMs are found by scanning for firecracker processes, so VMs
+    started by any tool count. Launches that were admitted but whose VMM
+    is not up yet are held as reservations in a small JSON file guarded by
+    flock, which keeps concurrent launchers (make, the launcher, the
+    daemon, the pool) from all admitting into the same headroom. A
+    reservation disappears once its VM is running, when the process that
+    made it exits, or after `reservation_ttl` seconds.
+    """
+
+    def __init__(self, policy: Optional[AdmissionPolicy] = None, state_path: str = DEFAULT_STATE_PATH):
+        self.policy = policy or AdmissionPolicy.from_env()
+        self.state_path = state_path
+
+    def _running(self) -> Dict[str, int]:
+        running = {}
+        for target in discover_firecracker():
+            mem = _vm_memory(target.pid, target.api_socket)
+            if mem is not None:
+                running[os.path.abspath(target.api_socket) if target.api_socket else str(target.pid)] = mem
+        return running
+
+    def _load(self, running: Dict[str, int]) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.state_path) as f:
+                reservations = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+
+        def live(key: str, r: Dict[str, Any]) -> bool:
+            if key in running or r["expires"] < now:
+                return False
+            return not r.get("owner") or os.path.exists(f"/proc/{r['owner']}")
+
+        return {k: r for k, r in reservations.items() if live(k, r)}
+
+    def _save(self, reservations: Dict[str, Dict[str, Any]]) -> None:
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(reservations, f)
+        os.replace(tmp, self.state_path)
+
+    def _compute(self, running: Dict[str, int], reservations: Dict[str, Dict[str, Any]]) -> Headroom:
+        p = self.policy
+        meminfo = read_meminfo()
+        vms = len(running) + len(reservations)
+        committed = sum(running.values()) + sum(r["mem_mib"] for r in reservations.values())
+        fixed = vms * (p.vmm_overhead_mib + p.page_cache_mib)
+        capacity = int(p.overcommit_ratio * max(0, meminfo["MemTotal"] - p.host_reserve_mib - fixed))
+        return Headroom(
+            host_total_mib=meminfo["MemTotal"],
+            host_available_mib=meminfo["MemAvailable"],
+            vms=len(running),
+            pending=len(reservations),
+            committed_guest_mib=committed,
+            fixed_overhead_mib=fixed,
+            guest_capacity_mib=capacity,
+            headroom_mib=capacity - committed,
+            overcommit_ratio=p.overcommit_ratio
+        )
+
+    def headroom(self) -> Headroom:
+        """Current budget usage, including admitted VMs that are still starting."""
+        running = self._running()
+        return self._compute(running, self._load(running))
+
+    def _fits(self, headroom: Headroom, mem_mib: int) -> Optional[str]:
+        p = self.policy
+        per_vm = p.vmm_overhead_mib + p.page_cache_mib
+        # The next VM's fixed cost shrinks capacity by `ratio` times as much.
+        after = headroom.headroom_mib - mem_mib - int(p.overcommit_ratio * per_vm)
+        if after < 0:
+            return (
+                f"{mem_mib} MiB guest does not fit: headroom {headroom.headroom_mib} MiB "
+                f"({headroom.committed_guest_mib}/{headroom.guest_capacity_mib} MiB committed, "
+                f"overcommit {p.overcommit_ratio:g})"
+            )
+        if headroom.host_available_mib - per_vm < p.host_reserve_mib:
+            return (
+                f"host has only {headroom.host_available_mib} MiB available; "
+                f"{p.host_reserve_mib} MiB is reserved for the host"
+            )
+        return None
+
+    def try_reserve(self, key: str, mem_mib: int, owner: Optional[int] = None) -> Headroom:
+        """
+        Admit one VM or raise, without waiting.
+
+        Args:
+            key: API socket of the VM (how it is recognised once running)
+            mem_mib: Guest memory size
+            owner: PID whose exit cancels the reservation (None: TTL only)
+        Raises:
+            AdmissionError: if the VM does not fit
+        """
+        key = os.path.abspath(key)
+        lock_path = f"{self.state_path}.lock"
+        with open(lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            running = self._running()
+            reservations = self._load(running)
+            reservations.pop(key, None)
+            headroom = self._compute(running, reservations)
+            reason = self._fits(headroom, mem_mib)
+            if reason:
+                self._save(reservations)
+                raise AdmissionError(reason)
+            reservations[key] = {
+                "mem_mib": mem_mib,
+                "owner": owner,
+                "expires": time.time() + self.policy.reservation_ttl
+            }
+            self._save(reservations)
+            return self._compute(running, reservations)
+
+    def reserve(self, key: str, mem_mib: int, owner: Optional[int] = None, wait: bool = False, timeout: float = 300.0) -> Headroom:
+        """
+        Admit one VM; with `wait`, queue until it fits or `timeout` expires.
+
+        Raises:
+            AdmissionError: if the VM does not fit (in time)
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.try_reserve(key, mem_mib, owner)
+            except AdmissionError:
+                if not wait or time.monotonic() >= deadline:
+                    raise
+            time.sleep(1.0)
+
+    def release(self, key: str) -> None:
+        """Drop a reservation, e.g. after the launch failed."""
+        with open(f"{self.state_path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            running = self._running()
+            reservations = self._load(running)
+            if reservations.pop(os.path.abspath(key), None) is not None:
+                self._save(reservations)
+
+def print_headroom(h: Headroom) -> None:
+    color = Colors.OKGREEN if h.headroom_mib > 0 else Colors.WARNING
+    print(f"Host memory:     {h.host_total_mib} MiB total, {h.host_available_mib} MiB available")
+    print(f"VMs:             {h.vms} running, {h.pending} starting")
+    print(f"Guest memory:    {h.committed_guest_mib} of {h.guest_capacity_mib} MiB committed "
+          f"(overcommit {h.overcommit_ratio:g}, {h.fixed_overhead_mib} MiB VMM/page cache)")
+    print_color(f"Headroom:        {h.headroom_mib} MiB", color)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Host memory admission control for Firecracker MicroVMs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    defaults = AdmissionPolicy.from_env()
+    parser.add_argument("--overcommit", type=float, default=defaults.overcommit_ratio, help="Guest memory overcommit ratio (FC_OVERCOMMIT)")
+    parser.add_argument("--host-reserve", type=int, default=defaults.host_reserve_mib, help="MiB kept for the host (FC_HOST_RESERVE_MIB)")
+    parser.add_argument("--vmm-overhead", type=int, default=defaults.vmm_overhead_mib, help="Per-VM VMM overhead in MiB (FC_VMM_OVERHEAD_MIB)")
+    parser.add_argument("--page-cache", type=int, default=defaults.page_cache_mib, help="Per-VM page cache in MiB (FC_PAGE_CACHE_MIB)")
+    parser.add_argument("--state", default=DEFAULT_STATE_PATH, help="Reservation file shared by all launchers")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    status = sub.add_parser("status", help="Show committed memory and headroom")
+    status.add_argument("--json", action="store_true", help="Print as JSON")
+
+    check = sub.add_parser("check", help="Admit one VM before launching it; exit 1 if it does not fit")
+    check.add_argument("--config", default="vm-config.json", help="Firecracker config of the VM")
+    check.add_argument("--mem", type=int, help="Guest memory in MiB (default: from --config)")
+    check.add_argument("--socket", default=DEFAULT_API_SOCKET, help="API socket the VM will use")
+    check.add_argument("--queue", action="store_true", help="Wait for headroom instead of failing")
+    check.add_argument("--timeout", type=float, default=300.0, help="Seconds to wait with --queue")
+
+    release = sub.add_parser("release", help="Cancel the reservation for a socket")
+    release.add_argument("--socket", default=DEFAULT_API_SOCKET, help="API socket of the VM")
+
+    args = parser.parse_args()
+    policy = AdmissionPolicy(args.overcommit, args.host_reserve, args.vmm_overhead, args.page_cache)
+    controller = AdmissionController(policy, args.state)
+
+    if args.command == "status":
+        headroom = controller.headroom()
+        if args.json:
+            print(json.dumps(asdict(headroom), indent=2))
+        else:
+            print_headroom(headroom)
+    elif args.command == "check":
+        mem = args.mem
+        if mem is None:
+            with open(args.config) as f:
+                mem = configured_memory(json.load(f))
+        try:
+            headroom = controller.reserve(args.socket, mem, wait=args.queue, timeout=args.timeout)
+        except AdmissionError as e:
+            print_color(f"Launch refused: {e}", Colors.FAIL)
+            sys.exit(1)
+        print_color(f"Admitted {mem} MiB guest; headroom now {headroom.headroom_mib} MiB", Colors.OKGREEN)
+    elif args.command == "release":
+        controller.release(args.socket)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List
+
+from firecracker_api import Colors, print_color, FirecrackerClient, FirecrackerAPIError, DEFAULT_API_SOCKET
+from vm_teardown import TeardownTarget, discover_firecracker
+
+PSI_MEMORY = "/proc/pressure/memory"
+MIB = 1024 * 1024
+
+def read_pressure(path: str = PSI_MEMORY) -> Dict[str, float]:
+    """
+    Host memory pressure from PSI, as percentages.
+
+    Returns:
+        dict: {"some": avg10, "full": avg10}; zeros when PSI is unavailable
+    """
+    pressure = {"some": 0.0, "full": 0.0}
+    try:
+        with open(path) as f:
+            for line in f:
+                kind, *fields = line.split()
+                values = dict(field.split("=", 1) for field in fields)
+                pressure[kind] = float(values.get("avg10", 0.0))
+    except (OSError, ValueError):
+        pass
+    return pressure
+
+def read_meminfo() -> Dict[str, int]:
+    """/proc/meminfo in MiB."""
+    info = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            info[key] = int(value.split()[0]) // 1024
+    return info
+
+def process_rss_mib(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return 0
+
+@dataclass
+class BalloonPolicy:
+    """
+    How much memory to take back from each guest.
+
+    The balloon is sized so the guest keeps `target_free_mib` of available
+    memory. When the host's PSI "some" pressure crosses `pressure_high`
+    the target drops to `pressure_free_mib`, squeezing guests harder. A
+    guest is never left with less than `min_guest_mib`, and the balloon
+    moves at most `step_mib` per tick so the guest can keep up.
+    """
+    target_free_mib: int = 256
+    pressure_free_mib: int = 64
+    min_guest_mib: int = 256
+    step_mib: int = 128
+    hysteresis_mib: int = 32
+    pressure_high: float = 10.0
+
+    def target(self, stats: Dict[str, Any], mem_size_mib: int, pressure: float) -> int:
+        """New balloon size in MiB for a guest reporting `stats`."""
+        current = int(stats.get("target_mib", 0))
+        available = stats.get("available_memory", stats.get("free_memory"))
+        if available is None:
+            return current
+        goal = self.pressure_free_mib if pressure >= self.pressure_high else self.target_free_mib
+        excess = available // MIB - goal
+        if abs(excess) < self.hysteresis_mib:
+            return current
+        delta = max(-self.step_mib, min(self.step_mib, excess))
+        return max(0, min(mem_size_mib - self.min_guest_mib, current + delta))
+
+    def settled(self, stats: Dict[str, Any], mem_size_mib: int) -> int:
+        """Balloon size the policy converges to if the guest's usage stays as it is now."""
+        available = stats.get("available_memory", stats.get("free_memory"))
+        current = int(stats.get("actual_mib", 0))
+        if available is None:
+            return current
+        return max(0, min(mem_size_mib - self.min_guest_mib, current + available // MIB - self.target_free_mib))
+
+class BalloonAutoscaler:
+    """
+    Periodically resizes the balloon of every running VM according to a policy.
+
+    Each tick reads host memory pressure once, then fetches balloon
+    statistics from all VMs concurrently and PATCHes the balloons whose
+    target changed. VMs started without a balloon device are skipped.
+    With `apply=False` it only samples and reports what it would do.
+    """
+
+    def __init__(
+        self,
+        policy: BalloonPolicy,
+        interval: float = 5.0,
+        sockets: Optional[List[str]] = None,
+        apply: bool = True
+    ):
+        self.policy = policy
+        self.interval = interval
+        self.sockets = sockets
+        self.apply = apply
+        self._mem_size: Dict[str, int] = {}
+        self.last: Dict[str, Dict[str, Any]] = {}
+
+    def _targets(self) -> List[TeardownTarget]:
+        if self.sockets:
+            return [TeardownTarget(pid=0, name=os.path.basename(os.path.dirname(os.path.abspath(s))) or s, api_socket=s)
+                    for s in self.sockets]
+        return [t for t in discover_firecracker() if t.api_socket]
+
+    def _scale_one(self, target: TeardownTarget, pressure: float) -> Dict[str, Any]:
+        decision: Dict[str, Any] = {"vm": target.name, "api_socket": target.api_socket, "pid": target.pid}
+        try:
+            with FirecrackerClient(target.api_socket, timeout=2.0) as client:
+                if target.api_socket not in self._mem_size:
+                    self._mem_size[target.api_socket] = int(client.get_machine_config()["mem_size_mib"])
+                mem_size = self._mem_size[target.api_socket]
+                stats = client.get_balloon_stats()
+                new_target = self.policy.target(stats, mem_size, pressure)
+                if self.apply and new_target != stats.get("target_mib"):
+                    client.patch_balloon(new_target)
+        except (OSError, FirecrackerAPIError, KeyError) as e:
+            decision["error"] = getattr(e, "fault", None) or str(e)
+            return decision
+        decision.update({
+            "mem_size_mib": mem_size,
+            "available_mib": stats.get("available_memory", 0) // MIB,
+            "balloon_mib": stats.get("actual_mib", 0),
+            "target_mib": new_target,
+            "previous_target_mib": stats.get("target_mib", 0),
+            "settled_mib": self.policy.settled(stats, mem_size)
+        })
+        return decision
+
+    async def tick(self) -> Dict[str, Any]:
+        pressure = read_pressure()
+        decisions = await asyncio.gather(
+            *(asyncio.to_thread(self._scale_one, t, pressure["some"]) for t in self._targets())
+        )
+        self.last = {d["vm"]: d for d in decisions}
+        return {"ts": time.time(), "pressure": pressure, "vms": decisions}
+
+    async def run(self, iterations: int = 0, quiet: bool = False) -> None:
+        done = 0
+        while not iterations or done < iterations:
+            report = await self.tick()
+            if not quiet:
+                print_tick(report)
+            done += 1
+            if not iterations or done < iterations:
+                await asyncio.sleep(self.interval)
+
+def print_tick(report: Dict[str, Any]) -> None:
+    pressure = report["pressure"]
+    print_color(
+        f"{time.strftime('%H:%M:%S')} host PSI some {pressure['some']:.1f}% full {pressure['full']:.1f}%",
+        Colors.HEADER
+    )
+    for d in report["vms"]:
+        if "error" in d:
+            print(f"  {d['vm']:<12} skipped: {d['error']}")
+            continue
+        change = d["target_mib"] - d["previous_target_mib"]
+        arrow = "inflate" if change > 0 else "deflate" if change < 0 else "hold"
+        print(f"  {d['vm']:<12} mem {d['mem_size_mib']:>6} MiB  available {d['available_mib']:>6} MiB  "
+              f"balloon {d['balloon_mib']:>6} -> {d['target_mib']:<6} MiB  {arrow}")
+
+def density_report(
+    decisions: List[Dict[str, Any]],
+    host_mem_mib: Optional[int] = None,
+    host_reserve_mib: int = 1024,
+    vmm_overhead_mib: int = 32,
+    mem_size_mib: Optional[int] = None,
+    reclaim_mib: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    How many VMs fit on the host with and without ballooning.
+
+    Without a balloon every VM eventually costs its full `mem_size_mib`;
+    with the policy it costs what is left after the balloon reclaimed
+    memory. The reclaimed amount is the average balloon size the policy
+    settles at on the running VMs unless `reclaim_mib` overrides it.
+    """
+    live = [d for d in decisions if "error" not in d]
+    host_mem = host_mem_mib or read_meminfo()["MemTotal"]
+    if mem_size_mib is None:
+        mem_size_mib = round(sum(d["mem_size_mib"] for d in live) / len(live)) if live else 1024
+    if reclaim_mib is None:
+        reclaim_mib = sum(d["settled_mib"] for d in live) / len(live) if live else 0.0
+    usable = max(0, host_mem - host_reserve_mib)
+
+    per_vm_static = mem_size_mib + vmm_overhead_mib
+    per_vm_ballooned = max(1.0, mem_size_mib - reclaim_mib + vmm_overhead_mib)
+    static = int(usable // per_vm_static)
+    ballooned = int(usable // per_vm_ballooned)
+    return {
+        "host_mem_mib": host_mem,
+        "host_reserve_mib": host_reserve_mib,
+        "vms_observed": len(live),
+        "mem_size_mib": mem_size_mib,
+        "vmm_overhead_mib": vmm_overhead_mib,
+        "avg_reclaim_mib": round(reclaim_mib, 1),
+        "observed_rss_mib": sum(process_rss_mib(d["pid"]) for d in live if d.get("pid")),
+        "vms_without_balloon": static,
+        "vms_with_balloon": ballooned,
+        "extra_vms": ballooned - static,
+        "extra_pct": round((ballooned - static) / static * 100, 1) if static else None
+    }
+
+def print_density(report: Dict[str, Any]) -> None:
+    print_color(
+        f"Host {report['host_mem_mib']} MiB (minus {report['host_reserve_mib']} MiB reserve), "
+        f"{report['mem_size_mib']} MiB guests + {report['vmm_overhead_mib']} MiB VMM overhead",
+        Colors.HEADER
+    )
+    print(f"Observed {report['vms_observed']} VM(s), average balloon {report['avg_reclaim_mib']} MiB, "
+          f"firecracker RSS {report['observed_rss_mib']} MiB")
+    print(f"Without ballooning: {report['vms_without_balloon']} VMs")
+    print(f"With ballooning:    {report['vms_with_balloon']} VMs")
+    extra = f" ({report['extra_pct']:+.1f}%)" if report["extra_pct"] is not None else ""
+    print_color(f"The policy buys {report['extra_vms']} extra VM(s){extra}", Colors.OKGREEN)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Reclaim idle guest memory by resizing Firecracker balloons",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--socket", action="append", default=[], help="Manage only this API socket (repeatable, default: all VMs)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def policy_args(p):
+        p.add_argument("--target-free", type=int, default=256, help="Available memory (MiB) to leave in each guest")
+        p.add_argument("--pressure-free", type=int, default=64, help="Available memory to leave under host pressure")
+        p.add_argument("--min-guest", type=int, default=256, help="Never shrink a guest below this many MiB")
+        p.add_argument("--step", type=int, default=128, help="Largest balloon change per tick in MiB")
+        p.add_argument("--pressure-high", type=float, default=10.0, help="Host PSI some avg10 (%%) that counts as pressure")
+
+    run = sub.add_parser("run", help="Run the autoscaler")
+    policy_args(run)
+    run.add_argument("--interval", type=float, default=5.0, help="Seconds between ticks")
+    run.add_argument("--iterations", type=int, default=0, help="Stop after this many ticks (0 = forever)")
+
+    sub.add_parser("stats", help="Show balloon statistics of each VM")
+
+    set_cmd = sub.add_parser("set", help="Set the balloon of the VMs selected with --socket")
+    set_cmd.add_argument("amount_mib", type=int, help="Balloon size in MiB")
+
+    density = sub.add_parser("density", help="Report how many extra VMs ballooning fits on this host")
+    density.add_argument("--host-mem", type=int, help="Host memory in MiB (default: MemTotal)")
+    density.add_argument("--host-reserve", type=int, default=1024, help="MiB kept for the host itself")
+    density.add_argument("--vmm-overhead", type=int, default=32, help="Per-VM VMM overhead in MiB")
+    density.add_argument("--mem", type=int, help="Guest memory in MiB (default: average of running VMs)")
+    density.add_argument("--reclaim", type=float, help="Balloon size per VM in MiB (default: observed average)")
+    density.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        policy = BalloonPolicy(args.target_free, args.pressure_free, args.min_guest, args.step, pressure_high=args.pressure_high)
+        scaler = BalloonAutoscaler(policy, args.interval, args.socket or None)
+        try:
+            asyncio.run(scaler.run(args.iterations))
+        except KeyboardInterrupt:
+            pass
+    elif args.command == "stats":
+        sockets = args.socket or [t.api_socket for t in discover_firecracker() if t.api_socket]
+        for path in sockets:
+            try:
+                with FirecrackerClient(path, timeout=2.0) as client:
+                    print_color(path, Colors.HEADER)
+                    print(json.dumps(client.get_balloon_stats(), indent=2))
+            except (OSError, FirecrackerAPIError) as e:
+                print_color(f"{path}: {getattr(e, 'fault', None) or e}", Colors.WARNING)
+    elif args.command == "set":
+        for path in args.socket or [DEFAULT_API_SOCKET]:
+            try:
+                with FirecrackerClient(path) as client:
+                    client.patch_balloon(args.amount_mib)
+                print_color(f"{path}: balloon set to {args.amount_mib} MiB", Colors.OKGREEN)
+            except (OSError, FirecrackerAPIError) as e:
+                print_color(f"Error: {path}: {getattr(e, 'fault', None) or e}", Colors.FAIL)
+                sys.exit(1)
+    elif args.command == "density":
+        sampler = BalloonAutoscaler(BalloonPolicy(), sockets=args.socket or None, apply=False)
+        tick = asyncio.run(sampler.tick())
+        report = density_report(tick["vms"], args.host_mem, args.host_reserve, args.vmm_overhead, args.mem, args.reclaim)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_density(report)
+
+if __name__ == "__main__":
+    main()
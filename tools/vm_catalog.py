@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import fcntl
+import sqlite3
+import argparse
+import threading
+import contextlib
+from dataclasses import dataclass, asdict, fields
+from typing import Optional, Dict, Any, List, Iterable, Iterator, Tuple
+
+from firecracker_api import Colors, print_color
+
+DEFAULT_CATALOG = os.environ.get("FC_SNAPSHOT_CATALOG", os.path.join("snapshots", "catalog.db"))
+
+# Reference counts of kernels and captured root disks follow the snapshot
+# rows through triggers. Chunk counts are maintained by the callers, which
+# read the recipes anyway; a row per (snapshot, chunk) would not scale.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id TEXT PRIMARY KEY,
+    chain TEXT NOT NULL,
+    layer INTEGER NOT NULL,
+    parent TEXT,
+    kind TEXT NOT NULL,
+    profile TEXT,
+    kernel TEXT,
+    rootfs TEXT,
+    mem_size INTEGER NOT NULL DEFAULT 0,
+    bytes_written INTEGER NOT NULL DEFAULT 0,
+    disk_bytes INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    recipe TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_chain ON snapshots (chain, layer);
+CREATE INDEX IF NOT EXISTS snapshots_created ON snapshots (created_at);
+CREATE INDEX IF NOT EXISTS snapshots_profile ON snapshots (profile, created_at);
+CREATE INDEX IF NOT EXISTS snapshots_kernel ON snapshots (kernel);
+CREATE INDEX IF NOT EXISTS snapshots_rootfs ON snapshots (rootfs);
+CREATE INDEX IF NOT EXISTS snapshots_parent ON snapshots (parent);
+
+CREATE TABLE IF NOT EXISTS artifacts (
+    hash TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    path TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    refs INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS artifacts_unreferenced ON artifacts (hash) WHERE refs <= 0;
+
+CREATE TABLE IF NOT EXISTS chunks (
+    digest TEXT PRIMARY KEY,
+    refs INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS chunks_unreferenced ON chunks (digest) WHERE refs <= 0;
+
+CREATE TRIGGER IF NOT EXISTS snapshots_ref AFTER INSERT ON snapshots BEGIN
+    UPDATE artifacts SET refs = refs + 1 WHERE hash IN (NEW.kernel, NEW.rootfs);
+END;
+CREATE TRIGGER IF NOT EXISTS snapshots_unref AFTER DELETE ON snapshots BEGIN
+    UPDATE artifacts SET refs = refs - 1 WHERE hash IN (OLD.kernel, OLD.rootfs);
+END;
+"""
+
+class CatalogError(Exception):
+    pass
+
+@dataclass
+class SnapshotRecord:
+    """One catalogued snapshot; `id` is "<chain>/<layer>"."""
+    id: str
+    chain: str
+    layer: int
+    parent: Optional[str]
+    kind: str
+    profile: Optional[str]
+    kernel: Optional[str]
+    rootfs: Optional[str]
+    mem_size: int
+    bytes_written: int
+    disk_bytes: int
+    created_at: float
+    recipe: Optional[str] = None
+
+COLUMNS = [f.name for f in fields(SnapshotRecord)]
+
+class Catalog:
+    """
+    SQLite index of every snapshot and the artifacts they share.
+
+    Chain manifests stay the source of truth for restoring; the catalog
+    answers queries across all chains without reading them and tracks
+    which kernels, root disks and store chunks are still referenced.
+    Each thread gets its own connection, so one catalog can be shared by
+    background snapshot workers.
+    """
+
+    def __init__(self, path: str = DEFAULT_CATALOG):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = sqlite3.connect(
+                self.path, timeout=30.0, isolation_level=None, check_same_thread=False
+            )
+            db.row_factory = sqlite3.Row
+            db.execute("PRAGMA synchronous=NORMAL")
+            with self._connections_lock:
+                self._connections.append(db)
+        return db
+
+    def close(self) -> None:
+        with self._connections_lock:
+            for db in self._connections:
+                db.close()
+            self._connections = []
+            self._local = threading.local()
+
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.db
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        """
+        Serialise writers to the chunk store against garbage collection.
+
+        Archiving can reuse a chunk whose count just dropped to zero, so a
+        sweep must not run between the store write and the count update.
+        """
+        with open(f"{self.path}.lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def add_artifact(self, digest: str, kind: str, path: Optional[str], size: int) -> None:
+        self.db.execute(
+            "INSERT INTO artifacts (hash, kind, path, size) VALUES (?, ?, ?, ?) ON CONFLICT (hash) DO NOTHING",
+            (digest, kind, path, size)
+        )
+
+    def ref_chunks(self, digests: Iterable[Optional[str]], delta: int = 1) -> None:
+        self.db.executemany(
+            "INSERT INTO chunks (digest, refs) VALUES (?, ?) ON CONFLICT (digest) DO UPDATE SET refs = refs + excluded.refs",
+            ((digest, delta) for digest in set(digests) if digest)
+        )
+
+    def add(self, record: SnapshotRecord, chunks: Iterable[Optional[str]] = ()) -> None:
+        """Insert a snapshot, counting a reference to its artifacts and recipe chunks."""
+        with self.transaction():
+            self.db.execute(
+                f"INSERT INTO snapshots ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [getattr(record, c) for c in COLUMNS]
+            )
+            self.ref_chunks(chunks, 1)
+
+    def update(self, snapshot_id: str, **values: Any) -> None:
+        """Change descriptive columns of a snapshot (not its artifacts)."""
+        if not values:
+            return
+        if set(values) & {"id", "kernel", "rootfs", "recipe"}:
+            raise CatalogError("use set_recipe, or remove and add, to change a snapshot's artifacts")
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        self.db.execute(f"UPDATE snapshots SET {assignments} WHERE id = ?", [*values.values(), snapshot_id])
+
+    def set_recipe(self, snapshot_id: str, recipe: str, chunks: Iterable[Optional[str]]) -> None:
+        """Record that a snapshot's memory was archived, referencing its chunks."""
+        with self.transaction():
+            if self.db.execute("UPDATE snapshots SET recipe = ? WHERE id = ? AND recipe IS NULL", (recipe, snapshot_id)).rowcount:
+                self.ref_chunks(chunks, 1)
+
+    def remove(self, snapshot_id: str, chunks: Iterable[Optional[str]] = ()) -> None:
+        """Delete a snapshot, dropping its references; `chunks` are those of its recipe."""
+        with self.transaction():
+            if self.db.execute("DELETE FROM snapshots WHERE id = ?", (snapshot_id,)).rowcount:
+                self.ref_chunks(chunks, -1)
+
+    def get(self, snapshot_id: str) -> SnapshotRecord:
+        row = self.db.execute("SELECT * FROM snapshots WHERE id = ?", (snapshot_id,)).fetchone()
+        if row is None:
+            raise CatalogError(f"no snapshot {snapshot_id!r} in {self.path}")
+        return SnapshotRecord(**dict(row))
+
+    def query(
+        self,
+        chain: Optional[str] = None,
+        profile: Optional[str] = None,
+        kernel: Optional[str] = None,
+        rootfs: Optional[str] = None,
+        since: Optional[float] = None,
+        before: Optional[float] = None,
+        limit: Optional[int] = None
+    ) -> List[SnapshotRecord]:
+        """Snapshots matching every given filter, newest first. Hash filters accept a prefix."""
+        where, params = [], []
+        for column, value in (("chain", chain), ("profile", profile)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        for column, value in (("kernel", kernel), ("rootfs", rootfs)):
+            if value is not None:
+                where.append(f"{column} >= ? AND {column} < ?")
+                params += [value, value + "\uffff"]
+        if since is not None:
+            where.append("created_at >= ?")
+            params.append(since)
+        if before is not None:
+            where.append("created_at < ?")
+            params.append(before)
+        sql = "SELECT * FROM snapshots"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return [SnapshotRecord(**dict(row)) for row in self.db.execute(sql, params)]
+
+    def chains(self) -> List[Tuple[str, int, float]]:
+        """(chain, layers, newest created_at) for every chain, most recently used first."""
+        return [
+            (row[0], row[1], row[2]) for row in self.db.execute(
+                "SELECT chain, COUNT(*), MAX(created_at) AS newest FROM snapshots GROUP BY chain ORDER BY newest DESC"
+            )
+        ]
+
+    def chain_ids(self, chain: str) -> List[str]:
+        return [row[0] for row in self.db.execute("SELECT id FROM snapshots WHERE chain = ? ORDER BY layer", (chain,))]
+
+    def unreferenced_chunks(self) -> List[str]:
+        return [row[0] for row in self.db.execute("SELECT digest FROM chunks WHERE refs <= 0")]
+
+    def unreferenced_artifacts(self) -> List[Dict[str, Any]]:
+        return [dict(row) for row in self.db.execute("SELECT * FROM artifacts WHERE refs <= 0")]
+
+    def forget_chunks(self, digests: List[str]) -> None:
+        with self.transaction():
+            self.db.executemany("DELETE FROM chunks WHERE digest = ? AND refs <= 0", ((d,) for d in digests))
+
+    def forget_artifacts(self, hashes: List[str]) -> None:
+        with self.transaction():
+            self.db.executemany("DELETE FROM artifacts WHERE hash = ? AND refs <= 0", ((h,) for h in hashes))
+
+    def known_chunks(self) -> Iterator[str]:
+        for row in self.db.execute("SELECT digest FROM chunks"):
+            yield row[0]
+
+    def clear(self) -> None:
+        """Forget everything, before rebuilding from the chains on disk."""
+        with self.transaction():
+            for table in ("snapshots", "artifacts", "chunks"):
+                self.db.execute(f"DELETE FROM {table}")
+
+    def stats(self) -> Dict[str, Any]:
+        snapshots = self.db.execute(
+            "SELECT COUNT(*), COUNT(DISTINCT chain), COALESCE(SUM(bytes_written), 0), COALESCE(SUM(disk_bytes), 0), "
+            "COUNT(recipe) FROM snapshots"
+        ).fetchone()
+        artifacts = {
+            row[0]: {"count": row[1], "bytes": row[2], "unreferenced": row[3]}
+            for row in self.db.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0), SUM(refs <= 0) FROM artifacts GROUP BY kind"
+            )
+        }
+        chunks = self.db.execute("SELECT COUNT(*), COALESCE(SUM(refs <= 0), 0) FROM chunks").fetchone()
+        return {
+            "snapshots": snapshots[0],
+            "chains": snapshots[1],
+            "memory_bytes": snapshots[2],
+            "disk_bytes": snapshots[3],
+            "archived": snapshots[4],
+            "artifacts": artifacts,
+            "chunks": chunks[0],
+            "unreferenced_chunks": chunks[1]
+        }
+
+def print_records(records: List[SnapshotRecord]) -> None:
+    print(f"{'snapshot':<24} {'kind':<5} {'created':<19} {'profile':<16} {'kernel':<12} {'rootfs':<12} {'memory':>10} {'disks':>10}")
+    for r in records:
+        print(
+            f"{r.id:<24} {r.kind:<5} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r.created_at))} "
+            f"{r.profile or '-':<16} {(r.kernel or '-')[:12]:<12} {(r.rootfs or '-')[:12]:<12} "
+            f"{r.bytes_written / 1048576:7.1f} MiB {r.disk_bytes / 1048576:6.1f} MiB" + ("  archived" if r.recipe else "")
+        )
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Query the snapshot catalog",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--catalog", default=DEFAULT_CATALOG, help="Catalog database")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ls = sub.add_parser("list", help="List snapshots, newest first")
+    ls.add_argument("--chain", help="Only this chain")
+    ls.add_argument("--profile", help="Only this VM profile (e.g. 2vcpu-1024mib)")
+    ls.add_argument("--kernel", help="Only snapshots of this kernel (hash prefix)")
+    ls.add_argument("--rootfs", help="Only snapshots of this root disk (hash prefix)")
+    ls.add_argument("--since-hours", type=float, help="Only snapshots taken in the last N hours")
+    ls.add_argument("--limit", type=int, default=50, help="At most this many rows (0 = all)")
+    ls.add_argument("--json", action="store_true", help="Print JSON")
+
+    show = sub.add_parser("show", help="Print one snapshot")
+    show.add_argument("id", help="Snapshot id (<chain>/<layer>)")
+
+    sub.add_parser("chains", help="List chains, most recently used first")
+    sub.add_parser("stats", help="Totals and unreferenced artifacts")
+
+    args = parser.parse_args()
+
+    try:
+        catalog = Catalog(args.catalog)
+        if args.command == "list":
+            records = catalog.query(
+                chain=args.chain, profile=args.profile, kernel=args.kernel, rootfs=args.rootfs,
+                since=time.time() - args.since_hours * 3600 if args.since_hours else None, limit=args.limit
+            )
+            if args.json:
+                print(json.dumps([asdict(r) for r in records], indent=2))
+            else:
+                print_records(records)
+        elif args.command == "show":
+            print(json.dumps(asdict(catalog.get(args.id)), indent=2))
+        elif args.command == "chains":
+            for chain, layers, newest in catalog.chains():
+                print(f"{chain:<24} {layers:>5} layer(s)  newest {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(newest))}")
+        elif args.command == "stats":
+            print(json.dumps(catalog.stats(), indent=2))
+    except CatalogError as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+    except (OSError, sqlite3.Error) as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import ctypes
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any, List, Iterator
+
+from firecracker_api import Colors, print_color
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_STORE = os.environ.get("FC_CHUNK_STORE", os.path.join("snapshots", ".store"))
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_WORKERS = os.cpu_count() or 4
+# Every object starts with one byte naming its codec, so stores written with
+# and without the zstandard module can be mixed.
+CODEC_TAGS = {"zstd": b"Z", "zlib": b"z", "none": b"-"}
+DEFAULT_CODEC = "zstd" if zstandard else "zlib"
+
+class ChunkStoreError(Exception):
+    pass
+
+@dataclass
+class Recipe:
+    """How to rebuild one file from the store; `None` entries are all-zero chunks."""
+    name: str
+    size: int
+    chunk_size: int
+    chunks: List[Optional[str]]
+
+@dataclass
+class PutStats:
+    name: str
+    size: int
+    chunks: int
+    zero_chunks: int
+    new_chunks: int
+    new_bytes: int
+    elapsed_s: float
+
+@dataclass
+class StoreReport:
+    recipes: int
+    logical_bytes: int
+    zero_bytes: int
+    referenced_bytes: int
+    unique_raw_bytes: int
+    stored_bytes: int
+    objects: int
+
+    @property
+    def dedup_ratio(self) -> float:
+        return self.referenced_bytes / self.unique_raw_bytes if self.unique_raw_bytes else 1.0
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.unique_raw_bytes / self.stored_bytes if self.stored_bytes else 1.0
+
+    @property
+    def total_ratio(self) -> float:
+        return self.logical_bytes / self.stored_bytes if self.stored_bytes else 1.0
+
+_local = threading.local()
+
+def _compress(data: bytes, codec: str, level: int) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise ChunkStoreError("zstd needs the zstandard module (pip install zstandard)")
+        if getattr(_local, "zstd_level", None) != level:
+            _local.zstd = zstandard.ZstdCompressor(level=level)
+            _local.zstd_level = level
+        return CODEC_TAGS[codec] + _local.zstd.compress(data)
+    if codec == "zlib":
+        return CODEC_TAGS[codec] + zlib.compress(data, min(level, 9))
+    return CODEC_TAGS[codec] + data
+
+def _decompress(blob: bytes) -> bytes:
+    tag, payload = blob[:1], blob[1:]
+    if tag == CODEC_TAGS["zstd"]:
+        if zstandard is None:
+            raise ChunkStoreError("chunk is zstd-compressed but the zstandard module is not installed")
+        if not hasattr(_local, "unzstd"):
+            _local.unzstd = zstandard.ZstdDecompressor()
+        return _local.unzstd.decompress(payload)
+    if tag == CODEC_TAGS["zlib"]:
+        return zlib.decompress(payload)
+    return payload
+
+class ChunkStore:
+    """
+    Content-addressed store for snapshot memory files.
+
+    Files are cut into fixed-size chunks. All-zero chunks are not stored
+    at all; every other chunk is stored once under its SHA-256, compressed,
+    no matter how many snapshots contain it. A recipe per file lists the
+    chunk hashes in order. Writes are rename-atomic, so several writers can
+    share one store.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE):
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.join(self.path, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.path, "recipes"), exist_ok=True)
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.path, "objects", digest[:2], digest[2:])
+
+    def recipe_path(self, name: str) -> str:
+        return os.path.join(self.path, "recipes", name.replace("/", "%") + ".json")
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.object_path(digest))
+
+    def put_object(self, digest: str, blob: bytes, verify: bool = False) -> bool:
+        """
+        Store a compressed chunk unless it is already present; returns True if written.
+
+        With `verify` the chunk is decompressed and its hash checked first,
+        for objects that arrive from another host.
+        """
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            return False
+        if verify and hashlib.sha256(_decompress(blob)).hexdigest() != digest:
+            raise ChunkStoreError(f"chunk {digest} does not match its contents")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(blob)
+        os.replace(tmp, path)
+        return True
+
+    def read_object(self, digest: str) -> bytes:
+        """The stored (compressed) form of a chunk."""
+        try:
+            with open(self.object_path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise ChunkStoreError(f"chunk {digest} is missing from {self.path}")
+
+    def read_chunk(self, digest: str) -> bytes:
+        try:
+            with open(self.object_path(digest), "rb") as f:
+                return _decompress(f.read())
+        except FileNotFoundError:
+            raise ChunkStoreError(f"chunk {digest} is missing from {self.path}")
+
+    def put_file(
+        self,
+        path: str,
+        name: str,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        workers: int = DEFAULT_WORKERS,
+        codec: str = DEFAULT_CODEC,
+        level: int = 3
+    ) -> PutStats:
+        """
+        Add a file to the store as recipe `name`.
+
+        Chunks are hashed and compressed on `workers` threads (hashlib, zlib
+        and zstandard release the GIL). Holes of sparse files are skipped
+        without being read.
+        """
+        start = time.monotonic()
+        size = os.path.getsize(path)
+        zero = bytes(chunk_size)
+        counts = {"zero": 0, "new": 0, "new_bytes": 0}
+        lock = threading.Lock()
+        fd = os.open(path, os.O_RDONLY)
+
+        def chunk(index: int) -> Optional[str]:
+            offset = index * chunk_size
+            try:
+                in_hole = os.lseek(fd, offset, os.SEEK_DATA) >= offset + chunk_size
+            except OSError:
+                in_hole = True
+            data = b"" if in_hole else os.pread(fd, chunk_size, offset)
+            if in_hole or data == zero[:len(data)]:
+                with lock:
+                    counts["zero"] += 1
+                return None
+            digest = hashlib.sha256(data).hexdigest()
+            if not self.has(digest):
+                blob = _compress(data, codec, level)
+                if self.put_object(digest, blob):
+                    with lock:
+                        counts["new"] += 1
+                        counts["new_bytes"] += len(blob)
+            return digest
+
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                chunks = list(pool.map(chunk, range((size + chunk_size - 1) // chunk_size)))
+        finally:
+            os.close(fd)
+        self.save_recipe(Recipe(name=name, size=size, chunk_size=chunk_size, chunks=chunks))
+        return PutStats(
+            name=name,
+            size=size,
+            chunks=len(chunks),
+            zero_chunks=counts["zero"],
+            new_chunks=counts["new"],
+            new_bytes=counts["new_bytes"],
+            elapsed_s=time.monotonic() - start
+        )
+
+    def save_recipe(self, recipe: Recipe) -> None:
+        path = self.recipe_path(recipe.name)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(asdict(recipe), f)
+        os.replace(tmp, path)
+
+    def recipe(self, name: str) -> Recipe:
+        try:
+            with open(self.recipe_path(name)) as f:
+                return Recipe(**json.load(f))
+        except FileNotFoundError:
+            raise ChunkStoreError(f"no recipe {name!r} in {self.path}")
+
+    def recipes(self) -> List[str]:
+        return sorted(
+            f[:-len(".json")].replace("%", "/")
+            for f in os.listdir(os.path.join(self.path, "recipes")) if f.endswith(".json")
+        )
+
+    def remove(self, name: str) -> None:
+        """Drop a recipe; its chunks stay until garbage collection."""
+        try:
+            os.unlink(self.recipe_path(name))
+        except FileNotFoundError:
+            raise ChunkStoreError(f"no recipe {name!r} in {self.path}")
+
+    def open(self, name: str, cache_chunks: int = 64) -> "ChunkReader":
+        return ChunkReader(self, self.recipe(name), cache_chunks)
+
+    def restore_file(self, name: str, dest: str, workers: int = DEFAULT_WORKERS) -> float:
+        """
+        Rebuild recipe `name` at `dest`, decompressing on `workers` threads.
+
+        Zero chunks become holes. Returns the elapsed seconds.
+        """
+        start = time.monotonic()
+        recipe = self.recipe(name)
+        tmp = f"{dest}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, recipe.size)
+
+            def write(index: int) -> None:
+                digest = recipe.chunks[index]
+                if digest is not None:
+                    os.pwrite(fd, self.read_chunk(digest), index * recipe.chunk_size)
+
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                list(pool.map(write, range(len(recipe.chunks))))
+        finally:
+            os.close(fd)
+        os.replace(tmp, dest)
+        return time.monotonic() - start
+
+    def objects(self) -> Iterator[str]:
+        root = os.path.join(self.path, "objects")
+        for prefix in os.listdir(root):
+            for rest in os.listdir(os.path.join(root, prefix)):
+                if not rest.endswith(".tmp"):
+                    yield prefix + rest
+
+    def report(self) -> StoreReport:
+        """Logical size of all recipes against what the store actually holds."""
+        logical = zero = referenced = 0
+        chunk_sizes: Dict[str, int] = {}
+        names = self.recipes()
+        for name in names:
+            recipe = self.recipe(name)
+            logical += recipe.size
+            for index, digest in enumerate(recipe.chunks):
+                length = min(recipe.chunk_size, recipe.size - index * recipe.chunk_size)
+                if digest is None:
+                    zero += length
+                else:
+                    referenced += length
+                    chunk_sizes[digest] = length
+        stored = objects = 0
+        for digest in self.objects():
+            stored += os.path.getsize(self.object_path(digest))
+            objects += 1
+        return StoreReport(
+            recipes=len(names),
+            logical_bytes=logical,
+            zero_bytes=zero,
+            referenced_bytes=referenced,
+            unique_raw_bytes=sum(chunk_sizes.values()),
+            stored_bytes=stored,
+            objects=objects
+        )
+
+class ChunkReader(io.RawIOBase):
+    """
+    Seekable, read-only stream over a recipe, decompressing chunks on demand.
+
+    Besides the file interface it offers `locate`/`limit`, which is what the
+    UFFD page server needs to copy pages straight out of decompressed chunks.
+    """
+
+    def __init__(self, store: ChunkStore, recipe: Recipe, cache_chunks: int = 64):
+        super().__init__()
+        self.store = store
+        self.recipe = recipe
+        self.size = recipe.size
+        self.chunk_size = recipe.chunk_size
+        self._pos = 0
+        self._cache: Dict[int, Optional[Any]] = {}
+        self._order: List[int] = []
+        self._cache_chunks = cache_chunks
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self.size}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def _buffer(self, index: int):
+        if index not in self._cache:
+            digest = self.recipe.chunks[index]
+            self._cache[index] = None if digest is None else ctypes.create_string_buffer(
+                self.store.read_chunk(digest), self.chunk_size
+            )
+            self._order.append(index)
+            if len(self._order) > self._cache_chunks:
+                self._cache.pop(self._order.pop(0), None)
+        return self._cache[index]
+
+    def readinto(self, b) -> int:
+        if self._pos >= self.size:
+            return 0
+        view = memoryview(b).cast("B")
+        index, inner = divmod(self._pos, self.chunk_size)
+        length = min(len(view), self.chunk_size - inner, self.size - self._pos)
+        buffer = self._buffer(index)
+        if buffer is None:
+            view[:length] = bytes(length)
+        else:
+            view[:length] = memoryview(buffer).cast("B")[inner:inner + length]
+        self._pos += length
+        return length
+
+    def limit(self, offset: int) -> int:
+        return min(self.size, (offset // self.chunk_size + 1) * self.chunk_size)
+
+    def locate(self, offset: int, length: int) -> Optional[int]:
+        buffer = self._buffer(offset // self.chunk_size)
+        return None if buffer is None else ctypes.addressof(buffer) + offset % self.chunk_size
+
+def print_report(report: StoreReport) -> None:
+    mib = 1048576
+    print_color(f"{report.recipes} file(s), {report.objects} unique chunk(s)", Colors.HEADER)
+    print(f"  logical size      {report.logical_bytes / mib:12.1f} MiB")
+    print(f"  zero chunks       {report.zero_bytes / mib:12.1f} MiB (not stored)")
+    print(f"  non-zero chunks   {report.referenced_bytes / mib:12.1f} MiB")
+    print(f"  unique chunks     {report.unique_raw_bytes / mib:12.1f} MiB  dedup {report.dedup_ratio:.2f}x")
+    print(f"  stored            {report.stored_bytes / mib:12.1f} MiB  compression {report.compression_ratio:.2f}x")
+    print(f"  overall           {report.total_ratio:.2f}x smaller than the raw files")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Deduplicating, compressed chunk store for snapshot memory files",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--store", default=DEFAULT_STORE, help="Store directory (FC_CHUNK_STORE)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Hashing/compression threads")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    put = sub.add_parser("put", help="Add files to the store")
+    put.add_argument("files", nargs="+", help="Memory files (or any files)")
+    put.add_argument("--name", help="Recipe name (default: the path; only with one file)")
+    put.add_argument("--chunk-kib", type=int, default=DEFAULT_CHUNK_SIZE // 1024, help="Chunk size in KiB")
+    put.add_argument("--codec", choices=sorted(CODEC_TAGS), default=DEFAULT_CODEC, help="Chunk compression")
+    put.add_argument("--level", type=int, default=3, help="Compression level")
+
+    get = sub.add_parser("get", help="Rebuild a file from the store and report restore throughput")
+    get.add_argument("name", help="Recipe name")
+    get.add_argument("out", help="Output file")
+
+    sub.add_parser("list", help="List recipes")
+    sub.add_parser("report", help="Show dedup and compression ratios")
+
+    bench = sub.add_parser("bench", help="Measure streaming read throughput of a recipe")
+    bench.add_argument("name", help="Recipe name")
+    bench.add_argument("--block-kib", type=int, default=1024, help="Read size in KiB")
+
+    rm = sub.add_parser("rm", help="Drop recipes (chunks are kept until gc)")
+    rm.add_argument("names", nargs="+", help="Recipe names")
+
+    args = parser.parse_args()
+
+    try:
+        store = ChunkStore(args.store)
+        if args.command == "put":
+            if args.name and len(args.files) > 1:
+                raise ChunkStoreError("--name only works with a single file")
+            for path in args.files:
+                stats = store.put_file(
+                    path, args.name or os.path.normpath(path), args.chunk_kib * 1024,
+                    args.workers, args.codec, args.level
+                )
+                print_color(
+                    f"{stats.name}: {stats.size / 1048576:.0f} MiB, {stats.zero_chunks}/{stats.chunks} zero chunks, "
+                    f"{stats.new_chunks} new ({stats.new_bytes / 1048576:.1f} MiB stored) in {stats.elapsed_s:.2f}s "
+                    f"({stats.size / 1048576 / max(stats.elapsed_s, 1e-9):.0f} MiB/s)",
+                    Colors.OKGREEN
+                )
+        elif args.command == "get":
+            elapsed = store.restore_file(args.name, args.out, args.workers)
+            size = store.recipe(args.name).size
+            print_color(f"Restored {args.out} in {elapsed:.2f}s ({size / 1048576 / max(elapsed, 1e-9):.0f} MiB/s)", Colors.OKGREEN)
+        elif args.command == "list":
+            for name in store.recipes():
+                recipe = store.recipe(name)
+                print(f"{name:<50} {recipe.size / 1048576:10.1f} MiB  {sum(c is None for c in recipe.chunks)}/{len(recipe.chunks)} zero")
+        elif args.command == "report":
+            print_report(store.report())
+        elif args.command == "bench":
+            reader = store.open(args.name)
+            block = bytearray(args.block_kib * 1024)
+            start = time.monotonic()
+            total = 0
+            while True:
+                n = reader.readinto(block)
+                if not n:
+                    break
+                total += n
+            elapsed = time.monotonic() - start
+            print_color(f"Streamed {total / 1048576:.0f} MiB in {elapsed:.2f}s ({total / 1048576 / max(elapsed, 1e-9):.0f} MiB/s)", Colors.OKGREEN)
+        elif args.command == "rm":
+            for name in args.names:
+                store.remove(name)
+    except ChunkStoreError as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import asyncio
+import secrets
+import argparse
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any, List
+
+from firecracker_api import Colors, print_color, FirecrackerClient, FirecrackerAPIError
+from vm_launcher import (
+    VMInstance, VMSpec, make_spec, ensure_tap, wait_for_socket, read_state, write_state, stop_vms, stop_process, _privileged
+)
+from vm_mmds import DEFAULT_SUBNET, ROOT_KEY, build_metadata, guest_network, parse_pairs
+from vm_ready import vsock_connect
+from vm_snapshot import DEFAULT_SNAPSHOT_DIR, Layer, SnapshotChain, SnapshotError, clone_file
+from vm_pool import percentile
+from vm_netlease import DEFAULT_LEASE_PATH, NetworkAllocator, LeaseError
+
+DEFAULT_BASE_DIR = os.path.join("vms", "clones")
+# Clone indexes start well above the ones `vm_launcher.py up` uses, so
+# their taps, MACs and /30s do not collide with launched VMs.
+DEFAULT_START_INDEX = 1000
+# Guest port of sandbox-reidentify.socket (create-matching-rootfs.sh), which
+# re-runs mmds-init so a clone picks up its own identity after resume.
+HOOK_PORT = 1025
+
+# Runs inside a private mount namespace: the clone's working directory is
+# bind-mounted over the golden VM's, so the drive and vsock paths recorded
+# in the snapshot resolve to this clone's own files.
+NAMESPACE_EXEC = 'mount --bind "$1" "$2" && exec "$3" --api-sock "$4" --id "$5"'
+
+@dataclass
+class CloneResult:
+    vm_id: str
+    pid: Optional[int]
+    tap: str
+    address: str
+    resumed_s: Optional[float] = None
+    identity_s: Optional[float] = None
+    hook: str = ""
+    memory_kib: Optional[Dict[str, int]] = None
+    error: Optional[str] = None
+
+def golden_dir(chain: SnapshotChain, layer: Layer) -> str:
+    """The working directory of the VM the snapshot was taken from."""
+    if not layer.disks:
+        hint = "--copy-disks (no reflink support)" if layer.disks_skipped else "without --no-disks"
+        raise SnapshotError(f"{chain.name}/{layer.id:04d} has no captured disks; clone a snapshot taken {hint}")
+    golden = os.path.commonpath([os.path.dirname(path) for path in layer.disks.values()])
+    if chain.path == golden or chain.path.startswith(golden + os.sep):
+        raise SnapshotError(
+            f"{golden} holds the snapshot itself; clone snapshots of VMs started by vm_launcher.py, "
+            f"which have their own working directory"
+        )
+    return golden
+
+def memory_usage(pid: int) -> Dict[str, int]:
+    """Rss, Pss and private memory of a process in KiB, from smaps_rollup."""
+    usage = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("Rss", "Pss", "Shared_Clean", "Private_Clean", "Private_Dirty"):
+                usage[key] = int(value.split()[0])
+    usage["Private"] = usage.get("Private_Clean", 0) + usage.get("Private_Dirty", 0)
+    return usage
+
+def golden_cid(golden: str) -> Optional[int]:
+    """
+    The vsock CID of the golden VM, which every clone keeps: Firecracker
+    restores the device as it was snapshotted. None if its state is gone.
+    """
+    state = read_state(golden)
+    try:
+        return int(state["spec"]["guest_cid"])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+def clone_metadata(
+    spec: VMSpec,
+    network: Dict[str, str],
+    source: str,
+    job: Optional[Dict[str, str]],
+    guest_cid: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    The launcher's MMDS document plus what a clone must not share with its siblings.
+
+    `guest_cid` is the CID the clone actually has (see golden_cid); the key
+    is left out when it is unknown rather than guessed from `spec`.
+    """
+    metadata = build_metadata(spec.vm_id, network, spec.guest_mac, job=job)
+    metadata[ROOT_KEY].update({
+        "clone-of": source,
+        "machine-id": secrets.token_hex(16),
+        "entropy": secrets.token_hex(64)
+    })
+    if guest_cid is not None:
+        metadata[ROOT_KEY]["vsock-cid"] = str(guest_cid)
+    return metadata
+
+async def run_hook(vsock_path: str, port: int, timeout: float) -> str:
+    """Connect to the guest's re-identify socket and return what the hook printed."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await vsock_connect(vsock_path, port, max(0.1, deadline - time.monotonic()))
+            break
+        except (ConnectionError, OSError, asyncio.TimeoutError):
+            if time.monotonic() >= deadline:
+                raise
+            await asyncio.sleep(0.01)
+    try:
+        output = await asyncio.wait_for(reader.read(), max(0.1, deadline - time.monotonic()))
+    finally:
+        writer.close()
+    return output.decode(errors="replace").strip()
+
+async def clone_vm(
+    chain: SnapshotChain,
+    layer: Layer,
+    memory: str,
+    golden: str,
+    spec: VMSpec,
+    firecracker_bin: str = "firecracker",
+    setup_tap: bool = False,
+    subnet: str = DEFAULT_SUBNET,
+    job: Optional[Dict[str, str]] = None,
+    hook_port: Optional[int] = HOOK_PORT,
+    timeout: float = 10.0,
+    leases: Optional[NetworkAllocator] = None
+) -> CloneResult:
+    """
+    Restore one clone of `layer` and give it its own identity.
+
+    The clone gets reflinked copies of the captured drives, its own tap
+    through the load's network overrides and a fresh MMDS document before
+    it resumes. Every clone maps the same `memory` file, so unmodified
+    guest pages are shared through the page cache. With `leases` the
+    clone's tap, /30 and MAC come from a lease on its working directory.
+    """
+    if leases:
+        lease = await asyncio.to_thread(leases.acquire, spec.workdir)
+        spec.tap, spec.guest_mac = lease.tap, lease.mac
+        network = lease.network()
+    else:
+        network = guest_network(spec.index, subnet)
+    guest_cid = golden_cid(golden)
+    if guest_cid is not None:
+        spec.guest_cid = guest_cid
+    result = CloneResult(vm_id=spec.vm_id, pid=None, tap=spec.tap, address=network["address"])
+    instance = VMInstance(spec=spec, started_at=time.time())
+    start = time.monotonic()
+    try:
+        os.makedirs(spec.workdir, exist_ok=True)
+        for stale in (spec.api_socket, spec.vsock_path):
+            if os.path.exists(stale):
+                os.unlink(stale)
+        for drive_id, path in layer.disks.items():
+            await asyncio.to_thread(clone_file, chain.disk(layer.id, drive_id), os.path.join(spec.workdir, os.path.relpath(path, golden)))
+        if setup_tap:
+            await ensure_tap(spec.tap, network["host_address"])
+
+        console = open(spec.console_path, "ab")
+        try:
+            instance.process = await asyncio.create_subprocess_exec(
+                *_privileged(["unshare", "--mount", "--propagation", "private", "sh", "-c", NAMESPACE_EXEC, "sh",
+                              spec.workdir, golden, firecracker_bin, spec.api_socket, spec.vm_id]),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=console,
+                stderr=asyncio.subprocess.STDOUT,
+                cwd=spec.workdir,
+                start_new_session=True
+            )
+        finally:
+            console.close()
+        instance.pid = result.pid = instance.process.pid
+        if not await wait_for_socket(spec.api_socket, timeout):
+            raise RuntimeError(f"API socket did not appear within {timeout}s")
+        instance.api_ready_s = time.monotonic() - start
+
+        def load() -> None:
+            with FirecrackerClient(spec.api_socket, timeout=60.0) as client:
+                client.load_snapshot(
+                    chain.vmstate(layer.id), mem_file_path=memory, resume_vm=False,
+                    network_overrides=[{"iface_id": "eth0", "host_dev_name": spec.tap}]
+                )
+                client.put_mmds(clone_metadata(spec, network, chain.recipe_name(layer.id), job, guest_cid))
+                client.resume()
+
+        await asyncio.to_thread(load)
+        result.resumed_s = time.monotonic() - start
+        if hook_port:
+            try:
+                result.hook = await run_hook(spec.vsock_path, hook_port, timeout)
+                result.identity_s = instance.guest_ready_s = time.monotonic() - start
+            except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                result.hook = f"not run: {e or type(e).__name__}"
+    except FirecrackerAPIError as e:
+        result.error = instance.error = e.fault
+    except Exception as e:
+        result.error = instance.error = str(e)
+    if result.error:
+        await stop_process(instance.process)
+    if result.error and leases:
+        await asyncio.to_thread(leases.release, spec.workdir)
+    write_state(instance)
+    return result
+
+async def clone_many(
+    chain: SnapshotChain,
+    count: int,
+    layer_id: Optional[int] = None,
+    base_dir: str = DEFAULT_BASE_DIR,
+    prefix: str = "clone",
+    start_index: int = DEFAULT_START_INDEX,
+    concurrency: int = 0,
+    firecracker_bin: str = "firecracker",
+    setup_taps: bool = False,
+    subnet: str = DEFAULT_SUBNET,
+    job: Optional[Dict[str, str]] = None,
+    hook_port: Optional[int] = HOOK_PORT,
+    timeout: float = 10.0,
+    settle: float = 1.0,
+    leases: Optional[NetworkAllocator] = None
+) -> Dict[str, Any]:
+    """
+    Restore `count` clones of one snapshot concurrently.
+
+    Reports clones per second and, `settle` seconds after the last clone
+    resumed, the memory of each clone: Rss counts the shared guest pages
+    in full, Pss divides them among the clones that map them.
+    """
+    layer = chain.layers[chain._index(layer_id)]
+    golden = golden_dir(chain, layer)
+    memory = chain.materialize(layer.id)
+    semaphore = asyncio.Semaphore(concurrency or count)
+
+    async def one(index: int) -> CloneResult:
+        async with semaphore:
+            return await clone_vm(
+                chain, layer, memory, golden, make_spec(index, base_dir, prefix), firecracker_bin,
+                setup_taps, subnet, job, hook_port, timeout, leases
+            )
+
+    start = time.monotonic()
+    results = await asyncio.gather(*(one(start_index + i) for i in range(count)))
+    wall = time.monotonic() - start
+    await asyncio.sleep(settle)
+    for result in results:
+        if result.error is None:
+            try:
+                result.memory_kib = memory_usage(result.pid)
+            except OSError:
+                pass
+
+    ok = [r for r in results if r.error is None]
+    measured = [r.memory_kib for r in ok if r.memory_kib]
+
+    def mean(key: str) -> Optional[float]:
+        return sum(m[key] for m in measured) / len(measured) if measured else None
+
+    return {
+        "source": chain.recipe_name(layer.id),
+        "mem_size_mib": layer.mem_size >> 20,
+        "requested": count,
+        "cloned": len(ok),
+        "failed": count - len(ok),
+        "wall_s": wall,
+        "clones_per_s": len(ok) / wall if wall > 0 else 0.0,
+        "resumed_p50_s": percentile([r.resumed_s for r in ok], 50),
+        "resumed_p90_s": percentile([r.resumed_s for r in ok], 90),
+        "identity_p50_s": percentile([r.identity_s for r in ok if r.identity_s is not None], 50),
+        "rss_mean_kib": mean("Rss"),
+        "pss_mean_kib": mean("Pss"),
+        "private_mean_kib": mean("Private"),
+        "clones": [asdict(r) for r in results]
+    }
+
+def print_report(report: Dict[str, Any]) -> None:
+    def ms(value: Optional[float]) -> str:
+        return f"{value * 1000:.0f} ms" if value is not None else "-"
+
+    def mib(kib: Optional[float]) -> str:
+        return f"{kib / 1024:.1f} MiB" if kib is not None else "-"
+
+    print(f"{'CLONE':<12} {'PID':<8} {'TAP':<14} {'ADDRESS':<18} {'RESUMED':>9} {'IDENTITY':>9} {'RSS':>11} {'PSS':>11} STATUS")
+    for clone in report["clones"]:
+        memory = clone["memory_kib"] or {}
+        status = clone["error"] or ("ok" if not clone["hook"].startswith("not run") else f"ok, hook {clone['hook']}")
+        print(
+            f"{clone['vm_id']:<12} {str(clone['pid'] or '-'):<8} {clone['tap']:<14} {clone['address']:<18} "
+            f"{ms(clone['resumed_s']):>9} {ms(clone['identity_s']):>9} {mib(memory.get('Rss')):>11} {mib(memory.get('Pss')):>11} {status}"
+        )
+    color = Colors.OKGREEN if report["failed"] == 0 else Colors.WARNING
+    print_color(
+        f"\nCloned {report['cloned']}/{report['requested']} VMs of a {report['mem_size_mib']} MiB guest from "
+        f"{report['source']} in {report['wall_s']:.2f}s ({report['clones_per_s']:.1f} clones/s, "
+        f"resume p50 {ms(report['resumed_p50_s'])}, p90 {ms(report['resumed_p90_s'])})",
+        color
+    )
+    if report["rss_mean_kib"] is not None:
+        print_color(
+            f"Per clone: RSS {mib(report['rss_mean_kib'])}, PSS {mib(report['pss_mean_kib'])}, "
+            f"private {mib(report['private_mean_kib'])}",
+            Colors.OKBLUE
+        )
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Restore many MicroVMs from one snapshot, each with its own identity",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--base-dir", default=DEFAULT_BASE_DIR, help="Directory holding one working directory per clone")
+    parser.add_argument("--prefix", default="clone", help="Prefix for clone ids and tap device names")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    up = sub.add_parser("up", help="Clone a snapshot COUNT times")
+    up.add_argument("--dir", default=DEFAULT_SNAPSHOT_DIR, help="Directory holding the snapshot chains")
+    up.add_argument("--chain", default="default", help="Chain to clone")
+    up.add_argument("--layer", type=int, help="Layer id (default: newest)")
+    up.add_argument("--count", type=int, default=4, help="Number of clones")
+    up.add_argument("--start-index", type=int, default=DEFAULT_START_INDEX, help="Index of the first clone")
+    up.add_argument("--concurrency", type=int, default=0, help="Maximum restores in flight (0 = all)")
+    up.add_argument("--firecracker", default="firecracker", help="Firecracker binary")
+    up.add_argument("--setup-taps", action="store_true", help="Create a tap device per clone")
+    up.add_argument("--subnet", default=DEFAULT_SUBNET, help="Subnet carved into one /30 per clone")
+    up.add_argument("--job", action="append", default=[], metavar="KEY=VALUE", help="Job parameter published through MMDS (repeatable)")
+    up.add_argument("--hook-port", type=int, default=HOOK_PORT, help="Guest vsock port of the re-identify hook (0 = skip)")
+    up.add_argument("--timeout", type=float, default=10.0, help="Seconds to wait for each VMM and hook")
+    up.add_argument("--settle", type=float, default=1.0, help="Seconds to wait before sampling clone memory")
+    up.add_argument("--leases", default=DEFAULT_LEASE_PATH, help="Lease file handing out taps, /30s and MACs (FC_NET_LEASES)")
+    up.add_argument("--no-leases", action="store_true", help="Derive taps, /30s and MACs from the clone index instead")
+    up.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    down = sub.add_parser("down", help="Stop every clone")
+    down.add_argument("--remove-taps", action="store_true", help="Delete the clones' tap devices")
+    down.add_argument("--leases", default=DEFAULT_LEASE_PATH, help="Lease file the clones' network leases are released from")
+    down.add_argument("--no-leases", action="store_true", help="Leave the lease file alone (clones started with up --no-leases)")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "up":
+            report = asyncio.run(clone_many(
+                SnapshotChain(os.path.join(args.dir, args.chain)), args.count, args.layer, args.base_dir, args.prefix,
+                args.start_index, args.concurrency, args.firecracker, args.setup_taps, args.subnet,
+                parse_pairs(args.job), args.hook_port or None, args.timeout, args.settle,
+                None if args.no_leases else NetworkAllocator(args.subnet, args.leases)
+            ))
+            if args.json:
+                print(json.dumps(report, indent=2))
+            else:
+                print_report(report)
+            sys.exit(0 if report["failed"] == 0 else 1)
+        elif args.command == "down":
+            results = asyncio.run(stop_vms(
+                args.base_dir, remove_taps=args.remove_taps,
+                leases=None if args.no_leases else NetworkAllocator(state_path=args.leases)
+            ))
+            print_color(f"Stopped {len(results)} clone(s).", Colors.OKGREEN)
+            survivors = [r.target.name for r in results if not r.exited]
+            if survivors:
+                print_color(f"Still running after SIGKILL: {', '.join(survivors)}", Colors.FAIL)
+                sys.exit(1)
+    except (SnapshotError, LeaseError, ValueError) as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
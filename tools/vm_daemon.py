@@ -0,0 +1,812 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import asyncio
+import argparse
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Dict, Any, List, Callable, Iterator, Tuple
+
+from firecracker_api import Colors, print_color, FirecrackerClient
+from vm_mmds import parse_pairs, guest_network
+from vm_launcher import DEFAULT_TEMPLATE, VMInstance, load_template, make_spec, launch_vm, pid_alive, ensure_tap, remove_tap
+from vm_teardown import TeardownTarget, shutdown_vm
+from vm_watch import EventBus, VMWatcher
+from vm_admission import AdmissionController, AdmissionError, Headroom, print_headroom
+from vm_hugepages import configured_memory
+from vm_snapshot import DEFAULT_STAGING, SnapshotChain
+from vm_idle import Front, IdlePolicy, IdleTracker, ScaleToZeroStats, sample_activity
+from vm_clone import memory_usage
+from vm_netlease import DEFAULT_LEASE_PATH, NetworkAllocator
+
+DEFAULT_DAEMON_SOCKET = os.environ.get("FC_DAEMON_SOCKET", "/tmp/firecracker-sandbox.sock")
+DEFAULT_STATE_DIR = "vms/daemon"
+REGISTRY_FILE = "registry.json"
+STOPPED_STATES = ("stopped", "failed", "crashed", "rejected")
+IDLE_DIR = "idle"
+# Evicting a restored VM writes a diff; compact the chain beyond this many layers.
+IDLE_MAX_LAYERS = 8
+# Seconds a revival waits for memory headroom before the client's connection is dropped.
+DEFAULT_REVIVE_TIMEOUT = 5.0
+
+@dataclass
+class VMRecord:
+    """Registry entry for one VM owned by the daemon."""
+    vm_id: str
+    index: int
+    state: str
+    workdir: str
+    api_socket: str
+    vsock_path: str
+    console_path: str
+    tap: str
+    guest_mac: str
+    guest_cid: int
+    pid: Optional[int] = None
+    created_at: float = 0.0
+    updated_at: float = 0.0
+    exit_code: Optional[int] = None
+    error: Optional[str] = None
+    snapshots: List[str] = field(default_factory=list)
+    forwards: List[str] = field(default_factory=list)
+    evictions: int = 0
+    revivals: int = 0
+
+class Registry:
+    """
+    In-memory VM registry mirrored to a small JSON file.
+
+    Reads never touch the disk or the process table; every mutation rewrites
+    the file atomically so a restarted daemon can pick up where it left off.
+    """
+
+    def __init__(self, path: str, listener: Optional[Callable[[VMRecord], None]] = None):
+        self.path = path
+        self.listener = listener
+        self.vms: Dict[str, VMRecord] = {}
+
+    def load(self) -> None:
+        """Load the persisted registry, if any."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        for entry in data.get("vms", []):
+            record = VMRecord(**entry)
+            self.vms[record.vm_id] = record
+
+    def save(self) -> None:
+        """Write the registry to disk atomically."""
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"vms": [asdict(r) for r in self.vms.values()]}, f, indent=2)
+        os.replace(tmp, self.path)
+
+    def put(self, record: VMRecord) -> None:
+        record.updated_at = time.time()
+        self.vms[record.vm_id] = record
+        self.save()
+        if self.listener:
+            self.listener(record)
+
+    def update(self, vm_id: str, **changes: Any) -> VMRecord:
+        record = self.vms[vm_id]
+        previous = record.state
+        for key, value in changes.items():
+            setattr(record, key, value)
+        record.updated_at = time.time()
+        self.save()
+        if self.listener and record.state != previous:
+            self.listener(record)
+        return record
+
+    def remove(self, vm_id: str) -> None:
+        self.vms.pop(vm_id, None)
+        self.save()
+
+    def free_index(self) -> int:
+        """Lowest VM index not used by any registered VM."""
+        used = {r.index for r in self.vms.values()}
+        index = 0
+        while index in used:
+            index += 1
+        return index
+
+class SandboxDaemon:
+    """Supervisor that owns firecracker children and serves a local JSON API."""
+
+    def __init__(
+        self,
+        socket_path: str = DEFAULT_DAEMON_SOCKET,
+        state_dir: str = DEFAULT_STATE_DIR,
+        template_path: str = DEFAULT_TEMPLATE,
+        firecracker_bin: str = "firecracker",
+        setup_taps: bool = False,
+        idle_policy: Optional[IdlePolicy] = None,
+        restore_backend: str = "file",
+        forward_bind: str = "127.0.0.1",
+        leases: Optional[NetworkAllocator] = None,
+        revive_timeout: float = DEFAULT_REVIVE_TIMEOUT
+    ):
+        self.socket_path = socket_path
+        self.state_dir = os.path.abspath(state_dir)
+        self.template_path = template_path
+        self.template = load_template(template_path)
+        self.template_dir = os.path.dirname(os.path.abspath(template_path))
+        self.firecracker_bin = firecracker_bin
+        self.setup_taps = setup_taps
+        self.bus = EventBus()
+        self.watcher = VMWatcher(self.bus, on_exit=self._on_exit)
+        self.registry = Registry(os.path.join(self.state_dir, REGISTRY_FILE), self._on_state_change)
+        self.instances: Dict[str, VMInstance] = {}
+        self.admission = AdmissionController()
+        self.idle_policy = idle_policy
+        self.idle = IdleTracker(idle_policy or IdlePolicy())
+        self.restore_backend = restore_backend
+        self.forward_bind = forward_bind
+        self.leases = leases
+        self.revive_timeout = revive_timeout
+        self.scale = ScaleToZeroStats()
+        self.fronts: Dict[str, Front] = {}
+        self._reviving: Dict[str, asyncio.Future] = {}
+        self._stopped = asyncio.Event()
+
+    # Startup
+
+    def recover(self) -> None:
+        """
+        Reload the registry and reconcile it with what is still running.
+
+        VMs that survived a daemon restart are adopted and tracked through
+        pidfds from here on; this is the only time PIDs are checked directly.
+        Evicted VMs stay evicted, as do VMs the daemon died while evicting
+        or reviving if their snapshot is complete.
+        """
+        self.registry.load()
+        for record in list(self.registry.vms.values()):
+            if record.state in STOPPED_STATES + ("evicted",):
+                continue
+            if pid_alive(record.pid, record.api_socket) and self.watcher.watch_pid(record.vm_id, record.pid):
+                self.watcher.watch_dir(record.vm_id, record.workdir)
+                if record.state in ("evicting", "reviving"):
+                    record.state = "running"
+            elif record.state in ("evicting", "reviving") and self._chain(record).layers:
+                record.state = "evicted"
+            else:
+                record.state = "stopped"
+        self.registry.save()
+
+    def _on_state_change(self, record: VMRecord) -> None:
+        self.bus.publish({"type": "state", "vm_id": record.vm_id, "state": record.state, "pid": record.pid})
+
+    def _on_exit(self, vm_id: str, code: Optional[int]) -> None:
+        child = self.instances.pop(vm_id, None)
+        record = self.registry.vms.get(vm_id)
+        if record is None:
+            return
+        if child is None and record.pid:
+            # Revived VMs are children the event loop does not reap.
+            try:
+                os.waitpid(record.pid, os.WNOHANG)
+            except ChildProcessError:
+                pass
+        self.watcher.unwatch_dir(record.workdir)
+        if record.state == "evicted":
+            return
+        if record.state == "stopping" or code in (0, None):
+            state = "stopped"
+        else:
+            state = "crashed"
+        self.registry.update(vm_id, state=state, exit_code=code)
+
+    async def serve(self) -> None:
+        """Serve requests until a `shutdown` request arrives."""
+        os.makedirs(self.state_dir, exist_ok=True)
+        if sys.version_info < (3, 12) and hasattr(asyncio, "PidfdChildWatcher"):
+            # Avoid one waitpid() thread per child on older Pythons.
+            child_watcher = asyncio.PidfdChildWatcher()
+            child_watcher.attach_loop(asyncio.get_running_loop())
+            asyncio.set_child_watcher(child_watcher)
+        self.watcher.start()
+        self.recover()
+        for record in self.registry.vms.values():
+            if record.state not in STOPPED_STATES:
+                await self._front(record)
+        idle_task = asyncio.create_task(self._idle_loop()) if self.idle_policy else None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = await asyncio.start_unix_server(self._handle, self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        print_color(f"Sandbox daemon listening on {self.socket_path}", Colors.OKGREEN)
+        try:
+            await self._stopped.wait()
+        finally:
+            if idle_task:
+                idle_task.cancel()
+            for front in self.fronts.values():
+                front.close()
+            server.close()
+            await server.wait_closed()
+            self.watcher.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    # Request handling
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if request.get("op") == "subscribe":
+                        await self._stream_events(writer, request.get("types"))
+                        break
+                    handler = getattr(self, f"op_{request.get('op', '').replace('-', '_')}", None)
+                    if handler is None:
+                        raise ValueError(f"unknown op {request.get('op')!r}")
+                    reply = {"ok": True, "result": await handler(request)}
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                writer.write(json.dumps(reply).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionResetError, BrokenPipeError, asyncio.CancelledError):
+            # Client went away, or the daemon is shutting down.
+            pass
+        finally:
+            writer.close()
+
+    async def _stream_events(self, writer: asyncio.StreamWriter, types: Optional[List[str]]) -> None:
+        """Push lifecycle events to a subscriber until it disconnects."""
+        queue = self.bus.subscribe()
+        try:
+            writer.write(json.dumps({"ok": True, "result": "subscribed"}).encode() + b"\n")
+            await writer.drain()
+            while True:
+                event = await queue.get()
+                if types and event["type"] not in types:
+                    continue
+                writer.write(json.dumps(event).encode() + b"\n")
+                await writer.drain()
+        finally:
+            self.bus.unsubscribe(queue)
+
+    def _record(self, vm_id: str) -> VMRecord:
+        record = self.registry.vms.get(vm_id)
+        if record is None:
+            raise KeyError(f"no such VM: {vm_id}")
+        return record
+
+    async def op_ping(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return {"pid": os.getpid(), "vms": len(self.registry.vms)}
+
+    async def op_list(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        states = request.get("states")
+        return [
+            asdict(r) for r in self.registry.vms.values()
+            if not states or r.state in states
+        ]
+
+    async def op_status(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return asdict(self._record(request["vm_id"]))
+
+    async def op_launch(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        count = int(request.get("count", 1))
+        forwards = request.get("forward") or []
+        if forwards and count > 1:
+            raise ValueError("forwarded ports need one VM per launch")
+        for forward in forwards:
+            _parse_forward(forward)
+        specs = []
+        for _ in range(count):
+            spec = make_spec(self.registry.free_index(), os.path.join(self.state_dir, "vms"), "vm")
+            if self.leases:
+                lease = await asyncio.to_thread(self.leases.acquire, spec.workdir)
+                spec.tap, spec.guest_mac = lease.tap, lease.mac
+            self.registry.put(VMRecord(
+                vm_id=spec.vm_id,
+                index=spec.index,
+                state="booting",
+                workdir=spec.workdir,
+                api_socket=spec.api_socket,
+                vsock_path=spec.vsock_path,
+                console_path=spec.console_path,
+                tap=spec.tap,
+                guest_mac=spec.guest_mac,
+                guest_cid=spec.guest_cid,
+                created_at=time.time(),
+                forwards=list(forwards)
+            ))
+            os.makedirs(spec.workdir, exist_ok=True)
+            self.watcher.watch_dir(spec.vm_id, spec.workdir)
+            specs.append(spec)
+
+        async def boot(spec) -> VMRecord:
+            try:
+                await asyncio.to_thread(
+                    self.admission.reserve, spec.api_socket, configured_memory(self.template),
+                    os.getpid(), bool(request.get("queue")), float(request.get("queue_timeout", 300.0))
+                )
+            except AdmissionError as e:
+                await self._release_lease(spec.workdir)
+                return self.registry.update(spec.vm_id, state="rejected", error=str(e))
+            instance = await launch_vm(
+                spec, self.template, self.template_dir, self.firecracker_bin,
+                self.setup_taps, wait_ready=bool(request.get("wait_ready")),
+                ready_timeout=float(request.get("ready_timeout", 60.0)),
+                job=request.get("job"), leases=self.leases
+            )
+            if instance.error:
+                if instance.process and instance.process.returncode is None:
+                    instance.process.kill()
+                await asyncio.to_thread(self.admission.release, spec.api_socket)
+                await self._release_lease(spec.workdir)
+                return self.registry.update(spec.vm_id, state="failed", error=instance.error, pid=instance.pid)
+            self.instances[spec.vm_id] = instance
+            self.watcher.watch_process(spec.vm_id, instance.process)
+            record = self.registry.update(spec.vm_id, state="running", pid=instance.pid)
+            await self._front(record)
+            return record
+
+        records = await asyncio.gather(*(boot(s) for s in specs))
+        return [asdict(r) for r in records]
+
+    async def op_headroom(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return asdict(await asyncio.to_thread(self.admission.headroom))
+
+    async def op_stop(self, request: Dict[str, Any]) -> List[Dict[str, Any]]:
+        vm_ids = request.get("vm_ids") or [
+            r.vm_id for r in self.registry.vms.values() if r.state not in STOPPED_STATES
+        ]
+        timeout = float(request.get("timeout", 10.0))
+
+        async def stop(vm_id: str) -> Dict[str, Any]:
+            record = self._record(vm_id)
+            self.registry.update(vm_id, state="stopping")
+            alive = pid_alive(record.pid, record.api_socket)
+            child = self.instances.get(vm_id)
+            target = TeardownTarget(
+                pid=record.pid if alive else 0,
+                name=vm_id,
+                api_socket=record.api_socket,
+                vsock_path=record.vsock_path,
+                tap=record.tap,
+                process=child.process if child and alive else None
+            )
+            front = self.fronts.pop(vm_id, None)
+            if front:
+                front.close()
+            self.idle.forget(vm_id)
+            result = await shutdown_vm(target, timeout, remove_taps=self.setup_taps)
+            if result.exited:
+                # A VMM that survived SIGKILL stays "stopping" and keeps its lease.
+                await self._release_lease(record.workdir)
+                self.registry.update(vm_id, state="stopped")
+            return {"vm_id": vm_id, "method": result.method, "elapsed": result.elapsed, "exited": result.exited}
+
+        return await asyncio.gather(*(stop(v) for v in vm_ids))
+
+    async def op_remove(self, request: Dict[str, Any]) -> List[str]:
+        removed = []
+        for vm_id in request["vm_ids"]:
+            record = self._record(vm_id)
+            if record.state not in STOPPED_STATES:
+                raise ValueError(f"{vm_id} is still running; stop it first")
+            self._chain(record).delete()
+            await self._release_lease(record.workdir)
+            self.registry.remove(vm_id)
+            removed.append(vm_id)
+        return removed
+
+    async def _api(self, vm_id: str, action: str, *args: Any) -> Any:
+        record = self._record(vm_id)
+        def call():
+            with FirecrackerClient(record.api_socket) as client:
+                return getattr(client, action)(*args)
+        return await asyncio.to_thread(call)
+
+    async def op_pause(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        await self._api(request["vm_id"], "pause")
+        return asdict(self.registry.update(request["vm_id"], state="paused"))
+
+    async def op_resume(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        await self._api(request["vm_id"], "resume")
+        return asdict(self.registry.update(request["vm_id"], state="running"))
+
+    async def op_snapshot(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        vm_id = request["vm_id"]
+        record = self._record(vm_id)
+        directory = os.path.abspath(request.get("dir") or os.path.join(
+            "snapshots", f"{vm_id}-{time.strftime('%Y%m%d_%H%M%S')}"
+        ))
+        os.makedirs(directory, exist_ok=True)
+        paused = await self._api(
+            vm_id, "snapshot",
+            os.path.join(directory, "mem_dump"),
+            os.path.join(directory, "memory")
+        )
+        self.registry.update(vm_id, snapshots=record.snapshots + [directory])
+        return {"vm_id": vm_id, "dir": directory, "paused_s": paused}
+
+    # Scale to zero
+
+    async def _release_lease(self, workdir: str) -> None:
+        if self.leases:
+            await asyncio.to_thread(self.leases.release, workdir)
+
+    def _network(self, record: VMRecord) -> Dict[str, str]:
+        """The VM's address: from its lease, or derived from its index for VMs launched without leases."""
+        lease = self.leases.get(record.workdir) if self.leases else None
+        return lease.network() if lease else guest_network(record.index)
+
+    def _chain(self, record: VMRecord) -> SnapshotChain:
+        return SnapshotChain(os.path.join(self.state_dir, IDLE_DIR, record.vm_id))
+
+    async def _front(self, record: VMRecord) -> Front:
+        """Start the VM's forwarded ports, and hold its vsock path if it is evicted."""
+        front = self.fronts.get(record.vm_id)
+        if front is None:
+            front = Front(
+                record.vm_id, self._network(record)["address"].split("/")[0], record.vsock_path,
+                lambda vm_id=record.vm_id: self.revive(vm_id),
+                [_parse_forward(f) for f in record.forwards], self.forward_bind
+            )
+            await front.start()
+            self.fronts[record.vm_id] = front
+        if record.state == "evicted":
+            await front.hold_vsock()
+        return front
+
+    async def _idle_loop(self) -> None:
+        """Sample every running VM and evict the ones idle for longer than the policy allows."""
+        while True:
+            await asyncio.sleep(self.idle_policy.interval)
+            for record in list(self.registry.vms.values()):
+                if record.state != "running" or not record.pid:
+                    continue
+                try:
+                    activity = await asyncio.to_thread(sample_activity, record.pid, record.tap, record.vsock_path)
+                except OSError:
+                    continue
+                front = self.fronts.get(record.vm_id)
+                idle = self.idle.observe(record.vm_id, activity, busy=bool(front and front.connections))
+                if idle >= self.idle_policy.idle_after:
+                    try:
+                        await self.evict(record.vm_id)
+                    except Exception as e:
+                        self.bus.publish({"type": "evict-failed", "vm_id": record.vm_id, "error": str(e)})
+
+    async def evict(self, vm_id: str) -> Dict[str, Any]:
+        """
+        Snapshot a running VM and stop it, freeing its memory and tap.
+
+        The snapshot is a diff when the VM was itself restored from the
+        chain, so repeated evictions write only what the guest dirtied.
+        The VM stays paused from the snapshot until it is killed.
+        """
+        record = self._record(vm_id)
+        if record.state != "running":
+            raise ValueError(f"{vm_id} is {record.state}, not running")
+        start = time.monotonic()
+        self.registry.update(vm_id, state="evicting")
+        try:
+            freed_kib = memory_usage(record.pid)["Rss"]
+        except (OSError, KeyError):
+            freed_kib = 0
+        chain = self._chain(record)
+        try:
+            layer = await asyncio.to_thread(
+                chain.take, record.api_socket, False, False, DEFAULT_STAGING, resume=False
+            )
+        except Exception:
+            self.scale.failures += 1
+            self.registry.update(vm_id, state="running")
+            raise
+        # Marked before the kill so the exit is not taken for a crash.
+        self.registry.update(vm_id, state="evicted")
+        pid, child = record.pid, self.instances.get(vm_id)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        if child:
+            await child.process.wait()
+        if self.setup_taps:
+            await remove_tap(record.tap)
+        await asyncio.to_thread(self.admission.release, record.api_socket)
+        if len(chain.layers) > IDLE_MAX_LAYERS:
+            await asyncio.to_thread(chain.compact)
+        self.idle.forget(vm_id)
+        await self._front(record)
+        elapsed = time.monotonic() - start
+        self.scale.evicted(elapsed, freed_kib)
+        self.registry.update(vm_id, pid=None, evictions=record.evictions + 1)
+        event = {
+            "vm_id": vm_id, "layer": layer.id, "kind": layer.kind, "paused_s": layer.paused_s,
+            "evict_s": elapsed, "freed_mib": freed_kib / 1024
+        }
+        self.bus.publish(dict(event, type="evicted"))
+        return event
+
+    async def revive(self, vm_id: str) -> float:
+        """Restore an evicted VM; concurrent callers share one restore. Returns its latency."""
+        record = self._record(vm_id)
+        if record.state == "running":
+            return 0.0
+        task = self._reviving.get(vm_id)
+        if task is None:
+            if record.state != "evicted":
+                raise ValueError(f"{vm_id} is {record.state}, not evicted")
+            task = self._reviving[vm_id] = asyncio.ensure_future(self._restore(record))
+            task.add_done_callback(lambda _: self._reviving.pop(vm_id, None))
+        return await asyncio.shield(task)
+
+    async def _restore(self, record: VMRecord) -> float:
+        start = time.monotonic()
+        vm_id = record.vm_id
+        self.registry.update(vm_id, state="reviving")
+        front = self.fronts.get(vm_id)
+        if front:
+            front.release_vsock()
+        try:
+            await asyncio.to_thread(
+                self.admission.reserve, record.api_socket, configured_memory(self.template), os.getpid(), True,
+                self.revive_timeout
+            )
+            if self.setup_taps:
+                await ensure_tap(record.tap, self._network(record)["host_address"])
+            chain = self._chain(record)
+            result = await asyncio.to_thread(
+                chain.restore, record.api_socket, firecracker_bin=self.firecracker_bin,
+                console=record.console_path, backend=self.restore_backend, disks=False
+            )
+        except Exception as e:
+            self.scale.failures += 1
+            self.registry.update(vm_id, state="evicted", error=str(e))
+            await asyncio.to_thread(self.admission.release, record.api_socket)
+            if front:
+                await front.hold_vsock()
+            raise
+        elapsed = time.monotonic() - start
+        # Each revival of a diff materializes a guest-size image; only the one just mapped is still needed.
+        await asyncio.to_thread(chain.prune_materialized, result["layer"])
+        self.watcher.watch_pid(vm_id, result["pid"])
+        self.watcher.watch_dir(vm_id, record.workdir)
+        self.scale.revived(elapsed)
+        self.registry.update(vm_id, state="running", pid=result["pid"], revivals=record.revivals + 1, error=None)
+        self.bus.publish({"type": "revived", "vm_id": vm_id, "layer": result["layer"], "revive_s": elapsed})
+        return elapsed
+
+    async def op_evict(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return await self.evict(request["vm_id"])
+
+    async def op_revive(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return {"vm_id": request["vm_id"], "revive_s": await self.revive(request["vm_id"])}
+
+    async def op_idle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        return dict(
+            self.scale.report(),
+            policy=asdict(self.idle_policy) if self.idle_policy else None,
+            vms=[
+                {
+                    "vm_id": r.vm_id, "state": r.state, "idle_s": self.idle.idle_for(r.vm_id),
+                    "evictions": r.evictions, "revivals": r.revivals, "forwards": r.forwards
+                }
+                for r in self.registry.vms.values() if r.state not in STOPPED_STATES
+            ]
+        )
+
+    async def op_shutdown(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        if request.get("stop_vms"):
+            await self.op_stop({"timeout": request.get("timeout", 10.0)})
+        self._stopped.set()
+        return {"stopping": True}
+
+def _parse_forward(forward: str) -> Tuple[int, int]:
+    """HOST_PORT:GUEST_PORT (or one port for both)."""
+    host, _, guest = forward.partition(":")
+    try:
+        return int(host), int(guest or host)
+    except ValueError:
+        raise ValueError(f"bad port forward {forward!r}, expected HOST_PORT:GUEST_PORT")
+
+class DaemonClient:
+    """Blocking client for the daemon's newline-delimited JSON protocol."""
+
+    def __init__(self, socket_path: str = DEFAULT_DAEMON_SOCKET, timeout: Optional[float] = 120.0):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.settimeout(timeout)
+        self._sock.connect(socket_path)
+        self._file = self._sock.makefile("rwb")
+
+    def call(self, op: str, **params: Any) -> Any:
+        """Send one request and return its result, raising on errors."""
+        self._file.write(json.dumps(dict(params, op=op)).encode() + b"\n")
+        self._file.flush()
+        reply = json.loads(self._file.readline())
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error"))
+        return reply["result"]
+
+    def subscribe(self, types: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """Switch the connection to event streaming and yield events forever."""
+        self.call("subscribe", types=types)
+        for line in self._file:
+            yield json.loads(line)
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self) -> "DaemonClient":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def print_vms(vms: List[Dict[str, Any]]) -> None:
+    """Print registry entries as a table."""
+    if not vms:
+        print("No VMs registered.")
+        return
+    print(f"{'VM':<8} {'STATE':<9} {'PID':<8} {'TAP':<8} {'MAC':<18} {'CID':<5} SOCKET")
+    print("-" * 100)
+    for vm in vms:
+        print(
+            f"{vm['vm_id']:<8} {vm['state']:<9} {str(vm['pid'] or '-'):<8} {vm['tap']:<8} "
+            f"{vm['guest_mac']:<18} {vm['guest_cid']:<5} {vm['api_socket']}"
+        )
+
+def print_idle(report: Dict[str, Any]) -> None:
+    def ms(value: Optional[float]) -> str:
+        return f"{value * 1000:.0f} ms" if value is not None else "-"
+
+    policy = report["policy"]
+    print_color(
+        f"Idle eviction after {policy['idle_after']:g}s" if policy else "Idle eviction off (evict/revive by hand)",
+        Colors.HEADER
+    )
+    print(
+        f"{report['evictions']} eviction(s), {report['revivals']} revival(s), {report['failures']} failure(s), "
+        f"{report['freed_mib']:.0f} MiB freed; revival p50 {ms(report['revive_p50_s'])}, "
+        f"p90 {ms(report['revive_p90_s'])}, max {ms(report['revive_max_s'])}"
+    )
+    for vm in report["vms"]:
+        idle = f"{vm['idle_s']:.0f}s" if vm["idle_s"] is not None else "-"
+        print(
+            f"  {vm['vm_id']:<8} {vm['state']:<9} idle {idle:>6}  evicted {vm['evictions']:>3}x  revived {vm['revivals']:>3}x"
+            + (f"  ports {', '.join(vm['forwards'])}" if vm["forwards"] else "")
+        )
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Sandbox daemon: owns Firecracker VMs and answers queries from an in-memory registry",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--socket", default=DEFAULT_DAEMON_SOCKET, help="Daemon control socket")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="Run the daemon in the foreground")
+    serve.add_argument("--state-dir", default=DEFAULT_STATE_DIR, help="Registry and VM working directories")
+    serve.add_argument("--template", default=DEFAULT_TEMPLATE, help="Firecracker config used as template")
+    serve.add_argument("--firecracker", default="firecracker", help="Firecracker binary")
+    serve.add_argument("--setup-taps", action="store_true", help="Create a tap device per VM")
+    serve.add_argument("--idle-after", type=float, default=0.0, help="Snapshot and evict VMs idle this many seconds (0 = never)")
+    serve.add_argument("--idle-interval", type=float, default=10.0, help="Seconds between activity samples")
+    serve.add_argument("--idle-cpu", type=float, default=0.02, help="vCPU share of one CPU below which a VM counts as idle")
+    serve.add_argument("--idle-net", type=float, default=512.0, help="Tap bytes per second below which a VM counts as idle")
+    serve.add_argument("--restore-backend", choices=("file", "uffd"), default="file", help="Memory backend used to revive evicted VMs")
+    serve.add_argument("--revive-timeout", type=float, default=DEFAULT_REVIVE_TIMEOUT, help="Seconds a revival waits for memory headroom before the connection fails")
+    serve.add_argument("--forward-bind", default="127.0.0.1", help="Address forwarded ports listen on")
+    serve.add_argument("--leases", default=DEFAULT_LEASE_PATH, help="Lease file handing out taps, /30s and MACs (FC_NET_LEASES)")
+    serve.add_argument("--no-leases", action="store_true", help="Derive taps, /30s and MACs from the VM index instead")
+
+    launch = sub.add_parser("launch", help="Launch VMs")
+    launch.add_argument("--count", type=int, default=1, help="Number of VMs")
+    launch.add_argument("--wait-ready", action="store_true", help="Wait until the guests report ready")
+    launch.add_argument("--queue", action="store_true", help="Wait for memory headroom instead of rejecting")
+    launch.add_argument("--job", action="append", default=[], metavar="KEY=VALUE", help="Job parameter published through MMDS (repeatable)")
+    launch.add_argument("--forward", action="append", default=[], metavar="HOST:GUEST", help="Forward a host port to the guest, reviving it when evicted (repeatable)")
+
+    sub.add_parser("headroom", help="Show host memory committed to VMs and the headroom left")
+
+    idle = sub.add_parser("idle", help="Show eviction and revival counts and revival latency")
+    idle.add_argument("--json", action="store_true", help="Print JSON")
+
+    lst = sub.add_parser("list", help="List registered VMs")
+    lst.add_argument("--json", action="store_true", help="Print JSON")
+    lst.add_argument("--state", action="append", help="Only show VMs in this state (repeatable)")
+
+    for name, help_text in (
+        ("status", "Show one VM"), ("pause", "Pause a VM"), ("resume", "Resume a VM"),
+        ("evict", "Snapshot a VM and stop it until a client connects"), ("revive", "Restore an evicted VM")
+    ):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("vm_id", help="VM id")
+
+    snap = sub.add_parser("snapshot", help="Snapshot a VM")
+    snap.add_argument("vm_id", help="VM id")
+    snap.add_argument("--dir", help="Snapshot directory (default: snapshots/<vm>-<timestamp>)")
+
+    stop = sub.add_parser("stop", help="Gracefully stop VMs")
+    stop.add_argument("vm_ids", nargs="*", help="VM ids (default: all running)")
+    stop.add_argument("--timeout", type=float, default=10.0, help="Seconds to wait for a clean shutdown")
+
+    remove = sub.add_parser("remove", help="Forget stopped VMs")
+    remove.add_argument("vm_ids", nargs="+", help="VM ids")
+
+    events = sub.add_parser("events", help="Stream lifecycle events as JSON lines")
+    events.add_argument("--type", action="append", help="Only show events of this type (repeatable)")
+
+    shutdown = sub.add_parser("shutdown", help="Stop the daemon")
+    shutdown.add_argument("--stop-vms", action="store_true", help="Stop all VMs first")
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        policy = IdlePolicy(args.idle_after, args.idle_interval, args.idle_cpu, args.idle_net) if args.idle_after else None
+        daemon = SandboxDaemon(
+            args.socket, args.state_dir, args.template, args.firecracker, args.setup_taps,
+            policy, args.restore_backend, args.forward_bind,
+            None if args.no_leases else NetworkAllocator(state_path=args.leases), args.revive_timeout
+        )
+        try:
+            asyncio.run(daemon.serve())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    try:
+        with DaemonClient(args.socket, timeout=None if args.command == "events" else 120.0) as client:
+            if args.command == "events":
+                for event in client.subscribe(args.type):
+                    print(json.dumps(event), flush=True)
+            elif args.command == "launch":
+                print_vms(client.call(
+                    "launch", count=args.count, wait_ready=args.wait_ready, queue=args.queue, job=parse_pairs(args.job),
+                    forward=args.forward
+                ))
+            elif args.command == "headroom":
+                print_headroom(Headroom(**client.call("headroom")))
+            elif args.command == "list":
+                vms = client.call("list", states=args.state)
+                if args.json:
+                    print(json.dumps(vms, indent=2))
+                else:
+                    print_vms(vms)
+            elif args.command == "idle":
+                report = client.call("idle")
+                if args.json:
+                    print(json.dumps(report, indent=2))
+                else:
+                    print_idle(report)
+            elif args.command in ("status", "pause", "resume", "evict", "revive"):
+                print(json.dumps(client.call(args.command, vm_id=args.vm_id), indent=2))
+            elif args.command == "snapshot":
+                result = client.call("snapshot", vm_id=args.vm_id, dir=args.dir)
+                print_color(f"Snapshot written to {result['dir']} (guest paused {result['paused_s'] * 1000:.1f} ms)", Colors.OKGREEN)
+            elif args.command == "stop":
+                for result in client.call("stop", vm_ids=args.vm_ids, timeout=args.timeout):
+                    print(f"{result['vm_id']:<8} {result['method']:<15} {result['elapsed']:.2f}s")
+            elif args.command == "remove":
+                print_color(f"Removed {', '.join(client.call('remove', vm_ids=args.vm_ids))}", Colors.OKGREEN)
+            elif args.command == "shutdown":
+                client.call("shutdown", stop_vms=args.stop_vms)
+                print_color("Daemon stopping.", Colors.OKGREEN)
+    except (FileNotFoundError, ConnectionRefusedError):
+        print_color(f"Error: sandbox daemon is not running on {args.socket}.", Colors.FAIL)
+        sys.exit(1)
+    except (RuntimeError, ValueError) as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import subprocess
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List
+
+from firecracker_api import Colors, print_color, FirecrackerClient, FirecrackerAPIError, wait_for_api_socket
+from vm_uffd import UffdError, start_page_server
+
+HUGEPAGES_ROOT = "/sys/kernel/mm/hugepages"
+# Firecracker only backs guest memory with 2M pages ("huge_pages": "2M").
+HUGE_PAGE_SIZES_KB = {"2M": 2048}
+
+class HugepageError(Exception):
+    """Raised when the host hugepage pool cannot satisfy a request."""
+
+@dataclass
+class PoolStatus:
+    """Counters of one hugepage size, in pages."""
+    size: str
+    total: int
+    free: int
+    reserved: int
+    surplus: int
+
+    @property
+    def available(self) -> int:
+        # Reserved pages are promised to mappings that have not faulted them in yet.
+        return max(0, self.free - self.reserved)
+
+class HugepagePool:
+    """
+    Sizes the kernel's persistent hugepage pool for the VMs about to run.
+
+    Guest memory backed by hugepages comes out of this pool when firecracker
+    maps it, and a VM that does not fit fails to start. The pool is grown
+    before a batch of VMs is launched, VMs are only admitted while it has
+    room for their whole memory, and unused pages are handed back to the
+    kernel afterwards.
+    """
+
+    def __init__(self, size: str = "2M", root: str = HUGEPAGES_ROOT):
+        if size not in HUGE_PAGE_SIZES_KB:
+            raise HugepageError(f"unsupported hugepage size {size!r}; choose from {', '.join(HUGE_PAGE_SIZES_KB)}")
+        self.size = size
+        self.page_kb = HUGE_PAGE_SIZES_KB[size]
+        self.path = os.path.join(root, f"hugepages-{self.page_kb}kB")
+
+    def _read(self, name: str) -> int:
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            raise HugepageError(f"{self.size} hugepages are not supported by this kernel ({self.path} missing)")
+
+    def status(self) -> PoolStatus:
+        return PoolStatus(
+            size=self.size,
+            total=self._read("nr_hugepages"),
+            free=self._read("free_hugepages"),
+            reserved=self._read("resv_hugepages"),
+            surplus=self._read("surplus_hugepages")
+        )
+
+    def pages_for(self, mem_mib: int) -> int:
+        """Pages needed to back `mem_mib` of guest memory."""
+        return -(-mem_mib * 1024 // self.page_kb)
+
+    def capacity(self, mem_mib: int) -> int:
+        """How many more VMs of `mem_mib` the pool can back right now."""
+        return self.status().available // self.pages_for(mem_mib)
+
+    def admit(self, mem_mib: int) -> None:
+        """
+        Check that one more VM of `mem_mib` fits.
+
+        Raises:
+            HugepageError: if the pool is exhausted
+        """
+        status = self.status()
+        needed = self.pages_for(mem_mib)
+        if status.available < needed:
+            raise HugepageError(
+                f"hugepage pool exhausted: {mem_mib} MiB needs {needed} x {self.size} pages, "
+                f"{status.available} available"
+            )
+
+    def set_total(self, pages: int) -> int:
+        """Resize the persistent pool; returns the size the kernel actually granted."""
+        target = os.path.join(self.path, "nr_hugepages")
+        if os.geteuid() == 0:
+            with open(target, "w") as f:
+                f.write(str(pages))
+        else:
+            subprocess.run(["sudo", "tee", target], input=str(pages).encode(), stdout=subprocess.DEVNULL, check=True)
+        return self._read("nr_hugepages")
+
+    def reserve(self, vm_count: int, mem_mib: int) -> PoolStatus:
+        """
+        Grow the pool until `vm_count` VMs of `mem_mib` fit.
+
+        Raises:
+            HugepageError: if the kernel could not find enough contiguous
+                memory; the pages it did allocate are kept
+        """
+        status = self.status()
+        needed = vm_count * self.pages_for(mem_mib)
+        shortfall = needed - status.available
+        if shortfall > 0:
+            granted = self.set_total(status.total + shortfall)
+            if granted < status.total + shortfall:
+                raise HugepageError(
+                    f"asked the kernel for {status.total + shortfall} x {self.size} pages but got {granted}; "
+                    "host memory is too fragmented or too small"
+                )
+        return self.status()
+
+    def release(self, vm_count: int = 0, mem_mib: int = 0) -> PoolStatus:
+        """Give unused pages back, all of them unless a VM count and size are given."""
+        return self.shrink(vm_count * self.pages_for(mem_mib) if vm_count else self.status().available)
+
+    def shrink(self, pages: int) -> PoolStatus:
+        """Give back up to `pages` unused pages, e.g. the ones reserved for VMs that have stopped."""
+        status = self.status()
+        unused = min(status.available, pages)
+        if unused > 0:
+            self.set_total(status.total - unused)
+        return self.status()
+
+def configured_memory(template: Dict[str, Any]) -> int:
+    """Guest memory size of a firecracker config, in MiB."""
+    return int(template.get("machine-config", {}).get("mem_size_mib", 128))
+
+def print_status(status: PoolStatus, mem_mib: Optional[int] = None, pool: Optional[HugepagePool] = None) -> None:
+    page_mib = HUGE_PAGE_SIZES_KB[status.size] / 1024
+    print(f"{status.size} pages: total {status.total}, free {status.free}, reserved {status.reserved}, "
+          f"surplus {status.surplus}, available {status.available} ({status.available * page_mib:.0f} MiB)")
+    if mem_mib and pool:
+        print(f"Room for {status.available // pool.pages_for(mem_mib)} more VM(s) of {mem_mib} MiB")
+
+# Benchmark
+
+def _launcher(args: List[str]) -> Dict[str, Any]:
+    tool = os.path.join(os.path.dirname(os.path.abspath(__file__)), "vm_launcher.py")
+    result = subprocess.run([sys.executable, tool] + args, capture_output=True, text=True)
+    if result.returncode != 0 and not result.stdout.strip().startswith("{"):
+        raise RuntimeError(f"vm_launcher {' '.join(args[:3])} failed: {result.stderr.strip() or result.stdout.strip()}")
+    return json.loads(result.stdout) if result.stdout.strip().startswith("{") else {}
+
+def _time_restore(vm: Dict[str, Any], firecracker_bin: str, timeout: float) -> Dict[str, Any]:
+    """
+    Snapshot a running VM, kill it and time loading the snapshot into a fresh VMM.
+
+    Firecracker restores hugepage-backed memory only through the Uffd
+    backend, so both profiles are loaded through a vm_uffd.py page server
+    and measured the same way.
+    """
+    spec = vm["spec"]
+    workdir = spec["workdir"]
+    snapshot_path = os.path.join(workdir, "bench.vmstate")
+    mem_path = os.path.join(workdir, "bench.mem")
+    with FirecrackerClient(spec["api_socket"]) as client:
+        client.pause()
+        client.create_snapshot(snapshot_path, mem_path)
+    # Kill rather than shut down so the disk matches the snapshot.
+    os.kill(vm["pid"], signal.SIGKILL)
+    for path in (spec["api_socket"], spec["vsock_path"]):
+        if os.path.exists(path):
+            os.unlink(path)
+
+    restore_socket = os.path.join(workdir, "restore.socket")
+    uffd_socket = f"{restore_socket}.uffd"
+    page_server = None
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        [firecracker_bin, "--api-sock", restore_socket],
+        cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+    try:
+        try:
+            page_server = start_page_server(uffd_socket, mem_file=mem_path, timeout=timeout)
+        except UffdError as e:
+            return {"restore_s": None, "detail": str(e)}
+        if not wait_for_api_socket(restore_socket, timeout):
+            return {"restore_s": None, "detail": "restore VMM did not start"}
+        try:
+            with FirecrackerClient(restore_socket, timeout=timeout) as client:
+                client.load_snapshot(
+                    snapshot_path, mem_backend={"backend_type": "Uffd", "backend_path": uffd_socket}, resume_vm=True
+                )
+        except FirecrackerAPIError as e:
+            return {"restore_s": None, "detail": e.fault}
+        return {"restore_s": time.monotonic() - start, "detail": ""}
+    finally:
+        proc.kill()
+        proc.wait()
+        if page_server:
+            page_server.kill()
+            page_server.wait()
+        for path in (restore_socket, uffd_socket, snapshot_path, mem_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+def benchmark(
+    template_path: str,
+    base_dir: str,
+    count: int = 4,
+    firecracker_bin: str = "firecracker",
+    setup_taps: bool = False,
+    ready_timeout: float = 60.0
+) -> Dict[str, Any]:
+    """
+    Boot `count` VMs with 4K pages and then with 2M hugepages and compare
+    the time until each guest is ready, plus the time to restore one of
+    them from a full snapshot.
+    """
+    with open(template_path) as f:
+        mem_mib = configured_memory(json.load(f))
+    pool = HugepagePool("2M")
+    report: Dict[str, Any] = {"count": count, "mem_size_mib": mem_mib}
+
+    for profile in ("4K", "2M"):
+        args = [
+            "--base-dir", os.path.join(base_dir, profile.lower()), "--prefix", f"hp{profile.lower()}",
+            "up", "--count", str(count), "--template", template_path, "--firecracker", firecracker_bin,
+            "--wait-ready", "--ready-timeout", str(ready_timeout), "--json"
+        ]
+        if setup_taps:
+            args.append("--setup-taps")
+        if profile == "2M":
+            pool.reserve(count, mem_mib)
+            args += ["--huge-pages", "2M"]
+        try:
+            launch = _launcher(args)
+            ready = sorted(vm["guest_ready_s"] for vm in launch.get("vms", []) if vm["guest_ready_s"] is not None)
+            result: Dict[str, Any] = {
+                "launched": launch.get("launched", 0),
+                "boot_p50_s": ready[len(ready) // 2] if ready else None,
+                "boot_max_s": ready[-1] if ready else None,
+                "wall_s": launch.get("wall_s")
+            }
+            booted = [vm for vm in launch.get("vms", []) if vm["error"] is None]
+            if booted:
+                result.update(_time_restore(booted[0], firecracker_bin, ready_timeout))
+            report[profile] = result
+        finally:
+            _launcher(["--base-dir", os.path.join(base_dir, profile.lower()), "down"] + (["--remove-taps"] if setup_taps else []))
+            if profile == "2M":
+                pool.release(count, mem_mib)
+
+    def delta(key: str) -> Optional[float]:
+        small, huge = report["4K"].get(key), report["2M"].get(key)
+        return round((huge - small) / small * 100, 1) if small and huge else None
+
+    report["boot_p50_change_pct"] = delta("boot_p50_s")
+    report["restore_change_pct"] = delta("restore_s")
+    return report
+
+def print_benchmark(report: Dict[str, Any]) -> None:
+    def s(value: Optional[float]) -> str:
+        return f"{value * 1000:.1f} ms" if value is not None else "n/a"
+
+    print_color(f"{report['count']} VM(s) with {report['mem_size_mib']} MiB of guest memory:", Colors.HEADER)
+    print(f"{'pages':<6} {'launched':>8} {'boot p50':>12} {'boot max':>12} {'restore':>12}")
+    for profile in ("4K", "2M"):
+        r = report[profile]
+        print(f"{profile:<6} {r['launched']:>8} {s(r['boot_p50_s']):>12} {s(r['boot_max_s']):>12} {s(r.get('restore_s')):>12}")
+        if r.get("detail"):
+            print_color(f"       restore: {r['detail']}", Colors.WARNING)
+    for key, label in (("boot_p50_change_pct", "boot p50"), ("restore_change_pct", "restore")):
+        if report[key] is not None:
+            print_color(f"{label} with 2M pages: {report[key]:+.1f}%", Colors.OKGREEN if report[key] <= 0 else Colors.WARNING)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage the host hugepage pool backing Firecracker guest memory",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--size", default="2M", choices=sorted(HUGE_PAGE_SIZES_KB), help="Hugepage size")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    status = sub.add_parser("status", help="Show the pool and how many VMs fit")
+    status.add_argument("--mem", type=int, default=0, help="Guest memory in MiB to compute room for")
+
+    reserve = sub.add_parser("reserve", help="Grow the pool so COUNT more VMs fit")
+    reserve.add_argument("--count", type=int, required=True, help="Number of VMs about to be scheduled")
+    reserve.add_argument("--mem", type=int, required=True, help="Guest memory per VM in MiB")
+
+    release = sub.add_parser("release", help="Return unused pages to the kernel")
+    release.add_argument("--count", type=int, default=0, help="Release pages for this many VMs (0 = all unused)")
+    release.add_argument("--mem", type=int, default=0, help="Guest memory per VM in MiB")
+
+    bench = sub.add_parser("bench", help="Compare boot and restore time on 4K pages and 2M hugepages")
+    bench.add_argument("--count", type=int, default=4, help="VMs to boot per profile")
+    bench.add_argument("--template", default="vm-config.json", help="Firecracker config used as template")
+    bench.add_argument("--base-dir", default="vms/hugepages-bench", help="Working directory for the benchmark VMs")
+    bench.add_argument("--firecracker", default="firecracker", help="Firecracker binary")
+    bench.add_argument("--setup-taps", action="store_true", help="Create a tap device per VM")
+    bench.add_argument("--ready-timeout", type=float, default=60.0, help="Seconds to wait for each guest")
+    bench.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    args = parser.parse_args()
+
+    try:
+        pool = HugepagePool(args.size)
+        if args.command == "status":
+            print_status(pool.status(), args.mem, pool)
+        elif args.command == "reserve":
+            print_status(pool.reserve(args.count, args.mem), args.mem, pool)
+        elif args.command == "release":
+            print_status(pool.release(args.count, args.mem))
+        elif args.command == "bench":
+            report = benchmark(args.template, args.base_dir, args.count, args.firecracker, args.setup_taps, args.ready_timeout)
+            if args.json:
+                print(json.dumps(report, indent=2))
+            else:
+                print_benchmark(report)
+    except (HugepageError, RuntimeError) as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print_color(f"Error: could not resize the hugepage pool ({e})", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
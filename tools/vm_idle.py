@@ -0,0 +1,266 @@
+import os
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional, Dict, Any, List, Tuple, Callable, Awaitable
+
+from vm_pool import percentile
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+# Firecracker names its vCPU threads "fc_vcpu <n>"; the VMM and API threads do not count as guest activity.
+VCPU_THREAD_PREFIX = "fc_vcpu"
+# Socket state in /proc/net/unix for a connected stream socket.
+UNIX_CONNECTED = "03"
+SPLICE_CHUNK = 64 * 1024
+
+@dataclass
+class Activity:
+    """Host-side counters of one VM; the detector only looks at how they change."""
+    vcpu_s: float = 0.0
+    net_bytes: int = 0
+    vsock_connections: int = 0
+
+@dataclass
+class IdlePolicy:
+    """When a VM counts as idle, and for how long it must stay idle before it is evicted."""
+    idle_after: float = 600.0
+    interval: float = 10.0
+    cpu_fraction: float = 0.02
+    net_bytes_per_s: float = 512.0
+
+def vcpu_seconds(pid: int) -> float:
+    """CPU time the VM's vCPU threads have used."""
+    ticks = 0
+    for tid in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{tid}/comm") as f:
+                if not f.read().startswith(VCPU_THREAD_PREFIX):
+                    continue
+            with open(f"/proc/{pid}/task/{tid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            ticks += int(fields[11]) + int(fields[12])
+        except OSError:
+            # The thread exited between listing and reading.
+            continue
+    return ticks / CLK_TCK
+
+def tap_bytes(tap: str) -> int:
+    """Bytes received and sent on a tap device, 0 when it does not exist."""
+    total = 0
+    for counter in ("rx_bytes", "tx_bytes"):
+        try:
+            with open(f"/sys/class/net/{tap}/statistics/{counter}") as f:
+                total += int(f.read())
+        except OSError:
+            pass
+    return total
+
+def vsock_connections(vsock_path: str) -> int:
+    """
+    Open host-side connections on a VM's vsock device.
+
+    Accepted sockets carry the address they were accepted on, so both
+    host-initiated connections (on the device socket itself) and
+    guest-initiated ones (on `<path>_<port>` listeners) show up by path.
+    """
+    paths = {vsock_path, os.path.abspath(vsock_path)}
+    count = 0
+    with open("/proc/net/unix") as f:
+        next(f)
+        for line in f:
+            parts = line.split()
+            if len(parts) < 8 or parts[5] != UNIX_CONNECTED:
+                continue
+            path = parts[7]
+            if path in paths or any(path.startswith(f"{p}_") for p in paths):
+                count += 1
+    return count
+
+def sample_activity(pid: int, tap: str, vsock_path: str) -> Activity:
+    return Activity(vcpu_seconds(pid), tap_bytes(tap), vsock_connections(vsock_path))
+
+class IdleTracker:
+    """
+    Turn successive activity samples into idle time per VM.
+
+    A VM is active during an interval if its vCPUs used more than
+    `cpu_fraction` of a CPU, its tap moved more than `net_bytes_per_s`,
+    or it had a vsock or forwarded connection open. Idle time counts from
+    the end of the last active interval.
+    """
+
+    def __init__(self, policy: IdlePolicy):
+        self.policy = policy
+        self._last: Dict[str, Tuple[float, Activity]] = {}
+        self._idle_since: Dict[str, float] = {}
+
+    def observe(self, vm_id: str, activity: Activity, busy: bool = False, now: Optional[float] = None) -> float:
+        """Record a sample and return how long the VM has been idle."""
+        now = time.monotonic() if now is None else now
+        last = self._last.get(vm_id)
+        self._last[vm_id] = (now, activity)
+        if last is None:
+            self._idle_since[vm_id] = now
+            return 0.0
+        elapsed = max(now - last[0], 1e-6)
+        active = (
+            busy or activity.vsock_connections > 0
+            or (activity.vcpu_s - last[1].vcpu_s) / elapsed > self.policy.cpu_fraction
+            or (activity.net_bytes - last[1].net_bytes) / elapsed > self.policy.net_bytes_per_s
+        )
+        if active:
+            self._idle_since[vm_id] = now
+        return now - self._idle_since[vm_id]
+
+    def idle_for(self, vm_id: str) -> Optional[float]:
+        since = self._idle_since.get(vm_id)
+        return None if since is None else time.monotonic() - since
+
+    def forget(self, vm_id: str) -> None:
+        self._last.pop(vm_id, None)
+        self._idle_since.pop(vm_id, None)
+
+class ScaleToZeroStats:
+    """Eviction and revival counters, with the latency of recent revivals."""
+
+    def __init__(self, window: int = 1000):
+        self.evictions = 0
+        self.revivals = 0
+        self.failures = 0
+        self.freed_kib = 0
+        self._evict_s: deque = deque(maxlen=window)
+        self._revive_s: deque = deque(maxlen=window)
+
+    def evicted(self, elapsed: float, freed_kib: int) -> None:
+        self.evictions += 1
+        self.freed_kib += freed_kib
+        self._evict_s.append(elapsed)
+
+    def revived(self, elapsed: float) -> None:
+        self.revivals += 1
+        self._revive_s.append(elapsed)
+
+    def report(self) -> Dict[str, Any]:
+        revive = list(self._revive_s)
+        return {
+            "evictions": self.evictions,
+            "revivals": self.revivals,
+            "failures": self.failures,
+            "freed_mib": self.freed_kib / 1024,
+            "evict_p50_s": percentile(list(self._evict_s), 50),
+            "revive_p50_s": percentile(revive, 50),
+            "revive_p90_s": percentile(revive, 90),
+            "revive_max_s": max(revive) if revive else None
+        }
+
+async def _splice(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            data = await reader.read(SPLICE_CHUNK)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof()
+    except (ConnectionError, OSError):
+        writer.close()
+
+async def _connect(
+    connect: Callable[[], Awaitable[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]],
+    timeout: float
+) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """Retry a connection while a freshly restored guest brings its service back."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await connect()
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.02)
+
+class Front:
+    """
+    Host-side endpoints of one VM that outlive its eviction.
+
+    Forwarded TCP ports always go through here, so open connections count
+    as activity. While the VM is evicted, a listener also holds its vsock
+    socket path. A client connecting to either triggers `revive` and is
+    then spliced through to the restored guest; vsock clients have their
+    `CONNECT <port>` line replayed to the new VMM.
+    """
+
+    def __init__(
+        self,
+        vm_id: str,
+        guest_address: str,
+        vsock_path: str,
+        revive: Callable[[], Awaitable[Any]],
+        forwards: Optional[List[Tuple[int, int]]] = None,
+        bind: str = "127.0.0.1",
+        connect_timeout: float = 30.0
+    ):
+        self.vm_id = vm_id
+        self.guest_address = guest_address
+        self.vsock_path = vsock_path
+        self.revive = revive
+        self.forwards = forwards or []
+        self.bind = bind
+        self.connect_timeout = connect_timeout
+        self.connections = 0
+        self._servers: List[asyncio.AbstractServer] = []
+        self._vsock: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        for host_port, guest_port in self.forwards:
+            self._servers.append(await asyncio.start_server(
+                lambda r, w, port=guest_port: self._forward(r, w, port), self.bind, host_port
+            ))
+
+    async def hold_vsock(self) -> None:
+        """Listen on the VM's vsock path while no VMM does."""
+        if self._vsock:
+            return
+        if os.path.exists(self.vsock_path):
+            os.unlink(self.vsock_path)
+        self._vsock = await asyncio.start_unix_server(self._vsock_client, self.vsock_path)
+
+    def release_vsock(self) -> None:
+        """Give the vsock path back so the restored VMM can bind it."""
+        if self._vsock:
+            # Not wait_closed(): it would wait for the connection that triggered the revival.
+            self._vsock.close()
+            self._vsock = None
+        if os.path.exists(self.vsock_path):
+            os.unlink(self.vsock_path)
+
+    def close(self) -> None:
+        self.release_vsock()
+        for server in self._servers:
+            server.close()
+        self._servers = []
+
+    async def _pipe(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, connect, greeting: bytes = b"") -> None:
+        self.connections += 1
+        try:
+            await self.revive()
+            up_reader, up_writer = await _connect(connect, self.connect_timeout)
+            if greeting:
+                up_writer.write(greeting)
+            await asyncio.gather(_splice(reader, up_writer), _splice(up_reader, writer))
+            up_writer.close()
+        except Exception:
+            # Revival or the guest connection failed; the client sees the connection close.
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def _forward(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, guest_port: int) -> None:
+        await self._pipe(reader, writer, lambda: asyncio.open_connection(self.guest_address, guest_port))
+
+    async def _vsock_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        greeting = await reader.readline()
+        await self._pipe(reader, writer, lambda: asyncio.open_unix_connection(self.vsock_path), greeting)
@@ -0,0 +1,698 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import shutil
+import subprocess
+import asyncio
+import argparse
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Dict, Any, List
+
+from firecracker_api import Colors, print_color
+from vm_ready import DEFAULT_PATTERN, wait_for_console
+from vm_teardown import TeardownTarget, TeardownResult, teardown_many, print_results
+from vm_hugepages import HUGE_PAGE_SIZES_KB, HugepagePool, HugepageError, configured_memory
+from vm_admission import AdmissionController, AdmissionPolicy, AdmissionError
+from vm_qos import apply_to_config as apply_qos, resolve as resolve_qos
+from vm_mmds import METADATA_FILE, DEFAULT_SUBNET, guest_network, build_metadata, mmds_config, write_metadata, parse_pairs
+from vm_netlease import DEFAULT_LEASE_PATH, NetworkAllocator, LeaseError
+
+DEFAULT_TEMPLATE = "vm-config.json"
+DEFAULT_BASE_DIR = "vms"
+STATE_FILE = "vm.json"
+
+@dataclass
+class VMSpec:
+    """Per-VM paths and identity derived from the launch index."""
+    vm_id: str
+    index: int
+    workdir: str
+    api_socket: str
+    vsock_path: str
+    log_path: str
+    console_path: str
+    config_path: str
+    metadata_path: str
+    rootfs_path: str
+    tap: str
+    guest_mac: str
+    guest_cid: int
+
+@dataclass
+class VMInstance:
+    """A launched firecracker process and its boot timings."""
+    spec: VMSpec
+    pid: Optional[int] = None
+    started_at: float = 0.0
+    api_ready_s: Optional[float] = None
+    guest_ready_s: Optional[float] = None
+    error: Optional[str] = None
+    huge_pages: Optional[str] = None
+    # Pages this VM's launch added to the hugepage pool, handed back by `down`.
+    hugepages_reserved: int = 0
+    process: Optional[asyncio.subprocess.Process] = field(default=None, repr=False)
+
+    def state(self) -> Dict[str, Any]:
+        """Serialisable state written next to the VM's sockets."""
+        return {
+            "spec": asdict(self.spec),
+            "pid": self.pid,
+            "started_at": self.started_at,
+            "api_ready_s": self.api_ready_s,
+            "guest_ready_s": self.guest_ready_s,
+            "error": self.error,
+            "huge_pages": self.huge_pages,
+            "hugepages_reserved": self.hugepages_reserved
+        }
+
+def load_template(path: str) -> Dict[str, Any]:
+    """Load a Firecracker config file to use as the per-VM template."""
+    with open(path) as f:
+        return json.load(f)
+
+def make_spec(index: int, base_dir: str, prefix: str = "fc") -> VMSpec:
+    """Derive socket, vsock, log, tap and MAC names for VM number `index`."""
+    vm_id = f"{prefix}-{index:03d}"
+    workdir = os.path.abspath(os.path.join(base_dir, vm_id))
+    mac_suffix = index + 1
+    return VMSpec(
+        vm_id=vm_id,
+        index=index,
+        workdir=workdir,
+        api_socket=os.path.join(workdir, "firecracker.socket"),
+        vsock_path=os.path.join(workdir, "vsock.sock"),
+        log_path=os.path.join(workdir, "firecracker.log"),
+        console_path=os.path.join(workdir, "console.log"),
+        config_path=os.path.join(workdir, "vm-config.json"),
+        metadata_path=os.path.join(workdir, METADATA_FILE),
+        rootfs_path=os.path.join(workdir, "rootfs.ext4"),
+        tap=f"{prefix}tap{index}",
+        guest_mac=f"06:00:00:00:{(mac_suffix >> 8) & 0xff:02x}:{mac_suffix & 0xff:02x}",
+        guest_cid=3 + index
+    )
+
+def _host_path(template_dir: str, path: str) -> str:
+    return os.path.normpath(os.path.join(template_dir, path))
+
+def render_config(
+    template: Dict[str, Any],
+    spec: VMSpec,
+    template_dir: str,
+    huge_pages: Optional[str] = None,
+    qos: Optional[Dict[str, Any]] = None,
+    shared_rootfs: bool = False
+) -> Dict[str, Any]:
+    """
+    Produce the config for one VM from the shared template.
+
+    Relative host paths in the template are resolved against the template's
+    directory; everything that must be unique per VM is rewritten.
+    `huge_pages` ("2M") backs guest memory with hugepages and `qos` (a
+    resolved vm_qos profile) rate-limits its drives and interfaces. With
+    `shared_rootfs` every VM boots the template's root image read-only
+    behind a tmpfs overlay instead of a private copy. Identity and
+    network settings reach the guest through MMDS, not the image.
+    """
+    config = json.loads(json.dumps(template))
+    mmds_config(config)
+
+    if qos:
+        apply_qos(config, qos)
+
+    if huge_pages:
+        config.setdefault("machine-config", {})["huge_pages"] = huge_pages
+
+    boot = config.get("boot-source", {})
+    if "kernel_image_path" in boot:
+        boot["kernel_image_path"] = _host_path(template_dir, boot["kernel_image_path"])
+    if shared_rootfs and "boot_args" in boot:
+        boot["boot_args"] = overlay_boot_args(boot["boot_args"])
+
+    for drive in config.get("drives", []):
+        if drive.get("is_root_device") and not drive.get("is_read_only") and shared_rootfs:
+            drive["path_on_host"] = _host_path(template_dir, drive["path_on_host"])
+            drive["is_read_only"] = True
+        elif drive.get("is_root_device") and not drive.get("is_read_only"):
+            drive["path_on_host"] = spec.rootfs_path
+        else:
+            drive["path_on_host"] = _host_path(template_dir, drive["path_on_host"])
+
+    for share in config.get("fs", {}).get("virtiofs", []):
+        share["path_on_host"] = _host_path(template_dir, share["path_on_host"])
+
+    if "logger" in config:
+        config["logger"]["log_path"] = spec.log_path
+
+    for iface in config.get("network-interfaces", []):
+        if iface.get("iface_id") == "eth0":
+            iface["host_dev_name"] = spec.tap
+            iface["guest_mac"] = spec.guest_mac
+
+    if "vsock" in config:
+        config["vsock"]["uds_path"] = spec.vsock_path
+        config["vsock"]["guest_cid"] = spec.guest_cid
+
+    return config
+
+def overlay_boot_args(boot_args: str) -> str:
+    """
+    Boot a read-only root through /sbin/overlay-init (tools/overlay-init.sh).
+
+    The original init is handed over in `real_init`, which the kernel
+    passes to init as an environment variable.
+    """
+    args = []
+    real_init = "/sbin/init"
+    for arg in boot_args.split():
+        if arg.startswith("init="):
+            real_init = arg[len("init="):]
+        elif arg != "rw":
+            args.append(arg)
+    return " ".join(args + ["ro", "init=/sbin/overlay-init", f"real_init={real_init}"])
+
+def template_rootfs(template: Dict[str, Any], template_dir: str) -> Optional[str]:
+    """Return the writable root drive image of the template, if any."""
+    for drive in template.get("drives", []):
+        if drive.get("is_root_device") and not drive.get("is_read_only"):
+            return _host_path(template_dir, drive["path_on_host"])
+    return None
+
+def _privileged(cmd: List[str]) -> List[str]:
+    return cmd if os.geteuid() == 0 else ["sudo"] + cmd
+
+async def _run(cmd: List[str]) -> int:
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+    )
+    return await proc.wait()
+
+async def ensure_tap(tap: str, host_address: Optional[str] = None) -> None:
+    """Create the tap device if missing, give it the host end of the VM's link and bring it up."""
+    if not os.path.exists(f"/sys/class/net/{tap}"):
+        if await _run(_privileged(["ip", "tuntap", "add", tap, "mode", "tap"])) != 0:
+            raise RuntimeError(f"failed to create tap device {tap}")
+    if host_address:
+        await _run(_privileged(["ip", "addr", "replace", host_address, "dev", tap]))
+    await _run(_privileged(["ip", "link", "set", tap, "up"]))
+
+async def remove_tap(tap: str) -> None:
+    """Delete the tap device, ignoring devices that are already gone."""
+    if os.path.exists(f"/sys/class/net/{tap}"):
+        await _run(_privileged(["ip", "link", "delete", tap]))
+
+async def clone_rootfs(source: str, dest: str) -> None:
+    """Give the VM a private copy of the root image (reflinked where supported)."""
+    if os.path.exists(dest):
+        return
+    if await _run(["cp", "--reflink=auto", "--sparse=always", source, dest]) != 0:
+        raise RuntimeError(f"failed to copy {source} to {dest}")
+
+async def wait_for_socket(path: str, timeout: float) -> bool:
+    """Poll until a Unix socket accepts connections."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.exists(path):
+            try:
+                _, writer = await asyncio.open_unix_connection(path)
+                writer.close()
+                return True
+            except OSError:
+                pass
+        await asyncio.sleep(0.005)
+    return False
+
+async def stop_process(process: Optional[asyncio.subprocess.Process], timeout: float = 5.0) -> None:
+    """Terminate a VMM we started, kill it if it lingers, and wait until it has exited."""
+    if process is None or process.returncode is not None:
+        return
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+
+def write_state(instance: VMInstance) -> None:
+    """Persist the VM's state file atomically."""
+    save_state(instance.spec.workdir, instance.state())
+
+def save_state(workdir: str, state: Dict[str, Any]) -> None:
+    path = os.path.join(workdir, STATE_FILE)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, path)
+
+def read_state(workdir: str) -> Optional[Dict[str, Any]]:
+    """Load a VM's state file, or None if it was never launched."""
+    try:
+        with open(os.path.join(workdir, STATE_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+async def launch_vm(
+    spec: VMSpec,
+    template: Dict[str, Any],
+    template_dir: str,
+    firecracker_bin: str = "firecracker",
+    setup_tap: bool = False,
+    timeout: float = 10.0,
+    wait_ready: bool = False,
+    ready_timeout: float = 60.0,
+    ready_pattern: str = DEFAULT_PATTERN,
+    huge_pages: Optional[str] = None,
+    qos: Optional[Dict[str, Any]] = None,
+    shared_rootfs: bool = False,
+    job: Optional[Dict[str, str]] = None,
+    subnet: str = DEFAULT_SUBNET,
+    leases: Optional[NetworkAllocator] = None
+) -> VMInstance:
+    """
+    Launch one firecracker process with its own sockets, log and tap.
+
+    The VM's hostname, address and `job` parameters are written to its
+    MMDS store, where the guest boot hook picks them up. With `leases`
+    the tap, /30 and MAC come from a lease held by the VM's working
+    directory (and replace the index-derived ones in `spec`); the caller
+    releases it when the VM is torn down.
+
+    Returns once the VMM's API socket is accepting connections, or, with
+    `wait_ready`, once the guest printed `ready_pattern` on its console.
+    """
+    instance = VMInstance(spec=spec, started_at=time.time())
+    start = time.monotonic()
+    try:
+        os.makedirs(spec.workdir, exist_ok=True)
+        for stale in (spec.api_socket, spec.vsock_path):
+            if os.path.exists(stale):
+                os.unlink(stale)
+        open(spec.log_path, "a").close()
+
+        rootfs = template_rootfs(template, template_dir)
+        if rootfs and not shared_rootfs:
+            await clone_rootfs(rootfs, spec.rootfs_path)
+        if leases:
+            lease = await asyncio.to_thread(leases.acquire, spec.workdir)
+            spec.tap, spec.guest_mac = lease.tap, lease.mac
+            network = lease.network()
+        else:
+            network = guest_network(spec.index, subnet)
+        if setup_tap:
+            await ensure_tap(spec.tap, network["host_address"])
+
+        with open(spec.config_path, "w") as f:
+            json.dump(render_config(template, spec, template_dir, huge_pages, qos, shared_rootfs), f, indent=2)
+        write_metadata(spec.metadata_path, build_metadata(spec.vm_id, network, spec.guest_mac, job=job))
+
+        console = open(spec.console_path, "ab")
+        console_offset = console.tell()
+        try:
+            instance.process = await asyncio.create_subprocess_exec(
+                firecracker_bin,
+                "--api-sock", spec.api_socket,
+                "--config-file", spec.config_path,
+                "--id", spec.vm_id,
+                "--metadata", spec.metadata_path,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=console,
+                stderr=asyncio.subprocess.STDOUT,
+                cwd=spec.workdir,
+                start_new_session=True
+            )
+        finally:
+            console.close()
+        instance.pid = instance.process.pid
+
+        if not await wait_for_socket(spec.api_socket, timeout):
+            if instance.process.returncode is not None:
+                raise RuntimeError(f"firecracker exited with code {instance.process.returncode}")
+            raise RuntimeError(f"API socket did not appear within {timeout}s")
+        instance.api_ready_s = time.monotonic() - start
+
+        if wait_ready:
+            result = await wait_for_console(
+                spec.console_path, ready_pattern, ready_timeout,
+                offset=console_offset, pid=instance.pid
+            )
+            if not result.ready:
+                raise RuntimeError(f"guest not ready: {result.detail}")
+            instance.guest_ready_s = time.monotonic() - start
+    except Exception as e:
+        instance.error = str(e)
+        # The caller releases the VM's reservation and lease on error, so the
+        # VMM must be gone before its tap and address can be handed out again.
+        await stop_process(instance.process)
+    if os.path.isdir(spec.workdir):
+        write_state(instance)
+    return instance
+
+async def launch_many(
+    count: int,
+    template_path: str,
+    base_dir: str = DEFAULT_BASE_DIR,
+    prefix: str = "fc",
+    start_index: int = 0,
+    concurrency: int = 0,
+    firecracker_bin: str = "firecracker",
+    setup_taps: bool = False,
+    timeout: float = 10.0,
+    wait_ready: bool = False,
+    ready_timeout: float = 60.0,
+    huge_pages: Optional[str] = None,
+    reserve_hugepages: bool = False,
+    admission: Optional[AdmissionController] = None,
+    queue: bool = False,
+    queue_timeout: float = 300.0,
+    qos: Optional[Dict[str, Any]] = None,
+    shared_rootfs: bool = False,
+    job: Optional[Dict[str, str]] = None,
+    subnet: str = DEFAULT_SUBNET,
+    leases: Optional[NetworkAllocator] = None
+) -> Dict[str, Any]:
+    """
+    Launch `count` VMs concurrently and report aggregate throughput.
+
+    Args:
+        count: Number of VMs to launch
+        template_path: Firecracker config used as the template
+        base_dir: Directory holding one subdirectory per VM
+        prefix: Prefix for VM ids and tap names
+        start_index: First VM index (keeps names unique across batches)
+        concurrency: Maximum launches in flight, 0 for unlimited
+        firecracker_bin: Firecracker binary to run
+        setup_taps: Create and bring up each VM's tap device
+        timeout: Seconds to wait for each API socket
+        wait_ready: Count a VM as launched only once its guest is usable
+        ready_timeout: Seconds to wait for each guest
+        huge_pages: Back guest memory with hugepages of this size ("2M");
+            VMs that do not fit in the host pool are refused
+        reserve_hugepages: Grow the host pool for the whole batch first
+        admission: Admit each VM against host memory before launching it
+        queue: Wait for memory headroom instead of refusing the VM
+        queue_timeout: Seconds a VM may wait in the queue
+        qos: Resolved vm_qos profile applied to every VM's drives and interfaces
+        shared_rootfs: Boot every VM from the template's root image, read-only
+        job: Job parameters published to every VM through MMDS
+        subnet: Subnet carved into one /30 link per VM
+        leases: Take each VM's tap, /30 and MAC from this allocator instead
+            of deriving them from the index
+    Returns:
+        dict: Launch report with per-VM results and VMs/second
+    """
+    template = load_template(template_path)
+    template_dir = os.path.dirname(os.path.abspath(template_path))
+    limit = asyncio.Semaphore(concurrency if concurrency > 0 else count or 1)
+
+    admitted = count
+    refusal = ""
+    grown = per_vm = 0
+    if huge_pages:
+        pool = HugepagePool(huge_pages)
+        mem_mib = configured_memory(template)
+        per_vm = pool.pages_for(mem_mib)
+        if reserve_hugepages:
+            before = pool.status().total
+            try:
+                pool.reserve(count, mem_mib)
+            except HugepageError as e:
+                refusal = str(e)
+            grown = max(0, pool.status().total - before)
+        # Decide up front so concurrent launches cannot oversubscribe the pool.
+        admitted = min(count, pool.capacity(mem_mib))
+        if admitted < count:
+            status = pool.status()
+            refusal = refusal or (
+                f"hugepage pool exhausted: {mem_mib} MiB needs {pool.pages_for(mem_mib)} x {huge_pages} pages, "
+                f"{status.available} available"
+            )
+
+    async def bounded(index: int) -> VMInstance:
+        spec = make_spec(index, base_dir, prefix)
+        if index - start_index >= admitted:
+            return VMInstance(spec=spec, error=refusal)
+        if admission:
+            try:
+                await asyncio.to_thread(
+                    admission.reserve, spec.api_socket, configured_memory(template),
+                    os.getpid(), queue, queue_timeout
+                )
+            except AdmissionError as e:
+                return VMInstance(spec=spec, error=f"admission refused: {e}")
+        async with limit:
+            instance = await launch_vm(
+                spec, template, template_dir, firecracker_bin, setup_taps, timeout,
+                wait_ready=wait_ready, ready_timeout=ready_timeout, huge_pages=huge_pages, qos=qos,
+                shared_rootfs=shared_rootfs, job=job, subnet=subnet, leases=leases
+            )
+        instance.huge_pages = huge_pages
+        if instance.error is None:
+            # The pages the pool grew by are attributed to the batch's VMs in index order.
+            instance.hugepages_reserved = max(0, min(per_vm, grown - (index - start_index) * per_vm))
+            write_state(instance)
+        if admission and instance.error:
+            await asyncio.to_thread(admission.release, spec.api_socket)
+        if leases and instance.error:
+            await asyncio.to_thread(leases.release, spec.workdir)
+        return instance
+
+    start = time.monotonic()
+    instances = await asyncio.gather(*(bounded(i) for i in range(start_index, start_index + count)))
+    elapsed = time.monotonic() - start
+    unused = grown - sum(i.hugepages_reserved for i in instances)
+    if unused > 0:
+        # Pages grown for VMs that were refused or failed to launch.
+        await asyncio.to_thread(pool.shrink, unused)
+
+    launched = [i for i in instances if i.error is None]
+    ready_times = sorted(i.api_ready_s for i in launched)
+    return {
+        "requested": count,
+        "launched": len(launched),
+        "failed": count - len(launched),
+        "cpu_count": os.cpu_count(),
+        "concurrency": concurrency or count,
+        "wall_s": elapsed,
+        "vms_per_s": len(launched) / elapsed if elapsed > 0 else 0.0,
+        "api_ready_p50_s": ready_times[len(ready_times) // 2] if ready_times else None,
+        "api_ready_max_s": ready_times[-1] if ready_times else None,
+        "guest_ready_max_s": max((i.guest_ready_s for i in launched), default=None) if wait_ready else None,
+        "huge_pages": huge_pages,
+        "vms": [i.state() for i in instances]
+    }
+
+def list_workdirs(base_dir: str) -> List[str]:
+    """Return the VM working directories under `base_dir`."""
+    if not os.path.isdir(base_dir):
+        return []
+    return sorted(
+        os.path.join(base_dir, d) for d in os.listdir(base_dir)
+        if os.path.isfile(os.path.join(base_dir, d, STATE_FILE))
+    )
+
+def pid_alive(pid: Optional[int], api_socket: Optional[str] = None) -> bool:
+    """
+    Check whether a process still exists.
+
+    When `api_socket` is given the process must also be the firecracker
+    serving that socket, so a recycled PID is never mistaken for the VM.
+    """
+    if not pid:
+        return False
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            cmdline = f.read().split(b"\0")
+    except OSError:
+        return False
+    return api_socket is None or api_socket.encode() in cmdline
+
+async def stop_vms(
+    base_dir: str,
+    vm_ids: Optional[List[str]] = None,
+    remove_taps: bool = False,
+    timeout: float = 10.0,
+    leases: Optional[NetworkAllocator] = None
+) -> List[TeardownResult]:
+    """
+    Gracefully stop launched VMs (all of them, or only `vm_ids`) in parallel.
+
+    With `leases`, the network lease of each VM that is confirmed gone is
+    released; a VMM that survived teardown keeps its tap and address. The
+    hugepages `up --reserve-hugepages` added for those VMs are handed back
+    to the kernel.
+    """
+    targets = []
+    workdirs = []
+    states = []
+    for workdir in list_workdirs(base_dir):
+        state = read_state(workdir)
+        spec = state["spec"]
+        if vm_ids and spec["vm_id"] not in vm_ids:
+            continue
+        # A recycled PID must never be signalled; pid 0 marks the VM as gone.
+        pid = state["pid"] if pid_alive(state.get("pid"), spec["api_socket"]) else 0
+        targets.append(TeardownTarget(
+            pid=pid,
+            name=spec["vm_id"],
+            api_socket=spec["api_socket"],
+            vsock_path=spec["vsock_path"],
+            tap=spec["tap"]
+        ))
+        workdirs.append(workdir)
+        states.append(state)
+    results = await teardown_many(targets, timeout, remove_taps=remove_taps)
+    if leases:
+        for workdir, result in zip(workdirs, results):
+            if result.exited:
+                await asyncio.to_thread(leases.release, workdir)
+    freed = [(w, s) for w, s, r in zip(workdirs, states, results) if r.exited and s.get("hugepages_reserved")]
+    reserved: Dict[str, int] = {}
+    for _, state in freed:
+        reserved[state["huge_pages"]] = reserved.get(state["huge_pages"], 0) + state["hugepages_reserved"]
+    for size, pages in reserved.items():
+        await asyncio.to_thread(HugepagePool(size).shrink, pages)
+    for workdir, state in freed:
+        # Handed back once; a second `down` must not shrink the pool again.
+        state["hugepages_reserved"] = 0
+        save_state(workdir, state)
+    return results
+
+def print_report(report: Dict[str, Any]) -> None:
+    """Print a launch report as a table plus the throughput summary."""
+    print(f"{'VM':<10} {'PID':<8} {'TAP':<10} {'API READY':<10} {'GUEST READY':<12} STATUS")
+    print("-" * 73)
+    for vm in report["vms"]:
+        spec = vm["spec"]
+        ready = f"{vm['api_ready_s'] * 1000:.0f} ms" if vm["api_ready_s"] is not None else "-"
+        guest = f"{vm['guest_ready_s'] * 1000:.0f} ms" if vm["guest_ready_s"] is not None else "-"
+        status = "ok" if vm["error"] is None else vm["error"]
+        print(f"{spec['vm_id']:<10} {str(vm['pid'] or '-'):<8} {spec['tap']:<10} {ready:<10} {guest:<12} {status}")
+    color = Colors.OKGREEN if report["failed"] == 0 else Colors.WARNING
+    print_color(
+        f"\nLaunched {report['launched']}/{report['requested']} VMs in {report['wall_s']:.2f}s "
+        f"({report['vms_per_s']:.1f} VMs/s, {report['cpu_count']} CPUs, "
+        f"concurrency {report['concurrency']})",
+        color
+    )
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Launch many Firecracker MicroVMs concurrently, each with its own sockets and tap",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "--base-dir",
+        default=DEFAULT_BASE_DIR,
+        help="Directory holding one working directory per VM"
+    )
+    parser.add_argument(
+        "--prefix",
+        default="fc",
+        help="Prefix for VM ids and tap device names"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    up = sub.add_parser("up", help="Launch VMs")
+    up.add_argument("--count", type=int, default=1, help="Number of VMs to launch")
+    up.add_argument("--start-index", type=int, default=0, help="Index of the first VM")
+    up.add_argument("--template", default=DEFAULT_TEMPLATE, help="Firecracker config used as template")
+    up.add_argument("--concurrency", type=int, default=0, help="Maximum launches in flight (0 = all)")
+    up.add_argument("--firecracker", default="firecracker", help="Firecracker binary")
+    up.add_argument("--setup-taps", action="store_true", help="Create a tap device per VM")
+    up.add_argument("--timeout", type=float, default=10.0, help="Seconds to wait for each API socket")
+    up.add_argument("--wait-ready", action="store_true", help="Wait until each guest reports ready on its console")
+    up.add_argument("--ready-timeout", type=float, default=60.0, help="Seconds to wait for each guest")
+    up.add_argument("--huge-pages", choices=sorted(HUGE_PAGE_SIZES_KB), help="Back guest memory with hugepages")
+    up.add_argument("--reserve-hugepages", action="store_true", help="Grow the host hugepage pool for the batch first")
+    up.add_argument(
+        "--admission",
+        choices=("reject", "queue", "off"),
+        default="reject",
+        help="Refuse or queue VMs that do not fit in host memory"
+    )
+    up.add_argument("--overcommit", type=float, default=AdmissionPolicy.from_env().overcommit_ratio, help="Guest memory overcommit ratio")
+    up.add_argument("--qos", help="QoS profile for drives and network interfaces (see vm_qos.py list)")
+    up.add_argument("--shared-rootfs", action="store_true", help="Boot every VM from the template's root image read-only")
+    up.add_argument("--job", action="append", default=[], metavar="KEY=VALUE", help="Job parameter published through MMDS (repeatable)")
+    up.add_argument("--subnet", default=DEFAULT_SUBNET, help="Subnet carved into one /30 link per VM")
+    up.add_argument("--leases", default=DEFAULT_LEASE_PATH, help="Lease file handing out taps, /30s and MACs (FC_NET_LEASES)")
+    up.add_argument("--no-leases", action="store_true", help="Derive taps, /30s and MACs from the VM index instead")
+    up.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    down = sub.add_parser("down", help="Stop launched VMs")
+    down.add_argument("vm_ids", nargs="*", help="VM ids to stop (default: all)")
+    down.add_argument("--remove-taps", action="store_true", help="Delete the VMs' tap devices")
+    down.add_argument("--timeout", type=float, default=10.0, help="Seconds to wait for a clean guest shutdown")
+    down.add_argument("--leases", default=DEFAULT_LEASE_PATH, help="Lease file the VMs' network leases are released from")
+    down.add_argument("--no-leases", action="store_true", help="Leave the lease file alone (VMs started with up --no-leases)")
+
+    sub.add_parser("list", help="List launched VMs")
+
+    args = parser.parse_args()
+
+    if args.command == "up":
+        if not shutil.which(args.firecracker):
+            print_color(f"Error: {args.firecracker} not found in PATH.", Colors.FAIL)
+            sys.exit(1)
+        policy = AdmissionPolicy.from_env()
+        policy.overcommit_ratio = args.overcommit
+        try:
+            qos = resolve_qos(args.qos) if args.qos else None
+            job = parse_pairs(args.job)
+            leases = None if args.no_leases else NetworkAllocator(args.subnet, args.leases)
+        except (KeyError, ValueError) as e:
+            print_color(f"Error: {e.args[0]}", Colors.FAIL)
+            sys.exit(1)
+        report = asyncio.run(launch_many(
+            args.count,
+            args.template,
+            base_dir=args.base_dir,
+            prefix=args.prefix,
+            start_index=args.start_index,
+            concurrency=args.concurrency,
+            firecracker_bin=args.firecracker,
+            setup_taps=args.setup_taps,
+            timeout=args.timeout,
+            wait_ready=args.wait_ready,
+            ready_timeout=args.ready_timeout,
+            huge_pages=args.huge_pages,
+            reserve_hugepages=args.reserve_hugepages,
+            admission=None if args.admission == "off" else AdmissionController(policy),
+            queue=args.admission == "queue",
+            qos=qos,
+            shared_rootfs=args.shared_rootfs,
+            job=job,
+            subnet=args.subnet,
+            leases=leases
+        ))
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+        if report["failed"]:
+            sys.exit(1)
+    elif args.command == "down":
+        start = time.monotonic()
+        leases = None if args.no_leases else NetworkAllocator(state_path=args.leases)
+        try:
+            results = asyncio.run(stop_vms(args.base_dir, args.vm_ids or None, args.remove_taps, args.timeout, leases))
+        except (LeaseError, HugepageError) as e:
+            print_color(f"Error: {e}", Colors.FAIL)
+            sys.exit(1)
+        except subprocess.CalledProcessError as e:
+            print_color(f"Error: could not shrink the hugepage pool ({e})", Colors.FAIL)
+            sys.exit(1)
+        print_results(results, time.monotonic() - start)
+    elif args.command == "list":
+        print(f"{'VM':<10} {'PID':<8} {'STATE':<8} {'TAP':<10} SOCKET")
+        print("-" * 70)
+        for workdir in list_workdirs(args.base_dir):
+            state = read_state(workdir)
+            spec = state["spec"]
+            alive = "running" if pid_alive(state.get("pid"), spec["api_socket"]) else "stopped"
+            print(f"{spec['vm_id']:<10} {str(state.get('pid') or '-'):<8} {alive:<8} {spec['tap']:<10} {spec['api_socket']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import argparse
+import ipaddress
+from typing import Optional, Dict, Any, List
+
+from firecracker_api import Colors, print_color, FirecrackerClient, FirecrackerAPIError, DEFAULT_API_SOCKET
+
+METADATA_FILE = "mmds.json"
+MMDS_ADDRESS = "169.254.169.254"
+DEFAULT_SUBNET = os.environ.get("FC_GUEST_SUBNET", "172.16.0.0/16")
+DEFAULT_DNS = ["1.1.1.1", "8.8.8.8"]
+
+# Everything the guest boot hook (tools/mmds-init.sh) reads lives under this key.
+# Leaves are strings so the guest can fetch each one as plain text without a JSON parser.
+ROOT_KEY = "sandbox"
+
+def guest_network(index: int, subnet: str = DEFAULT_SUBNET) -> Dict[str, str]:
+    """
+    Point-to-point addressing for VM number `index`: one /30 per VM.
+
+    The host end of the VM's tap gets the first address and the guest the second.
+    """
+    network = ipaddress.ip_network(subnet)
+    block = ipaddress.ip_network((int(network.network_address) + 4 * index, 30))
+    if not block.subnet_of(network):
+        raise ValueError(f"{subnet} has no room for VM {index}")
+    gateway, address = list(block.hosts())
+    return {
+        "address": f"{address}/{block.prefixlen}",
+        "gateway": str(gateway),
+        "host_address": f"{gateway}/{block.prefixlen}"
+    }
+
+def build_metadata(
+    vm_id: str,
+    network: Dict[str, str],
+    guest_mac: Optional[str] = None,
+    dns: Optional[List[str]] = None,
+    job: Optional[Dict[str, str]] = None
+) -> Dict[str, Any]:
+    """The MMDS document for one VM: identity, network and job parameters."""
+    return {
+        ROOT_KEY: {
+            "vm-id": vm_id,
+            "hostname": vm_id,
+            "network": {
+                "address": network["address"],
+                "gateway": network["gateway"],
+                "dns": " ".join(dns or DEFAULT_DNS),
+                "mac": guest_mac or ""
+            },
+            "job": {str(k): str(v) for k, v in (job or {}).items()}
+        }
+    }
+
+def mmds_config(config: Dict[str, Any], iface_id: str = "eth0") -> Dict[str, Any]:
+    """Enable MMDS V2 on `iface_id` in a Firecracker config, if the VM has that interface."""
+    if any(i.get("iface_id") == iface_id for i in config.get("network-interfaces", [])):
+        config["mmds-config"] = {"version": "V2", "network_interfaces": [iface_id], "ipv4_address": MMDS_ADDRESS}
+    return config
+
+def write_metadata(path: str, metadata: Dict[str, Any]) -> None:
+    """Write the document passed to firecracker with --metadata."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(metadata, f, indent=2)
+    os.replace(tmp, path)
+
+def parse_pairs(pairs: List[str]) -> Dict[str, str]:
+    """Turn ["KEY=value", ...] into a dict."""
+    result = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep or not key:
+            raise ValueError(f"expected KEY=VALUE, got {pair!r}")
+        result[key] = value
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Inspect and update the per-VM metadata (MMDS) read by the guest boot hook",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument(
+        "--socket",
+        default=os.environ.get("FC_API_SOCKET", DEFAULT_API_SOCKET),
+        help="Path to the Firecracker API socket"
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("show", help="Print the VM's metadata store")
+
+    job = sub.add_parser("set-job", help="Add or change job parameters of a running VM")
+    job.add_argument("pairs", nargs="+", metavar="KEY=VALUE", help="Job parameters")
+
+    render = sub.add_parser("render", help="Print the metadata the launcher would give VM number INDEX")
+    render.add_argument("index", type=int, help="Launch index of the VM")
+    render.add_argument("--prefix", default="fc", help="Prefix of VM ids")
+    render.add_argument("--subnet", default=DEFAULT_SUBNET, help="Subnet carved into one /30 per VM")
+    render.add_argument("--job", action="append", default=[], metavar="KEY=VALUE", help="Job parameter (repeatable)")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "render":
+            metadata = build_metadata(
+                f"{args.prefix}-{args.index:03d}", guest_network(args.index, args.subnet), job=parse_pairs(args.job)
+            )
+            print(json.dumps(metadata, indent=2))
+            return
+        with FirecrackerClient(args.socket) as client:
+            if args.command == "show":
+                print(json.dumps(client.get_mmds(), indent=2))
+            elif args.command == "set-job":
+                client.patch_mmds({ROOT_KEY: {"job": parse_pairs(args.pairs)}})
+                print_color("Job parameters updated; the guest sees them on its next read.", Colors.OKGREEN)
+    except ValueError as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+    except (OSError, FirecrackerAPIError) as e:
+        print_color(f"Error: {getattr(e, 'fault', None) or e}", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import fcntl
+import argparse
+import ipaddress
+import contextlib
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any, List, Iterator
+
+from firecracker_api import Colors, print_color
+from vm_mmds import DEFAULT_SUBNET, guest_network
+
+DEFAULT_LEASE_PATH = os.environ.get("FC_NET_LEASES", "/tmp/firecracker-net-leases.json")
+DEFAULT_TAP_PREFIX = "fctap"
+# Interface names are limited to IFNAMSIZ - 1 characters.
+MAX_TAP_NAME = 15
+
+class LeaseError(Exception):
+    """Raised when no network slot is left or the ledger does not match the request."""
+
+@dataclass
+class Lease:
+    """One VM's share of the host network: its tap, /30 link and MAC."""
+    owner: str
+    slot: int
+    tap: str
+    mac: str
+    address: str
+    gateway: str
+    host_address: str
+    created_at: float
+
+    def network(self) -> Dict[str, str]:
+        """The lease in the form `vm_mmds.guest_network` returns."""
+        return {"address": self.address, "gateway": self.gateway, "host_address": self.host_address}
+
+def guest_mac(address: str) -> str:
+    """
+    MAC for a guest address: 06:00 followed by the four IPv4 bytes.
+
+    The guest can derive its address from its MAC, and the MAC never
+    changes for a given slot.
+    """
+    packed = ipaddress.ip_interface(address).ip.packed
+    return "06:00:" + ":".join(f"{b:02x}" for b in packed)
+
+class NetworkAllocator:
+    """
+    Hands each VM its own tap device, /30 link and MAC, persisted as leases.
+
+    Slot `n` is the n-th /30 of `subnet` and the tap `<tap_prefix><n>`.
+    Leases live in a small JSON file guarded by flock, like admission
+    reservations, so concurrent launchers never hand out the same slot.
+    The ledger keeps a high-water mark and a stack of released slots, so
+    allocating and releasing never search for a free slot. Leases are
+    keyed by owner (the VM's working directory); acquiring again for the
+    same owner returns its existing lease, which is what a restarted or
+    revived VM needs.
+    """
+
+    def __init__(self, subnet: str = DEFAULT_SUBNET, state_path: str = DEFAULT_LEASE_PATH, tap_prefix: str = DEFAULT_TAP_PREFIX):
+        self.subnet = str(ipaddress.ip_network(subnet))
+        self.state_path = state_path
+        self.tap_prefix = tap_prefix
+        self.slots = ipaddress.ip_network(subnet).num_addresses // 4
+
+    def _load(self, check: bool) -> Dict[str, Any]:
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if not state.get("leases"):
+            # An empty ledger can switch to another subnet or tap prefix.
+            return {"subnet": self.subnet, "tap_prefix": self.tap_prefix, "next": 0, "free": [], "leases": {}}
+        if check and (state["subnet"] != self.subnet or state["tap_prefix"] != self.tap_prefix):
+            raise LeaseError(
+                f"{self.state_path} holds leases in {state['subnet']} (taps {state['tap_prefix']}N); "
+                f"release them or use another lease file for {self.subnet}"
+            )
+        return state
+
+    def _save(self, state: Dict[str, Any]) -> None:
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    @contextlib.contextmanager
+    def _locked(self, check: bool = False) -> Iterator[Dict[str, Any]]:
+        # Only new leases must match the ledger's subnet; releasing works with any allocator.
+        with open(f"{self.state_path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield self._load(check)
+
+    def acquire(self, owner: str) -> Lease:
+        """
+        Lease a slot to `owner`, or return the one it already holds.
+
+        Raises:
+            LeaseError: if every slot of the subnet is leased
+        """
+        owner = os.path.abspath(owner)
+        with self._locked(check=True) as state:
+            if owner in state["leases"]:
+                return Lease(**state["leases"][owner])
+            if state["free"]:
+                slot = state["free"].pop()
+            elif state["next"] < self.slots:
+                slot = state["next"]
+                state["next"] += 1
+            else:
+                raise LeaseError(f"all {self.slots} /30 links of {self.subnet} are leased")
+            tap = f"{self.tap_prefix}{slot}"
+            if len(tap) > MAX_TAP_NAME:
+                raise LeaseError(f"tap name {tap} is longer than {MAX_TAP_NAME} characters")
+            network = guest_network(slot, self.subnet)
+            lease = Lease(
+                owner=owner,
+                slot=slot,
+                tap=tap,
+                mac=guest_mac(network["address"]),
+                address=network["address"],
+                gateway=network["gateway"],
+                host_address=network["host_address"],
+                created_at=time.time()
+            )
+            state["leases"][owner] = asdict(lease)
+            self._save(state)
+            return lease
+
+    def release(self, owner: str) -> Optional[Lease]:
+        """Return `owner`'s slot to the pool; None if it held no lease."""
+        owner = os.path.abspath(owner)
+        with self._locked() as state:
+            entry = state["leases"].pop(owner, None)
+            if entry is None:
+                return None
+            state["free"].append(entry["slot"])
+            self._save(state)
+            return Lease(**entry)
+
+    def get(self, owner: str) -> Optional[Lease]:
+        with self._locked() as state:
+            entry = state["leases"].get(os.path.abspath(owner))
+            return Lease(**entry) if entry else None
+
+    def leases(self) -> List[Lease]:
+        with self._locked() as state:
+            return sorted((Lease(**entry) for entry in state["leases"].values()), key=lambda l: l.slot)
+
+    def prune(self) -> List[Lease]:
+        """Release the leases whose owner directory no longer exists."""
+        with self._locked() as state:
+            stale = [entry for owner, entry in state["leases"].items() if not os.path.isdir(owner)]
+            for entry in stale:
+                del state["leases"][entry["owner"]]
+                state["free"].append(entry["slot"])
+            if stale:
+                self._save(state)
+            return [Lease(**entry) for entry in stale]
+
+def print_leases(leases: List[Lease]) -> None:
+    print(f"{'SLOT':<6} {'TAP':<12} {'HOST':<18} {'GUEST':<18} {'MAC':<18} OWNER")
+    print("-" * 100)
+    for lease in leases:
+        print(f"{lease.slot:<6} {lease.tap:<12} {lease.host_address:<18} {lease.address:<18} {lease.mac:<18} {lease.owner}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Per-VM tap, /30 and MAC leases for Firecracker MicroVMs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--leases", default=DEFAULT_LEASE_PATH, help="Lease file shared by all launchers (FC_NET_LEASES)")
+    parser.add_argument("--subnet", default=DEFAULT_SUBNET, help="Subnet carved into one /30 link per VM")
+    parser.add_argument("--tap-prefix", default=DEFAULT_TAP_PREFIX, help="Tap devices are named <prefix><slot>")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    lst = sub.add_parser("list", help="Show the leases")
+    lst.add_argument("--json", action="store_true", help="Print as JSON")
+
+    acquire = sub.add_parser("acquire", help="Lease a slot to a VM directory (prints the lease as JSON)")
+    acquire.add_argument("owner", help="VM working directory")
+
+    release = sub.add_parser("release", help="Return a VM directory's slot")
+    release.add_argument("owner", help="VM working directory")
+
+    sub.add_parser("prune", help="Release leases whose VM directory is gone")
+
+    args = parser.parse_args()
+    allocator = NetworkAllocator(args.subnet, args.leases, args.tap_prefix)
+
+    try:
+        if args.command == "list":
+            leases = allocator.leases()
+            if args.json:
+                print(json.dumps([asdict(lease) for lease in leases], indent=2))
+            else:
+                print_leases(leases)
+        elif args.command == "acquire":
+            print(json.dumps(asdict(allocator.acquire(args.owner)), indent=2))
+        elif args.command == "release":
+            lease = allocator.release(args.owner)
+            if lease is None:
+                print_color(f"{args.owner} holds no lease.", Colors.WARNING)
+            else:
+                print_color(f"Released {lease.tap} ({lease.address}).", Colors.OKGREEN)
+        elif args.command == "prune":
+            pruned = allocator.prune()
+            print_color(f"Released {len(pruned)} stale lease(s).", Colors.OKGREEN)
+    except LeaseError as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
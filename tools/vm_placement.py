@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import signal
+import argparse
+import subprocess
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Dict, Any, List, Set, Tuple
+
+from firecracker_api import Colors, print_color
+from vm_teardown import TeardownTarget, discover_firecracker, find_by_socket
+from vm_pool import percentile
+
+SYSFS_CPU = "/sys/devices/system/cpu"
+SYSFS_NODE = "/sys/devices/system/node"
+POLICIES = ("packed", "spread", "dedicated", "numa")
+VCPU_THREAD = re.compile(r"^fc_vcpu\s*(\d+)$")
+
+class PlacementError(Exception):
+    """Raised when a placement policy cannot be satisfied on this host."""
+
+@dataclass
+class CPU:
+    """One logical CPU and where it sits in the host topology."""
+    cpu: int
+    core: int
+    package: int
+    node: int
+
+    @property
+    def core_key(self) -> Tuple[int, int]:
+        return (self.package, self.core)
+
+@dataclass
+class HostTopology:
+    """Online logical CPUs grouped by physical core and NUMA node."""
+    cpus: Dict[int, CPU]
+
+    def nodes(self) -> Dict[int, List[int]]:
+        nodes: Dict[int, List[int]] = {}
+        for cpu in sorted(self.cpus.values(), key=lambda c: c.cpu):
+            nodes.setdefault(cpu.node, []).append(cpu.cpu)
+        return nodes
+
+    def cores(self) -> Dict[Tuple[int, int], List[int]]:
+        cores: Dict[Tuple[int, int], List[int]] = {}
+        for cpu in sorted(self.cpus.values(), key=lambda c: c.cpu):
+            cores.setdefault(cpu.core_key, []).append(cpu.cpu)
+        return cores
+
+    def siblings(self, cpu: int) -> List[int]:
+        return self.cores()[self.cpus[cpu].core_key]
+
+def parse_cpulist(text: str) -> List[int]:
+    """Expand a sysfs cpulist such as "0-3,8,10-11"."""
+    cpus: List[int] = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def format_cpulist(cpus) -> str:
+    """Collapse CPU numbers back into the compact cpulist form."""
+    ranges: List[str] = []
+    ordered = sorted(set(cpus))
+    i = 0
+    while i < len(ordered):
+        j = i
+        while j + 1 < len(ordered) and ordered[j + 1] == ordered[j] + 1:
+            j += 1
+        ranges.append(str(ordered[i]) if i == j else f"{ordered[i]}-{ordered[j]}")
+        i = j + 1
+    return ",".join(ranges)
+
+def _read(path: str, default: str = "") -> str:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+def read_topology(cpu_root: str = SYSFS_CPU, node_root: str = SYSFS_NODE) -> HostTopology:
+    """Discover online CPUs, their cores, packages and NUMA nodes from sysfs."""
+    online = parse_cpulist(_read(os.path.join(cpu_root, "online"))) or list(range(os.cpu_count() or 1))
+
+    node_of: Dict[int, int] = {}
+    if os.path.isdir(node_root):
+        for entry in os.listdir(node_root):
+            match = re.match(r"^node(\d+)$", entry)
+            if match:
+                for cpu in parse_cpulist(_read(os.path.join(node_root, entry, "cpulist"))):
+                    node_of[cpu] = int(match.group(1))
+
+    cpus: Dict[int, CPU] = {}
+    for cpu in online:
+        topo = os.path.join(cpu_root, f"cpu{cpu}", "topology")
+        cpus[cpu] = CPU(
+            cpu=cpu,
+            core=int(_read(os.path.join(topo, "core_id"), str(cpu))),
+            package=int(_read(os.path.join(topo, "physical_package_id"), "0")),
+            node=node_of.get(cpu, 0)
+        )
+    return HostTopology(cpus)
+
+def vm_threads(pid: int) -> Dict[str, Any]:
+    """
+    Classify a firecracker process's threads.
+
+    Returns:
+        dict: {"vcpus": {index: tid}, "vmm": [tids]} where "vmm" holds the
+        main VMM/device-emulation thread and every other helper thread
+    """
+    vcpus: Dict[int, int] = {}
+    vmm: List[int] = []
+    try:
+        tids = sorted(int(t) for t in os.listdir(f"/proc/{pid}/task"))
+    except OSError:
+        return {"vcpus": vcpus, "vmm": vmm}
+    for tid in tids:
+        match = VCPU_THREAD.match(_read(f"/proc/{pid}/task/{tid}/comm"))
+        if match:
+            vcpus[int(match.group(1))] = tid
+        else:
+            vmm.append(tid)
+    return {"vcpus": vcpus, "vmm": vmm}
+
+def wait_for_vcpu_threads(pid: int, count: int, timeout: float = 5.0) -> Dict[str, Any]:
+    """Wait until firecracker has spawned `count` vCPU threads (right after InstanceStart)."""
+    deadline = time.monotonic() + timeout
+    threads = vm_threads(pid)
+    while len(threads["vcpus"]) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+        threads = vm_threads(pid)
+    return threads
+
+@dataclass
+class Placement:
+    """CPU sets chosen for one VM's threads."""
+    name: str
+    pid: int
+    policy: str
+    vcpu_cpus: Dict[int, List[int]]
+    vmm_cpus: List[int]
+    node: Optional[int] = None
+    warnings: List[str] = field(default_factory=list)
+
+class Placer:
+    """
+    Assigns CPUs to VMs under a placement policy.
+
+    The placer remembers how many vCPUs it has put on each logical CPU, so
+    successive VMs are balanced against each other:
+
+    - packed: fill one physical core at a time, keeping a VM's vCPUs on
+      hyperthread siblings so they share L1/L2 and leave other cores idle
+    - spread: one vCPU per physical core, round-robin across NUMA nodes, so
+      no two vCPUs of a VM compete for the same core
+    - dedicated: every vCPU gets a whole physical core that no other VM may
+      use; VMM/IO threads are confined to the housekeeping CPUs
+    - numa: keep all of a VM's threads on the least loaded node and move its
+      guest memory there
+    """
+
+    def __init__(self, topology: HostTopology, housekeeping: Optional[List[int]] = None):
+        self.topology = topology
+        self.housekeeping = sorted(set(housekeeping or []) & set(topology.cpus))
+        self.load: Dict[int, int] = {c: 0 for c in topology.cpus if c not in self.housekeeping}
+        if not self.load:
+            raise PlacementError("no CPUs left after reserving housekeeping CPUs")
+        self.exclusive: Set[Tuple[int, int]] = set()
+
+    def _usable(self, node: Optional[int] = None) -> List[CPU]:
+        return [
+            cpu for c, cpu in sorted(self.topology.cpus.items())
+            if c in self.load and cpu.core_key not in self.exclusive and (node is None or cpu.node == node)
+        ]
+
+    def _core_load(self, key: Tuple[int, int]) -> int:
+        return sum(self.load.get(c, 0) for c in self.topology.cores()[key])
+
+    def plan(self, name: str, pid: int, vcpu_count: int, policy: str) -> Placement:
+        if policy not in POLICIES:
+            raise PlacementError(f"unknown policy {policy!r}; choose from {', '.join(POLICIES)}")
+        if vcpu_count < 1:
+            raise PlacementError(f"{name} has no vCPU threads")
+        return getattr(self, f"_plan_{policy}")(name, pid, vcpu_count)
+
+    def _commit(self, placement: Placement) -> Placement:
+        for cpus in placement.vcpu_cpus.values():
+            for cpu in cpus:
+                self.load[cpu] += 1
+        return placement
+
+    def _plan_packed(self, name: str, pid: int, vcpu_count: int) -> Placement:
+        usable = self._usable()
+        if not usable:
+            raise PlacementError("every CPU is reserved or dedicated")
+        ordered = sorted(usable, key=lambda c: (self._core_load(c.core_key), c.node, c.core_key, c.cpu))
+        chosen = [ordered[i % len(ordered)].cpu for i in range(vcpu_count)]
+        return self._commit(Placement(
+            name, pid, "packed",
+            {i: [cpu] for i, cpu in enumerate(chosen)},
+            sorted(set(chosen))
+        ))
+
+    def _plan_spread(self, name: str, pid: int, vcpu_count: int) -> Placement:
+        cores = self.topology.cores()
+        by_node: Dict[int, List[Tuple[int, int]]] = {}
+        for cpu in self._usable():
+            keys = by_node.setdefault(cpu.node, [])
+            if cpu.core_key not in keys:
+                keys.append(cpu.core_key)
+        for keys in by_node.values():
+            keys.sort(key=lambda k: (self._core_load(k), k))
+        # Interleave nodes so consecutive vCPUs alternate between them.
+        interleaved: List[Tuple[int, int]] = []
+        queues = [list(keys) for _, keys in sorted(by_node.items(), key=lambda kv: self._node_load(kv[0]))]
+        while any(queues):
+            for queue in queues:
+                if queue:
+                    interleaved.append(queue.pop(0))
+        if not interleaved:
+            raise PlacementError("every CPU is reserved or dedicated")
+
+        placement = Placement(name, pid, "spread", {}, [])
+        for i in range(vcpu_count):
+            key = interleaved[i % len(interleaved)]
+            cpu = min((c for c in cores[key] if c in self.load), key=lambda c: (self.load[c], c))
+            placement.vcpu_cpus[i] = [cpu]
+            self.load[cpu] += 1
+        if vcpu_count > len(interleaved):
+            placement.warnings.append(f"{vcpu_count} vCPUs but only {len(interleaved)} physical cores; cores are shared")
+        placement.vmm_cpus = sorted({c for cpus in placement.vcpu_cpus.values() for c in cpus})
+        return placement
+
+    def _plan_dedicated(self, name: str, pid: int, vcpu_count: int) -> Placement:
+        cores = self.topology.cores()
+        free = sorted(
+            {cpu.core_key for cpu in self._usable()},
+            key=lambda k: (self._core_load(k), k)
+        )
+        free = [k for k in free if self._core_load(k) == 0 and all(c in self.load for c in cores[k])]
+        if len(free) < vcpu_count:
+            raise PlacementError(
+                f"{name} needs {vcpu_count} dedicated cores but only {len(free)} are free"
+            )
+        placement = Placement(name, pid, "dedicated", {}, [])
+        for i, key in enumerate(free[:vcpu_count]):
+            self.exclusive.add(key)
+            placement.vcpu_cpus[i] = [cores[key][0]]
+            for cpu in cores[key]:
+                self.load[cpu] += 1
+        placement.vmm_cpus = list(self.housekeeping) or sorted(
+            c for c, cpu in self.topology.cpus.items() if cpu.core_key not in self.exclusive
+        )
+        if not placement.vmm_cpus:
+            placement.vmm_cpus = [cpus[0] for cpus in placement.vcpu_cpus.values()]
+            placement.warnings.append("no housekeeping CPUs left; VMM threads share the vCPU cores")
+        return placement
+
+    def _node_load(self, node: int) -> float:
+        cpus = [c for c in self.topology.nodes()[node] if c in self.load]
+        return sum(self.load[c] for c in cpus) / len(cpus) if cpus else float("inf")
+
+    def _plan_numa(self, name: str, pid: int, vcpu_count: int) -> Placement:
+        node = min(self.topology.nodes(), key=lambda n: (self._node_load(n), n))
+        usable = self._usable(node)
+        if not usable:
+            raise PlacementError(f"node {node} has no usable CPUs")
+        ordered = sorted(usable, key=lambda c: (self.load[c.cpu], c.cpu))
+        placement = Placement(
+            name, pid, "numa",
+            {i: [ordered[i % len(ordered)].cpu] for i in range(vcpu_count)},
+            [c.cpu for c in usable],
+            node=node
+        )
+        return self._commit(placement)
+
+def apply_placement(placement: Placement, threads: Optional[Dict[str, Any]] = None) -> Placement:
+    """Pin the VM's threads with sched_setaffinity and, for numa, migrate its memory."""
+    threads = threads or vm_threads(placement.pid)
+    for index, tid in threads["vcpus"].items():
+        cpus = placement.vcpu_cpus.get(index)
+        if cpus is None:
+            placement.warnings.append(f"vCPU {index} has no placement")
+            continue
+        os.sched_setaffinity(tid, cpus)
+    for tid in threads["vmm"]:
+        try:
+            os.sched_setaffinity(tid, placement.vmm_cpus)
+        except ProcessLookupError:
+            # Short-lived helper threads may exit between listing and pinning.
+            pass
+
+    if placement.node is not None and len(read_topology().nodes()) > 1:
+        migratepages = shutil.which("migratepages")
+        if migratepages:
+            result = subprocess.run(
+                [migratepages, str(placement.pid), "all", str(placement.node)],
+                capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                placement.warnings.append(f"migratepages failed: {result.stderr.strip()}")
+        else:
+            placement.warnings.append("migratepages (numactl) not installed; guest memory was not moved")
+    return placement
+
+def unpin(pid: int) -> None:
+    """Let every thread of `pid` run on any online CPU again."""
+    everything = list(read_topology().cpus)
+    threads = vm_threads(pid)
+    for tid in list(threads["vcpus"].values()) + threads["vmm"]:
+        try:
+            os.sched_setaffinity(tid, everything)
+        except ProcessLookupError:
+            pass
+
+def place_vms(
+    targets: List[TeardownTarget],
+    policy: str,
+    housekeeping: Optional[List[int]] = None,
+    vcpu_count: int = 0,
+    timeout: float = 5.0
+) -> List[Placement]:
+    """
+    Plan and apply a placement for every VM in `targets`.
+
+    Args:
+        targets: firecracker processes to pin
+        policy: One of POLICIES
+        housekeeping: CPUs reserved for VMM/IO threads (never given to vCPUs)
+        vcpu_count: Wait for this many vCPU threads per VM (0 = use what exists)
+        timeout: Seconds to wait for vCPU threads to appear
+    """
+    placer = Placer(read_topology(), housekeeping)
+    placements = []
+    for target in targets:
+        threads = wait_for_vcpu_threads(target.pid, vcpu_count, timeout) if vcpu_count else vm_threads(target.pid)
+        placement = placer.plan(target.name, target.pid, len(threads["vcpus"]), policy)
+        placements.append(apply_placement(placement, threads))
+    return placements
+
+def describe_affinity(pid: int) -> Dict[str, str]:
+    """Current CPU affinity of each thread, keyed by thread name."""
+    affinity = {}
+    threads = vm_threads(pid)
+    for index, tid in sorted(threads["vcpus"].items()):
+        affinity[f"fc_vcpu {index}"] = format_cpulist(os.sched_getaffinity(tid))
+    for tid in threads["vmm"]:
+        name = _read(f"/proc/{pid}/task/{tid}/comm") or str(tid)
+        try:
+            affinity[f"{name} ({tid})"] = format_cpulist(os.sched_getaffinity(tid))
+        except ProcessLookupError:
+            pass
+    return affinity
+
+def print_placements(placements: List[Placement]) -> None:
+    for p in placements:
+        vcpus = " ".join(f"{i}->{format_cpulist(c)}" for i, c in sorted(p.vcpu_cpus.items()))
+        node = f" node {p.node}" if p.node is not None else ""
+        print(f"{p.name:<12} pid {p.pid:<8} {p.policy:<9}{node} vcpu {vcpus}  vmm {format_cpulist(p.vmm_cpus)}")
+        for warning in p.warnings:
+            print_color(f"  warning: {warning}", Colors.WARNING)
+
+# Benchmark
+
+def _run_workload(command: str, iterations: int) -> List[float]:
+    samples = []
+    for _ in range(iterations):
+        start = time.monotonic()
+        result = subprocess.run(command, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        samples.append(time.monotonic() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"workload failed ({result.returncode}): {result.stderr.decode(errors='replace').strip()}")
+    return samples
+
+def _start_noise(count: int) -> List[subprocess.Popen]:
+    # Host-side busy loops that compete with the vCPU threads for cores.
+    return [
+        subprocess.Popen([sys.executable, "-c", "while True: pass"], start_new_session=True)
+        for _ in range(count)
+    ]
+
+def _stop_noise(procs: List[subprocess.Popen]) -> None:
+    for proc in procs:
+        proc.send_signal(signal.SIGKILL)
+        proc.wait()
+
+def _summary(samples: List[float]) -> Dict[str, Any]:
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "iterations": len(samples),
+        "mean_ms": ms(sum(samples) / len(samples)) if samples else None,
+        "p50_ms": ms(percentile(samples, 50)),
+        "p90_ms": ms(percentile(samples, 90)),
+        "p99_ms": ms(percentile(samples, 99)),
+        "max_ms": ms(max(samples, default=None))
+    }
+
+def benchmark(
+    targets: List[TeardownTarget],
+    command: str,
+    policy: str,
+    iterations: int = 50,
+    warmup: int = 3,
+    noise: int = 0,
+    housekeeping: Optional[List[int]] = None
+) -> Dict[str, Any]:
+    """
+    Compare workload latency with the VMs unpinned and pinned under `policy`.
+
+    `command` runs on the host and must drive a CPU-bound job inside the
+    guest (for example over ssh or vsock); its wall time is one sample.
+    """
+    report: Dict[str, Any] = {
+        "policy": policy,
+        "command": command,
+        "noise_procs": noise,
+        "cpus": len(read_topology().cpus),
+        "vms": [t.name for t in targets]
+    }
+    procs = _start_noise(noise)
+    try:
+        for phase in ("unpinned", "pinned"):
+            if phase == "unpinned":
+                for target in targets:
+                    unpin(target.pid)
+            else:
+                report["placements"] = [asdict(p) for p in place_vms(targets, policy, housekeeping)]
+            _run_workload(command, warmup)
+            report[phase] = _summary(_run_workload(command, iterations))
+    finally:
+        _stop_noise(procs)
+        for target in targets:
+            unpin(target.pid)
+
+    before, after = report["unpinned"]["p99_ms"], report["pinned"]["p99_ms"]
+    report["p99_change_pct"] = round((after - before) / before * 100, 1) if before else None
+    return report
+
+def print_benchmark(report: Dict[str, Any]) -> None:
+    print_color(
+        f"Workload latency over {report['unpinned']['iterations']} runs, policy {report['policy']}, "
+        f"{report['noise_procs']} noise process(es), {report['cpus']} CPU(s):", Colors.HEADER
+    )
+    print(f"{'':<10} {'mean':>10} {'p50':>10} {'p90':>10} {'p99':>10} {'max':>10}")
+    for phase in ("unpinned", "pinned"):
+        s = report[phase]
+        print(f"{phase:<10} " + " ".join(f"{s[k]:>10.2f}" for k in ("mean_ms", "p50_ms", "p90_ms", "p99_ms", "max_ms")))
+    if report["p99_change_pct"] is not None:
+        color = Colors.OKGREEN if report["p99_change_pct"] <= 0 else Colors.WARNING
+        print_color(f"p99 change with pinning: {report['p99_change_pct']:+.1f}%", color)
+
+def _targets(args) -> List[TeardownTarget]:
+    if args.all or not (args.pid or args.socket):
+        return discover_firecracker()
+    known = {t.pid: t for t in discover_firecracker()}
+    targets = [known.get(pid, TeardownTarget(pid=pid, name=str(pid))) for pid in args.pid]
+    for path in args.socket:
+        target = find_by_socket(path)
+        if target is None:
+            raise PlacementError(f"no firecracker process is serving {path}")
+        targets.append(target)
+    return targets
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pin Firecracker vCPU and VMM threads according to a placement policy",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("topology", help="Show CPUs, cores and NUMA nodes")
+
+    def selection(p):
+        p.add_argument("--pid", type=int, action="append", default=[], help="firecracker PID (repeatable)")
+        p.add_argument("--socket", action="append", default=[], help="VM API socket (repeatable)")
+        p.add_argument("--all", action="store_true", help="Every firecracker process on the host (default)")
+
+    show = sub.add_parser("show", help="Show the current affinity of each VM thread")
+    selection(show)
+
+    pin = sub.add_parser("pin", help="Pin VM threads")
+    selection(pin)
+    pin.add_argument("--policy", choices=POLICIES, default="spread", help="Placement policy")
+    pin.add_argument("--housekeeping", default="", help="cpulist reserved for VMM/IO threads, e.g. 0 or 0-1")
+    pin.add_argument("--vcpus", type=int, default=0, help="Wait for this many vCPU threads per VM (0 = use what exists)")
+
+    unpin_cmd = sub.add_parser("unpin", help="Allow VM threads on every CPU again")
+    selection(unpin_cmd)
+
+    bench = sub.add_parser("bench", help="Compare guest workload tail latency with and without pinning")
+    selection(bench)
+    bench.add_argument("--workload", required=True, help="Host command that runs a CPU-bound job in the guest")
+    bench.add_argument("--policy", choices=POLICIES, default="dedicated", help="Placement policy to compare")
+    bench.add_argument("--iterations", type=int, default=50, help="Timed runs per phase")
+    bench.add_argument("--warmup", type=int, default=3, help="Untimed runs before each phase")
+    bench.add_argument("--noise", type=int, default=0, help="Host busy-loop processes competing for CPUs")
+    bench.add_argument("--housekeeping", default="", help="cpulist reserved for VMM/IO threads")
+    bench.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "topology":
+            topology = read_topology()
+            for node, cpus in sorted(topology.nodes().items()):
+                print_color(f"node {node}: cpus {format_cpulist(cpus)}", Colors.HEADER)
+                for key, siblings in sorted(topology.cores().items()):
+                    if topology.cpus[siblings[0]].node == node:
+                        print(f"  package {key[0]} core {key[1]:<4} threads {format_cpulist(siblings)}")
+            return
+
+        targets = _targets(args)
+        if not targets:
+            print_color("No firecracker processes found.", Colors.WARNING)
+            return
+
+        if args.command == "show":
+            for target in targets:
+                print_color(f"{target.name} (pid {target.pid})", Colors.HEADER)
+                for name, cpus in describe_affinity(target.pid).items():
+                    print(f"  {name:<24} {cpus}")
+        elif args.command == "pin":
+            print_placements(place_vms(targets, args.policy, parse_cpulist(args.housekeeping), args.vcpus))
+        elif args.command == "unpin":
+            for target in targets:
+                unpin(target.pid)
+            print_color(f"Unpinned {len(targets)} VM(s).", Colors.OKGREEN)
+        elif args.command == "bench":
+            report = benchmark(
+                targets, args.workload, args.policy, args.iterations, args.warmup,
+                args.noise, parse_cpulist(args.housekeeping)
+            )
+            if args.json:
+                print(json.dumps(report, indent=2))
+            else:
+                print_benchmark(report)
+    except (PlacementError, RuntimeError) as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+    except PermissionError as e:
+        print_color(f"Error: {e} (pinning another user's threads needs root or CAP_SYS_NICE)", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+import os
+import sys
+import math
+import json
+import time
+import shutil
+import asyncio
+import argparse
+from collections import deque
+from typing import Optional, Dict, Any, List, Deque, Set
+
+from firecracker_api import Colors, print_color, FirecrackerClient, FirecrackerAPIError
+from vm_launcher import (
+    DEFAULT_TEMPLATE,
+    VMInstance,
+    load_template,
+    make_spec,
+    launch_vm,
+    remove_tap,
+    stop_process
+)
+from vm_ready import DEFAULT_PATTERN, wait_for_console
+from vm_admission import AdmissionController
+from vm_hugepages import configured_memory
+from vm_netlease import DEFAULT_LEASE_PATH, NetworkAllocator
+
+DEFAULT_POOL_DIR = "vms/pool"
+DEFAULT_METRICS_FILE = "pool-metrics.json"
+
+def percentile(samples: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of `samples` (None when empty)."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+class VMPool:
+    """
+    Keeps a set of booted, paused MicroVMs ready to hand out.
+
+    `acquire()` pops a paused VM and resumes it, which costs one API round
+    trip instead of a full boot. A background task keeps the pool topped up:
+    once the number of ready plus booting VMs drops below `low_watermark` it
+    boots new ones until `target_size` is reached. The pool never owns more
+    than `high_watermark` idle VMs; surplus VMs (e.g. after `resize()`) are
+    stopped.
+    """
+
+    def __init__(
+        self,
+        template_path: str = DEFAULT_TEMPLATE,
+        base_dir: str = DEFAULT_POOL_DIR,
+        target_size: int = 4,
+        low_watermark: Optional[int] = None,
+        high_watermark: Optional[int] = None,
+        boot_concurrency: int = 4,
+        ready_timeout: float = 60.0,
+        ready_pattern: str = DEFAULT_PATTERN,
+        firecracker_bin: str = "firecracker",
+        setup_taps: bool = False,
+        prefix: str = "pool",
+        leases: Optional[NetworkAllocator] = None
+    ):
+        self.template_path = template_path
+        self.template = load_template(template_path)
+        self.template_dir = os.path.dirname(os.path.abspath(template_path))
+        self.base_dir = base_dir
+        self.target_size = target_size
+        self.low_watermark = low_watermark if low_watermark is not None else max(1, target_size // 2)
+        self.high_watermark = high_watermark if high_watermark is not None else target_size * 2
+        self.ready_timeout = ready_timeout
+        self.ready_pattern = ready_pattern
+        self.firecracker_bin = firecracker_bin
+        self.setup_taps = setup_taps
+        self.prefix = prefix
+        self.leases = leases
+        self.mem_mib = configured_memory(self.template)
+        self.admission = AdmissionController()
+
+        self._ready: Deque[VMInstance] = deque()
+        self._booting = 0
+        self._free_indices: List[int] = []
+        self._next_index = 0
+        self._boot_limit = asyncio.Semaphore(boot_concurrency)
+        self._changed = asyncio.Condition()
+        self._refill_task: Optional[asyncio.Task] = None
+        self._boot_tasks: Set[asyncio.Task] = set()
+        self._watch_tasks: Set[asyncio.Task] = set()
+        self._closed = False
+
+        self.acquire_latencies: List[float] = []
+        self.boot_times: List[float] = []
+        self.hits = 0
+        self.misses = 0
+        self.boot_failures = 0
+        self.idle_exits = 0
+
+    # Pool lifecycle
+
+    async def start(self, wait: bool = True) -> None:
+        """Start the refill task and optionally wait for the pool to fill."""
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._refill_task = asyncio.create_task(self._refill_loop())
+        await self._notify()
+        if wait:
+            async with self._changed:
+                await self._changed.wait_for(
+                    lambda: len(self._ready) >= self.target_size or self._closed
+                )
+
+    async def close(self) -> None:
+        """Stop refilling and destroy every idle VM."""
+        self._closed = True
+        await self._notify()
+        if self._refill_task:
+            self._refill_task.cancel()
+            try:
+                await self._refill_task
+            except asyncio.CancelledError:
+                pass
+        # In-flight boots notice the pool is closed and destroy their VM.
+        await asyncio.gather(*self._boot_tasks, return_exceptions=True)
+        for task in list(self._watch_tasks):
+            task.cancel()
+        while self._ready:
+            await self.destroy(self._ready.popleft())
+
+    async def resize(self, target_size: int, low_watermark: Optional[int] = None, high_watermark: Optional[int] = None) -> None:
+        """Change the pool size; surplus idle VMs are stopped."""
+        self.target_size = target_size
+        if low_watermark is not None:
+            self.low_watermark = low_watermark
+        if high_watermark is not None:
+            self.high_watermark = high_watermark
+        while len(self._ready) > self.high_watermark:
+            await self.destroy(self._ready.pop())
+        await self._notify()
+
+    # Acquisition
+
+    async def acquire(self, timeout: Optional[float] = None) -> VMInstance:
+        """
+        Take a VM out of the pool and resume it.
+
+        Waits for the refill task when the pool is empty. A VM that cannot
+        be resumed (its VMM died after the idle check) is destroyed and the
+        next one is tried.
+
+        Raises:
+            asyncio.TimeoutError: if no VM became available within `timeout`
+        """
+        start = time.monotonic()
+        if self._ready:
+            self.hits += 1
+        else:
+            self.misses += 1
+        while True:
+            remaining = None if timeout is None else max(0.0, timeout - (time.monotonic() - start))
+            async with self._changed:
+                await asyncio.wait_for(
+                    self._changed.wait_for(lambda: bool(self._ready) or self._closed),
+                    remaining
+                )
+                if self._closed:
+                    raise RuntimeError("pool is closed")
+                instance = self._ready.popleft()
+            await self._notify()
+            try:
+                await asyncio.to_thread(self._api, instance, "resume")
+            except (OSError, FirecrackerAPIError) as e:
+                print_color(f"Pool VM {instance.spec.vm_id} could not be resumed, trying another: {e}", Colors.WARNING)
+                await self.destroy(instance)
+                continue
+            self.acquire_latencies.append(time.monotonic() - start)
+            return instance
+
+    async def release(self, instance: VMInstance) -> None:
+        """Return a sandbox after use; it is destroyed, never reused."""
+        await self.destroy(instance)
+
+    async def destroy(self, instance: VMInstance) -> None:
+        """Stop a VM's process and remove its working directory."""
+        await stop_process(instance.process)
+        await asyncio.to_thread(self.admission.release, instance.spec.api_socket)
+        if self.setup_taps:
+            await remove_tap(instance.spec.tap)
+        if self.leases:
+            await asyncio.to_thread(self.leases.release, instance.spec.workdir)
+        shutil.rmtree(instance.spec.workdir, ignore_errors=True)
+        self._free_indices.append(instance.spec.index)
+
+    # Refill
+
+    def owned(self) -> int:
+        """Number of idle VMs, ready or still booting."""
+        return len(self._ready) + self._booting
+
+    async def _notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _refill_loop(self) -> None:
+        refilling = False
+        async with self._changed:
+            while not self._closed:
+                owned = self.owned()
+                if owned < self.low_watermark:
+                    refilling = True
+                if refilling and owned < min(self.target_size, self.high_watermark):
+                    self._booting += 1
+                    task = asyncio.create_task(self._boot_one())
+                    self._boot_tasks.add(task)
+                    task.add_done_callback(self._boot_tasks.discard)
+                    continue
+                refilling = False
+                await self._changed.wait()
+
+    def _take_index(self) -> int:
+        if self._free_indices:
+            return self._free_indices.pop()
+        index = self._next_index
+        self._next_index += 1
+        return index
+
+    async def _boot_one(self) -> None:
+        index = self._take_index()
+        instance: Optional[VMInstance] = None
+        try:
+            async with self._boot_limit:
+                start = time.monotonic()
+                spec = make_spec(index, self.base_dir, self.prefix)
+                # A refused VM counts as a failed boot and is retried, so the pool queues for memory.
+                await asyncio.to_thread(self.admission.try_reserve, spec.api_socket, self.mem_mib, os.getpid())
+                instance = await launch_vm(
+                    spec, self.template, self.template_dir,
+                    self.firecracker_bin, self.setup_taps, leases=self.leases
+                )
+                if instance.error:
+                    raise RuntimeError(instance.error)
+                await self._wait_until_usable(instance)
+                await asyncio.to_thread(self._api, instance, "pause")
+                self.boot_times.append(time.monotonic() - start)
+            if self._closed:
+                await self.destroy(instance)
+            else:
+                self._ready.append(instance)
+                task = asyncio.create_task(self._watch_idle(instance))
+                self._watch_tasks.add(task)
+                task.add_done_callback(self._watch_tasks.discard)
+        except Exception as e:
+            self.boot_failures += 1
+            print_color(f"Pool VM {index} failed to boot: {e}", Colors.WARNING)
+            spec = make_spec(index, self.base_dir, self.prefix)
+            await asyncio.to_thread(self.admission.release, spec.api_socket)
+            if instance is not None:
+                await self.destroy(instance)
+            else:
+                if self.leases:
+                    await asyncio.to_thread(self.leases.release, spec.workdir)
+                self._free_indices.append(index)
+            await asyncio.sleep(1)
+        finally:
+            self._booting -= 1
+            await self._notify()
+
+    async def _watch_idle(self, instance: VMInstance) -> None:
+        """Drop a pooled VM the moment its process dies so it is never handed out."""
+        await instance.process.wait()
+        if instance in self._ready:
+            self._ready.remove(instance)
+            self.idle_exits += 1
+            print_color(f"Pool VM {instance.spec.vm_id} exited while idle (code {instance.process.returncode})", Colors.WARNING)
+            await self.destroy(instance)
+            await self._notify()
+
+    async def _wait_until_usable(self, instance: VMInstance) -> None:
+        """Wait for the guest's ready marker so it is never paused mid-boot."""
+        result = await wait_for_console(
+            instance.spec.console_path, self.ready_pattern, self.ready_timeout, pid=instance.pid
+        )
+        if not result.ready:
+            raise RuntimeError(f"guest not ready: {result.detail}")
+
+    @staticmethod
+    def _api(instance: VMInstance, action: str) -> None:
+        with FirecrackerClient(instance.spec.api_socket) as client:
+            getattr(client, action)()
+
+    # Metrics
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool occupancy and acquisition latency percentiles in milliseconds."""
+        def ms(value: Optional[float]) -> Optional[float]:
+            return round(value * 1000, 3) if value is not None else None
+
+        latencies = self.acquire_latencies
+        return {
+            "timestamp": time.time(),
+            "ready": len(self._ready),
+            "booting": self._booting,
+            "target_size": self.target_size,
+            "low_watermark": self.low_watermark,
+            "high_watermark": self.high_watermark,
+            "acquisitions": len(latencies),
+            "hits": self.hits,
+            "misses": self.misses,
+            "boot_failures": self.boot_failures,
+            "idle_exits": self.idle_exits,
+            "acquire_ms": {
+                "p50": ms(percentile(latencies, 50)),
+                "p90": ms(percentile(latencies, 90)),
+                "p99": ms(percentile(latencies, 99)),
+                "max": ms(max(latencies) if latencies else None)
+            },
+            "boot_ms": {
+                "p50": ms(percentile(self.boot_times, 50)),
+                "p99": ms(percentile(self.boot_times, 99))
+            }
+        }
+
+    def export_metrics(self, path: str) -> None:
+        """Write `stats()` to `path` atomically."""
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.stats(), f, indent=2)
+        os.replace(tmp, path)
+
+async def run_pool(args: argparse.Namespace) -> Dict[str, Any]:
+    """Fill a pool, serve `args.acquire` sandboxes at `args.rate`/s and report."""
+    pool = VMPool(
+        template_path=args.template,
+        base_dir=args.base_dir,
+        target_size=args.size,
+        low_watermark=args.low,
+        high_watermark=args.high,
+        boot_concurrency=args.boot_concurrency,
+        ready_timeout=args.ready_timeout,
+        ready_pattern=args.ready_pattern,
+        firecracker_bin=args.firecracker,
+        setup_taps=args.setup_taps,
+        leases=None if args.no_leases else NetworkAllocator(state_path=args.leases)
+    )
+    print_color(f"Filling pool to {args.size} paused VMs...", Colors.HEADER)
+    await pool.start()
+    print_color(f"Pool ready ({pool.stats()['ready']} VMs).", Colors.OKGREEN)
+
+    async def exporter() -> None:
+        while True:
+            pool.export_metrics(args.metrics_file)
+            await asyncio.sleep(args.metrics_interval)
+
+    export_task = asyncio.create_task(exporter())
+    try:
+        for _ in range(args.acquire):
+            vm = await pool.acquire(timeout=args.timeout)
+            print(f"Acquired {vm.spec.vm_id} in {pool.acquire_latencies[-1] * 1000:.1f} ms")
+            await asyncio.sleep(args.hold)
+            await pool.release(vm)
+            if args.rate > 0:
+                await asyncio.sleep(1.0 / args.rate)
+        if args.acquire == 0:
+            await asyncio.Event().wait()
+    finally:
+        export_task.cancel()
+        pool.export_metrics(args.metrics_file)
+        await pool.close()
+    return pool.stats()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Keep a warm pool of booted, paused Firecracker MicroVMs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, help="Firecracker config used as template")
+    parser.add_argument("--base-dir", default=DEFAULT_POOL_DIR, help="Working directory for pool VMs")
+    parser.add_argument("--size", type=int, default=4, help="Target number of ready VMs")
+    parser.add_argument("--low", type=int, default=None, help="Refill when fewer VMs are owned (default: size/2)")
+    parser.add_argument("--high", type=int, default=None, help="Never keep more idle VMs than this (default: 2*size)")
+    parser.add_argument("--boot-concurrency", type=int, default=4, help="Parallel boots while refilling")
+    parser.add_argument("--ready-timeout", type=float, default=60.0, help="Seconds a new VM may take to report ready")
+    parser.add_argument("--ready-pattern", default=DEFAULT_PATTERN, help="Console regex that marks a guest as booted")
+    parser.add_argument("--firecracker", default="firecracker", help="Firecracker binary")
+    parser.add_argument("--setup-taps", action="store_true", help="Create a tap device per VM")
+    parser.add_argument("--leases", default=DEFAULT_LEASE_PATH, help="Lease file handing out taps, /30s and MACs (FC_NET_LEASES)")
+    parser.add_argument("--no-leases", action="store_true", help="Derive taps, /30s and MACs from the VM index instead")
+    parser.add_argument("--acquire", type=int, default=0, help="Sandboxes to acquire and release (0 = keep the pool running)")
+    parser.add_argument("--rate", type=float, default=0.0, help="Acquisitions per second (0 = back to back)")
+    parser.add_argument("--hold", type=float, default=0.0, help="Seconds to hold each sandbox before releasing it")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for a VM when the pool is empty")
+    parser.add_argument("--metrics-file", default=DEFAULT_METRICS_FILE, help="Where acquisition metrics are exported")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="Seconds between metrics exports")
+    args = parser.parse_args()
+
+    if not shutil.which(args.firecracker):
+        print_color(f"Error: {args.firecracker} not found in PATH.", Colors.FAIL)
+        sys.exit(1)
+
+    try:
+        stats = asyncio.run(run_pool(args))
+    except KeyboardInterrupt:
+        return
+    acquire = stats["acquire_ms"]
+    print_color(
+        f"\n{stats['acquisitions']} acquisitions ({stats['hits']} hits, {stats['misses']} misses): "
+        f"p50 {acquire['p50']} ms, p90 {acquire['p90']} ms, p99 {acquire['p99']} ms, max {acquire['max']} ms",
+        Colors.OKGREEN
+    )
+    print(f"Metrics written to {args.metrics_file}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from typing import Optional, Dict, Any, List
+
+from firecracker_api import Colors, print_color, FirecrackerClient, FirecrackerAPIError, DEFAULT_API_SOCKET
+
+DEFAULT_PROFILES_FILE = "qos-profiles.json"
+MB = 1000 * 1000
+
+# Rates are per second, bursts are a one-time allowance on top of the rate.
+# A missing or zero rate means that bucket is not limited.
+BUILTIN_PROFILES: Dict[str, Dict[str, Dict[str, float]]] = {
+    "unlimited": {"disk": {}, "net": {}},
+    "small": {
+        "disk": {"mbps": 20, "burst_mb": 100, "iops": 500, "burst_ops": 1000},
+        "net": {"mbps": 10, "burst_mb": 50}
+    },
+    "standard": {
+        "disk": {"mbps": 100, "burst_mb": 500, "iops": 2000, "burst_ops": 5000},
+        "net": {"mbps": 50, "burst_mb": 200}
+    },
+    "large": {
+        "disk": {"mbps": 400, "burst_mb": 1000, "iops": 10000, "burst_ops": 20000},
+        "net": {"mbps": 250, "burst_mb": 500}
+    }
+}
+
+def load_profiles(path: Optional[str] = None) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """Built-in profiles, overridden and extended by a JSON file when it exists."""
+    profiles = json.loads(json.dumps(BUILTIN_PROFILES))
+    path = path or DEFAULT_PROFILES_FILE
+    if os.path.exists(path):
+        with open(path) as f:
+            profiles.update(json.load(f))
+    return profiles
+
+def _bucket(rate: float, burst: float) -> Dict[str, int]:
+    # A bucket of `rate` tokens refilled every second; size 0 disables it.
+    bucket = {"size": int(rate), "refill_time": 1000 if rate else 0}
+    if rate and burst:
+        bucket["one_time_burst"] = int(burst)
+    return bucket
+
+def rate_limiter(limits: Dict[str, float]) -> Dict[str, Any]:
+    """
+    Firecracker rate_limiter object for one device.
+
+    Args:
+        limits: {"mbps", "burst_mb", "iops", "burst_ops"}; absent or zero
+            values leave that bucket unlimited
+    """
+    return {
+        "bandwidth": _bucket(limits.get("mbps", 0) * MB, limits.get("burst_mb", 0) * MB),
+        "ops": _bucket(limits.get("iops", 0), limits.get("burst_ops", 0))
+    }
+
+def resolve(profile: str, profiles: Optional[Dict[str, Dict[str, Dict[str, float]]]] = None) -> Dict[str, Dict[str, float]]:
+    profiles = profiles or load_profiles()
+    if profile not in profiles:
+        raise KeyError(f"unknown QoS profile {profile!r}; choose from {', '.join(sorted(profiles))}")
+    return profiles[profile]
+
+def apply_to_config(config: Dict[str, Any], profile: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+    """Add the profile's rate limiters to every drive and network interface of a config."""
+    if profile.get("disk"):
+        for drive in config.get("drives", []):
+            drive["rate_limiter"] = rate_limiter(profile["disk"])
+    if profile.get("net"):
+        for iface in config.get("network-interfaces", []):
+            iface["rx_rate_limiter"] = rate_limiter(profile["net"])
+            iface["tx_rate_limiter"] = rate_limiter(profile["net"])
+    return config
+
+def apply_to_vm(api_socket: str, profile: Dict[str, Dict[str, float]]) -> List[str]:
+    """PATCH the profile onto every drive and interface of a running VM; returns the devices changed."""
+    disk = rate_limiter(profile.get("disk", {}))
+    net = rate_limiter(profile.get("net", {}))
+    changed = []
+    with FirecrackerClient(api_socket) as client:
+        config = client.get_vm_config()
+        for drive in config.get("drives", []):
+            client.patch_drive(drive["drive_id"], rate_limiter=disk)
+            changed.append(f"drive {drive['drive_id']}")
+        for iface in config.get("network-interfaces", []):
+            client.patch_network_interface(iface["iface_id"], rx_rate_limiter=net, tx_rate_limiter=net)
+            changed.append(f"iface {iface['iface_id']}")
+    return changed
+
+def describe(profile: Dict[str, Dict[str, float]]) -> str:
+    def part(name: str, limits: Dict[str, float]) -> str:
+        bits = []
+        if limits.get("mbps"):
+            bits.append(f"{limits['mbps']:g} MB/s (+{limits.get('burst_mb', 0):g} MB burst)")
+        if limits.get("iops"):
+            bits.append(f"{limits['iops']:g} IOPS (+{limits.get('burst_ops', 0):g} burst)")
+        return f"{name}: {', '.join(bits) or 'unlimited'}"
+    return "; ".join(part(n, profile.get(n, {})) for n in ("disk", "net"))
+
+# Benchmark
+
+def jain_index(values: List[float]) -> Optional[float]:
+    """Jain's fairness index: 1.0 when all values are equal, 1/n when one takes everything."""
+    if not values or not any(values):
+        return None
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+async def _run(command: str) -> float:
+    start = time.monotonic()
+    proc = await asyncio.create_subprocess_shell(
+        command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(f"workload failed ({proc.returncode}): {stderr.decode(errors='replace').strip()}")
+    return time.monotonic() - start
+
+async def _contend(vms: List[Dict[str, Any]], workload: str, noisy: int, size_mb: float) -> Dict[str, Any]:
+    """Run the workload on every VM at once; the first `noisy` VMs repeat it until the others finish."""
+    stop = asyncio.Event()
+
+    async def noisy_loop(vm: Dict[str, Any]) -> int:
+        runs = 0
+        while not stop.is_set():
+            await _run(workload.format(**vm))
+            runs += 1
+        return runs
+
+    noise = [asyncio.create_task(noisy_loop(vm)) for vm in vms[:noisy]]
+    try:
+        measured = vms[noisy:]
+        elapsed = await asyncio.gather(*(_run(workload.format(**vm)) for vm in measured))
+    finally:
+        stop.set()
+        noisy_runs = await asyncio.gather(*noise, return_exceptions=True)
+    throughput = [size_mb / e for e in elapsed]
+    return {
+        "per_vm_mbps": {vm["vm_id"]: round(t, 2) for vm, t in zip(measured, throughput)},
+        "noisy_runs": {vm["vm_id"]: r for vm, r in zip(vms[:noisy], noisy_runs) if isinstance(r, int)},
+        "min_mbps": round(min(throughput), 2),
+        "max_mbps": round(max(throughput), 2),
+        "total_mbps": round(sum(throughput), 2),
+        "jain_index": round(jain_index(throughput), 4)
+    }
+
+async def benchmark(
+    vms: List[Dict[str, Any]],
+    workload: str,
+    profile_name: str,
+    profiles: Dict[str, Dict[str, Dict[str, float]]],
+    noisy: int = 1,
+    size_mb: float = 256.0
+) -> Dict[str, Any]:
+    """
+    Compare per-VM throughput of a contended workload without limits and with `profile_name`.
+
+    `workload` is a host command template run once per VM; it may use
+    {vm_id}, {api_socket}, {vsock_path}, {guest_cid}, {guest_mac}, {tap}
+    and {workdir}, and should move `size_mb` MB through the guest's disk
+    or network.
+    """
+    if noisy >= len(vms):
+        raise ValueError(f"need more than {noisy} VMs so some are measured next to the noisy ones")
+    report: Dict[str, Any] = {"profile": profile_name, "vms": len(vms), "noisy": noisy, "size_mb": size_mb}
+    for phase, name in (("without", "unlimited"), ("with", profile_name)):
+        for vm in vms:
+            await asyncio.to_thread(apply_to_vm, vm["api_socket"], resolve(name, profiles))
+        report[phase] = await _contend(vms, workload, noisy, size_mb)
+    for vm in vms:
+        await asyncio.to_thread(apply_to_vm, vm["api_socket"], resolve("unlimited", profiles))
+    return report
+
+def print_benchmark(report: Dict[str, Any]) -> None:
+    print_color(
+        f"{report['vms'] - report['noisy']} measured VM(s) next to {report['noisy']} noisy neighbour(s), "
+        f"{report['size_mb']:g} MB each, profile {report['profile']}:", Colors.HEADER
+    )
+    print(f"{'':<9} {'min MB/s':>10} {'max MB/s':>10} {'total MB/s':>11} {'Jain':>8}")
+    for phase in ("without", "with"):
+        r = report[phase]
+        print(f"{phase:<9} {r['min_mbps']:>10.2f} {r['max_mbps']:>10.2f} {r['total_mbps']:>11.2f} {r['jain_index']:>8.4f}")
+    for phase in ("without", "with"):
+        runs = report[phase]["noisy_runs"]
+        if runs:
+            print(f"noisy neighbour runs {phase} limits: " + ", ".join(f"{k}={v}" for k, v in runs.items()))
+
+def _launched_vms(base_dir: str) -> List[Dict[str, Any]]:
+    vms = []
+    if not os.path.isdir(base_dir):
+        return vms
+    for name in sorted(os.listdir(base_dir)):
+        state_path = os.path.join(base_dir, name, "vm.json")
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+            if state.get("pid") and not state.get("error") and os.path.exists(state["spec"]["api_socket"]):
+                vms.append(state["spec"])
+    return vms
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Disk and network QoS profiles for Firecracker MicroVMs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--profiles", default=DEFAULT_PROFILES_FILE, help="JSON file with extra or overriding profiles")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("list", help="Show the available profiles")
+
+    apply = sub.add_parser("apply", help="PATCH a profile onto running VMs")
+    apply.add_argument("profile", help="Profile name")
+    apply.add_argument("--socket", action="append", default=[], help="API socket (repeatable, default: FC_API_SOCKET or /tmp/firecracker.socket)")
+
+    limit = sub.add_parser("limit", help="PATCH explicit limits onto one device of a running VM")
+    limit.add_argument("--socket", default=os.environ.get("FC_API_SOCKET", DEFAULT_API_SOCKET), help="API socket")
+    device = limit.add_mutually_exclusive_group(required=True)
+    device.add_argument("--drive", help="Drive id, e.g. rootfs")
+    device.add_argument("--iface", help="Network interface id, e.g. eth0")
+    limit.add_argument("--mbps", type=float, default=0, help="Bandwidth in MB/s (0 = unlimited)")
+    limit.add_argument("--burst-mb", type=float, default=0, help="One-time bandwidth burst in MB")
+    limit.add_argument("--iops", type=float, default=0, help="Operations per second (0 = unlimited)")
+    limit.add_argument("--burst-ops", type=float, default=0, help="One-time burst in operations")
+
+    bench = sub.add_parser("bench", help="Measure per-VM throughput fairness with and without a profile")
+    bench.add_argument("--base-dir", default="vms", help="Launcher directory of the VMs to use")
+    bench.add_argument("--profile", default="standard", help="Profile to compare against no limits")
+    bench.add_argument("--workload", required=True, help="Host command template run per VM, e.g. \"ssh root@{vm_id} dd ...\"")
+    bench.add_argument("--size-mb", type=float, default=256.0, help="MB the workload moves per run")
+    bench.add_argument("--noisy", type=int, default=1, help="VMs that run the workload in a loop as noisy neighbours")
+    bench.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    args = parser.parse_args()
+
+    try:
+        profiles = load_profiles(args.profiles)
+        if args.command == "list":
+            for name in sorted(profiles):
+                print(f"{name:<10} {describe(profiles[name])}")
+        elif args.command == "apply":
+            profile = resolve(args.profile, profiles)
+            for path in args.socket or [os.environ.get("FC_API_SOCKET", DEFAULT_API_SOCKET)]:
+                changed = apply_to_vm(path, profile)
+                print_color(f"{path}: {args.profile} applied to {', '.join(changed) or 'no devices'}", Colors.OKGREEN)
+        elif args.command == "limit":
+            limiter = rate_limiter({"mbps": args.mbps, "burst_mb": args.burst_mb, "iops": args.iops, "burst_ops": args.burst_ops})
+            with FirecrackerClient(args.socket) as client:
+                if args.drive:
+                    client.patch_drive(args.drive, rate_limiter=limiter)
+                else:
+                    client.patch_network_interface(args.iface, rx_rate_limiter=limiter, tx_rate_limiter=limiter)
+            print_color(f"Updated {args.drive or args.iface}: {json.dumps(limiter)}", Colors.OKGREEN)
+        elif args.command == "bench":
+            vms = _launched_vms(args.base_dir)
+            report = asyncio.run(benchmark(vms, args.workload, args.profile, profiles, args.noisy, args.size_mb))
+            if args.json:
+                print(json.dumps(report, indent=2))
+            else:
+                print_benchmark(report)
+    except (KeyError, ValueError, RuntimeError) as e:
+        print_color(f"Error: {e.args[0] if e.args else e}", Colors.FAIL)
+        sys.exit(1)
+    except (OSError, FirecrackerAPIError) as e:
+        print_color(f"Error: {getattr(e, 'fault', None) or e}", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
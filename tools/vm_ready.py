@@ -0,0 +1,368 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import time
+import struct
+import ctypes
+import asyncio
+import argparse
+import ctypes.util
+from dataclasses import dataclass
+from typing import Optional, List, Tuple
+
+from firecracker_api import Colors, print_color
+
+# Printed to the serial console by the rootfs' rc.local once networking is up.
+READY_MARKER = "firecracker-sandbox: ready"
+DEFAULT_PATTERN = f"{READY_MARKER}|login:"
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+_EVENT_HEADER = struct.Struct("iIII")
+
+@dataclass
+class ReadinessResult:
+    """Outcome of a readiness probe."""
+    ready: bool
+    source: str
+    elapsed: float
+    detail: str = ""
+
+class Inotify:
+    """
+    Thin ctypes wrapper around inotify(7).
+
+    The descriptor is non-blocking so it can be registered with an asyncio
+    loop via `loop.add_reader(inotify.fileno(), ...)`.
+    """
+
+    _libc = None
+
+    def __init__(self):
+        if Inotify._libc is None:
+            Inotify._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = Inotify._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._paths = {}
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch `path` for the events in `mask` and return the watch descriptor."""
+        wd = Inotify._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self._paths[wd] = path
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        """Stop watching a descriptor returned by `add_watch`."""
+        Inotify._libc.inotify_rm_watch(self._fd, wd)
+        self._paths.pop(wd, None)
+
+    def read_events(self) -> List[Tuple[str, int, str]]:
+        """Drain pending events as (watched path, mask, name) tuples."""
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+                offset += length
+                events.append((self._paths.get(wd, ""), mask, name))
+        return events
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __enter__(self) -> "Inotify":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def open_inotify() -> Optional[Inotify]:
+    """Return an Inotify instance, or None where inotify is unavailable."""
+    try:
+        return Inotify()
+    except (OSError, AttributeError):
+        return None
+
+async def wait_readable(fd: int, timeout: float) -> bool:
+    """Wait until `fd` is readable; False on timeout."""
+    loop = asyncio.get_running_loop()
+    readable = loop.create_future()
+    loop.add_reader(fd, lambda: readable.done() or readable.set_result(True))
+    try:
+        await asyncio.wait_for(readable, timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        loop.remove_reader(fd)
+
+def _process_alive(pid: Optional[int]) -> bool:
+    if pid is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+async def wait_for_console(
+    path: str,
+    pattern: str = DEFAULT_PATTERN,
+    timeout: float = 60.0,
+    offset: int = 0,
+    pid: Optional[int] = None
+) -> ReadinessResult:
+    """
+    Wait for `pattern` to appear in a serial console log.
+
+    The file is read incrementally from `offset`; between reads the probe
+    sleeps on inotify events for the file (or its directory, until the file
+    exists) rather than a fixed interval. Fails early if `pid` exits.
+    """
+    regex = re.compile(pattern.encode())
+    start = time.monotonic()
+    deadline = start + timeout
+    inotify = open_inotify()
+    directory = os.path.dirname(os.path.abspath(path))
+    tail = b""
+    handle = None
+    try:
+        if inotify:
+            inotify.add_watch(directory, IN_CREATE | IN_MOVED_TO)
+        while True:
+            if handle is None and os.path.exists(path):
+                handle = open(path, "rb")
+                handle.seek(offset)
+                if inotify:
+                    inotify.add_watch(path, IN_MODIFY | IN_CLOSE_WRITE | IN_DELETE_SELF)
+
+            if handle is not None:
+                chunk = handle.read()
+                if chunk:
+                    # Keep a short tail so a marker split across reads still matches.
+                    buffer = tail + chunk
+                    match = regex.search(buffer)
+                    if match:
+                        return ReadinessResult(True, "console", time.monotonic() - start, match.group(0).decode(errors="replace"))
+                    tail = buffer[-4096:]
+
+            if not _process_alive(pid):
+                return ReadinessResult(False, "console", time.monotonic() - start, f"process {pid} exited")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return ReadinessResult(False, "console", time.monotonic() - start, "timed out")
+
+            # Wake at least twice a second to notice a dead VMM.
+            if inotify:
+                if await wait_readable(inotify.fileno(), min(remaining, 0.5)):
+                    inotify.read_events()
+            else:
+                await asyncio.sleep(min(remaining, 0.02))
+    finally:
+        if handle is not None:
+            handle.close()
+        if inotify:
+            inotify.close()
+
+async def vsock_connect(uds_path: str, port: int, timeout: float = 1.0) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """
+    Open a host-initiated connection to guest vsock `port`.
+
+    Performs Firecracker's `CONNECT <port>` handshake on the vsock UDS.
+
+    Raises:
+        ConnectionError: if no guest process is listening on the port
+    """
+    reader, writer = await asyncio.open_unix_connection(uds_path)
+    try:
+        writer.write(f"CONNECT {port}\n".encode())
+        await writer.drain()
+        reply = await asyncio.wait_for(reader.readline(), timeout)
+        if not reply.startswith(b"OK "):
+            raise ConnectionError(f"vsock port {port} refused: {reply!r}")
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+async def wait_for_vsock(
+    uds_path: str,
+    port: int,
+    timeout: float = 60.0,
+    pid: Optional[int] = None
+) -> ReadinessResult:
+    """Retry a host-initiated vsock handshake until a guest service answers."""
+    start = time.monotonic()
+    deadline = start + timeout
+    delay = 0.01
+    while True:
+        try:
+            _, writer = await vsock_connect(uds_path, port, max(0.1, deadline - time.monotonic()))
+            writer.close()
+            return ReadinessResult(True, "vsock", time.monotonic() - start, f"port {port}")
+        except (OSError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            pass
+        if not _process_alive(pid):
+            return ReadinessResult(False, "vsock", time.monotonic() - start, f"process {pid} exited")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return ReadinessResult(False, "vsock", time.monotonic() - start, "timed out")
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.2)
+
+async def wait_for_vsock_hello(
+    uds_path: str,
+    port: int,
+    timeout: float = 60.0
+) -> ReadinessResult:
+    """
+    Wait for the guest to connect to host vsock `port` (CID 2).
+
+    Firecracker forwards guest-initiated connections to `<uds_path>_<port>`,
+    so the listener must be created before the guest boots. The first line
+    the guest sends is returned as the detail.
+    """
+    start = time.monotonic()
+    listen_path = f"{uds_path}_{port}"
+    hello: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    async def on_connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            line = await asyncio.wait_for(reader.readline(), 5)
+            if not hello.done():
+                hello.set_result(line.decode(errors="replace").strip())
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            writer.close()
+
+    if os.path.exists(listen_path):
+        os.unlink(listen_path)
+    server = await asyncio.start_unix_server(on_connect, listen_path)
+    try:
+        detail = await asyncio.wait_for(hello, timeout)
+        return ReadinessResult(True, "vsock-hello", time.monotonic() - start, detail)
+    except asyncio.TimeoutError:
+        return ReadinessResult(False, "vsock-hello", time.monotonic() - start, "timed out")
+    finally:
+        server.close()
+        await server.wait_closed()
+        try:
+            os.unlink(listen_path)
+        except FileNotFoundError:
+            pass
+
+async def wait_until_ready(
+    console_path: Optional[str] = None,
+    pattern: str = DEFAULT_PATTERN,
+    vsock_path: Optional[str] = None,
+    vsock_port: Optional[int] = None,
+    timeout: float = 60.0,
+    offset: int = 0,
+    pid: Optional[int] = None
+) -> ReadinessResult:
+    """
+    Run the configured probes concurrently and return the first success.
+
+    With both a console log and a vsock port configured, whichever signal
+    arrives first wins; a failure is only reported once every probe failed.
+    """
+    probes = []
+    if console_path:
+        probes.append(wait_for_console(console_path, pattern, timeout, offset, pid))
+    if vsock_path and vsock_port:
+        probes.append(wait_for_vsock(vsock_path, vsock_port, timeout, pid))
+    if not probes:
+        raise ValueError("no readiness probe configured")
+
+    tasks = [asyncio.ensure_future(p) for p in probes]
+    failures = []
+    try:
+        for finished in asyncio.as_completed(tasks):
+            result = await finished
+            if result.ready:
+                return result
+            failures.append(result)
+    finally:
+        for task in tasks:
+            task.cancel()
+    if len(failures) == 1:
+        return failures[0]
+    return ReadinessResult(
+        False,
+        "+".join(r.source for r in failures),
+        max(r.elapsed for r in failures),
+        "; ".join(f"{r.source}: {r.detail}" for r in failures)
+    )
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Wait until a Firecracker guest is actually usable",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--console", help="Serial console log to watch")
+    parser.add_argument("--pattern", default=DEFAULT_PATTERN, help="Regex that marks the guest as ready")
+    parser.add_argument("--from-end", action="store_true", help="Ignore console output written before the probe started")
+    parser.add_argument("--vsock", help="Firecracker vsock UDS path")
+    parser.add_argument("--vsock-port", type=int, help="Guest vsock port to handshake with")
+    parser.add_argument("--vsock-listen", type=int, help="Wait for the guest to connect to this host vsock port")
+    parser.add_argument("--pid", type=int, help="Give up early if this process exits")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait")
+    parser.add_argument("--quiet", action="store_true", help="Only report failures")
+    args = parser.parse_args()
+
+    if args.vsock_listen:
+        if not args.vsock:
+            parser.error("--vsock-listen requires --vsock")
+        probe = wait_for_vsock_hello(args.vsock, args.vsock_listen, args.timeout)
+    elif args.console or (args.vsock and args.vsock_port):
+        offset = 0
+        if args.from_end and args.console and os.path.exists(args.console):
+            offset = os.path.getsize(args.console)
+        probe = wait_until_ready(
+            console_path=args.console,
+            pattern=args.pattern,
+            vsock_path=args.vsock,
+            vsock_port=args.vsock_port,
+            timeout=args.timeout,
+            offset=offset,
+            pid=args.pid
+        )
+    else:
+        parser.error("configure --console and/or --vsock with --vsock-port or --vsock-listen")
+
+    result = asyncio.run(probe)
+    if result.ready:
+        if not args.quiet:
+            print_color(f"Guest ready after {result.elapsed:.2f}s ({result.source}: {result.detail})", Colors.OKGREEN)
+        return
+    print_color(f"Guest not ready after {result.elapsed:.2f}s ({result.source}: {result.detail})", Colors.FAIL)
+    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import queue
+import shlex
+import socket
+import struct
+import shutil
+import argparse
+import contextlib
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Optional, Dict, Any, List, Tuple, BinaryIO
+
+from firecracker_api import Colors, print_color
+from vm_chunkstore import DEFAULT_STORE, DEFAULT_WORKERS, ChunkStore, ChunkStoreError, Recipe
+from vm_catalog import Catalog, CatalogError
+from vm_snapshot import DEFAULT_SNAPSHOT_DIR, Layer, SnapshotChain, SnapshotError, allocated_bytes
+
+DEFAULT_STREAMS = 4
+# Objects are sent in batches of about this many compressed bytes, one batch per request.
+BATCH_BYTES = 8 * 1024 * 1024
+# Digests per `missing` query, to keep headers small.
+QUERY_DIGESTS = 8192
+HEADER = struct.Struct(">I")
+
+class ReplicationError(Exception):
+    pass
+
+def send_frame(f: BinaryIO, header: Dict[str, Any], payload: bytes = b"") -> None:
+    """Write one message: a length-prefixed JSON header, then `header["size"]` payload bytes."""
+    data = json.dumps(dict(header, size=len(payload))).encode()
+    f.write(HEADER.pack(len(data)) + data)
+    if payload:
+        f.write(payload)
+    f.flush()
+
+def _read_exact(f: BinaryIO, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) != n:
+        raise EOFError(f"stream closed after {len(data)} of {n} bytes")
+    return data
+
+def read_frame(f: BinaryIO) -> Optional[Tuple[Dict[str, Any], bytes]]:
+    """Read one message; None when the peer closed the stream between messages."""
+    prefix = f.read(HEADER.size)
+    if not prefix:
+        return None
+    if len(prefix) != HEADER.size:
+        raise EOFError("stream closed inside a message header")
+    header = json.loads(_read_exact(f, HEADER.unpack(prefix)[0]))
+    return header, _read_exact(f, header["size"]) if header["size"] else b""
+
+class PipeTransport:
+    """
+    One stream to a receiver started as a subprocess, talking over its stdin and stdout.
+
+    The command is `vm_replicate.py receive` either run locally (loopback,
+    e.g. between two store directories) or through ssh on another host.
+    """
+
+    def __init__(self, cmd: List[str]):
+        self.cmd = cmd
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def request(self, header: Dict[str, Any], payload: bytes = b"") -> Dict[str, Any]:
+        try:
+            send_frame(self.process.stdin, header, payload)
+            reply = read_frame(self.process.stdout)
+        except (BrokenPipeError, EOFError) as e:
+            raise ReplicationError(f"receiver exited ({self.process.poll()}): {e}")
+        if reply is None:
+            raise ReplicationError(f"receiver exited ({self.process.wait()}) without replying")
+        if "error" in reply[0]:
+            raise ReplicationError(f"receiver: {reply[0]['error']}")
+        return reply[0]
+
+    def close(self) -> None:
+        try:
+            send_frame(self.process.stdin, {"op": "bye"})
+            self.process.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+def receiver_command(
+    store: str,
+    snapshot_dir: str,
+    catalog: Optional[str] = None,
+    host: Optional[str] = None,
+    python: str = "python3",
+    cwd: str = ".",
+    script: str = os.path.join("tools", "vm_replicate.py")
+) -> List[str]:
+    """Command line of a receiver: this script on the local host, or `script` in `cwd` on `host` over ssh."""
+    options = ["--store", store, "--dir", snapshot_dir] + (["--catalog", catalog] if catalog else [])
+    if host is None:
+        return [sys.executable, os.path.abspath(__file__)] + options + ["receive"]
+    remote = " ".join(shlex.quote(arg) for arg in [python, script] + options + ["receive"])
+    return ["ssh", "-o", "BatchMode=yes", host, f"cd {shlex.quote(cwd)} && exec {remote}"]
+
+def export_layer(chain: SnapshotChain, layer_id: Optional[int] = None, workers: int = DEFAULT_WORKERS) -> Dict[str, Any]:
+    """
+    Describe a layer as a set of store recipes, adding whatever is missing.
+
+    The memory image is archived as usual; the vmstate, the captured
+    drives and the kernel are added as sidecar recipes of the layer
+    (`<chain>/<id>.vmstate`, `.disk.<drive>`, `.kernel`) so that every
+    file travels as deduplicated chunks. Sidecars are dropped with their
+    layer.
+    """
+    if chain.store is None:
+        raise ReplicationError("replication needs a chunk store")
+    layer = chain.layers[chain._index(layer_id)]
+    chain.archive(chain.store, workers)
+    name = chain.recipe_name(layer.id)
+    files = {"vmstate": chain.vmstate(layer.id)}
+    files.update({f"disk.{drive_id}": chain.disk(layer.id, drive_id) for drive_id in layer.disks})
+    if layer.kernel:
+        files["kernel"] = os.path.join(chain.kernels_dir, layer.kernel)
+    recipes = {"memory": chain.store.recipe(name)}
+    for key, path in files.items():
+        sidecar = f"{name}.{key}"
+        if not os.path.exists(chain.store.recipe_path(sidecar)):
+            if not os.path.exists(path):
+                raise ReplicationError(f"{chain.name}/{layer.id:04d} is missing {path}")
+            with chain.catalog.lock() if chain.catalog else contextlib.nullcontext():
+                chain.store.put_file(path, sidecar, workers=workers)
+                if chain.catalog:
+                    chain.catalog.ref_chunks(chain.store.recipe(sidecar).chunks)
+        recipes[key] = chain.store.recipe(sidecar)
+    return {
+        "origin": f"{socket.gethostname()}:{name}@{layer.created_at}",
+        "chain": chain.name,
+        "layer": asdict(layer),
+        "recipes": {key: asdict(recipe) for key, recipe in recipes.items()}
+    }
+
+def import_layer(
+    bundle: Dict[str, Any],
+    snapshot_dir: str,
+    store: ChunkStore,
+    catalog: Optional[Catalog] = None,
+    workers: int = DEFAULT_WORKERS
+) -> Tuple[Layer, bool]:
+    """
+    Rebuild an exported layer as the new full base of the local chain of the same name.
+
+    All chunks must already be in `store`. The files are written into a
+    fresh layer directory and the recipes kept, so the layer can be
+    restored from either. Importing the layer the chain already ends with
+    does nothing. Returns the layer and whether it was added.
+    """
+    chain = SnapshotChain(os.path.join(snapshot_dir, bundle["chain"]), catalog, store)
+    if chain.layers and chain.layers[-1].origin == bundle["origin"]:
+        return chain.layers[-1], False
+    recipes = {key: Recipe(**recipe) for key, recipe in bundle["recipes"].items()}
+    missing = {digest for recipe in recipes.values() for digest in recipe.chunks if digest and not store.has(digest)}
+    if missing:
+        raise ReplicationError(f"{len(missing)} chunk(s) of {bundle['origin']} have not arrived")
+    layer = Layer(**bundle["layer"])
+    layer.id = chain.next_id
+    layer.kind = "Full"
+    layer.archived = True
+    layer.staged = False
+    layer.origin = bundle["origin"]
+    name = chain.recipe_name(layer.id)
+    names = {key: name if key == "memory" else f"{name}.{key}" for key in recipes}
+    paths = {key: chain.disk(layer.id, key[len("disk."):]) for key in recipes if key.startswith("disk.")}
+    paths.update(memory=chain.memory(layer.id), vmstate=chain.vmstate(layer.id))
+    chain.next_id += 1
+    chain.save()
+    try:
+        for key, recipe in recipes.items():
+            store.save_recipe(Recipe(name=names[key], size=recipe.size, chunk_size=recipe.chunk_size, chunks=recipe.chunks))
+        for key, path in paths.items():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            store.restore_file(names[key], path, workers)
+        if layer.kernel and not os.path.exists(os.path.join(chain.kernels_dir, layer.kernel)):
+            os.makedirs(chain.kernels_dir, exist_ok=True)
+            store.restore_file(names["kernel"], os.path.join(chain.kernels_dir, layer.kernel), workers)
+    except Exception:
+        for recipe_name in names.values():
+            store.remove(recipe_name)
+        shutil.rmtree(chain.layer_dir(layer.id), ignore_errors=True)
+        raise
+    layer.bytes_written = allocated_bytes(chain.memory(layer.id)) + os.path.getsize(chain.vmstate(layer.id))
+    with catalog.lock() if catalog else contextlib.nullcontext():
+        chain._drop(chain.layers)
+        chain.layers = [layer]
+        chain.source = None
+        chain.save()
+        if catalog:
+            chain._record(layer, None, recipes["memory"].chunks)
+            for key, recipe in recipes.items():
+                if key != "memory":
+                    catalog.ref_chunks(recipe.chunks)
+    return layer, True
+
+def serve(store: ChunkStore, snapshot_dir: str, catalog: Optional[Catalog], rfile: BinaryIO, wfile: BinaryIO, workers: int) -> None:
+    """Answer one sender's requests until it says goodbye or closes the stream."""
+    while True:
+        frame = read_frame(rfile)
+        if frame is None:
+            return
+        header, payload = frame
+        op = header.get("op")
+        try:
+            if op == "bye":
+                return
+            elif op == "missing":
+                reply = {"missing": [digest for digest in header["digests"] if not store.has(digest)]}
+            elif op == "objects":
+                stored, offset = 0, 0
+                for digest, size in header["objects"]:
+                    # Every object is written atomically as it is checked, so an interrupted batch is kept up to its last object.
+                    stored += store.put_object(digest, payload[offset:offset + size], verify=True)
+                    offset += size
+                reply = {"stored": stored}
+            elif op == "commit":
+                layer, added = import_layer(header["bundle"], snapshot_dir, store, catalog, workers)
+                reply = {"layer": asdict(layer), "added": added}
+            else:
+                reply = {"error": f"unknown request {op!r}"}
+        except (ReplicationError, ChunkStoreError, SnapshotError, CatalogError, OSError, KeyError, ValueError) as e:
+            reply = {"error": str(e)}
+        send_frame(wfile, reply)
+
+def _batches(store: ChunkStore, digests: List[str], batch_bytes: int) -> List[List[Tuple[str, int]]]:
+    batches: List[List[Tuple[str, int]]] = [[]]
+    total = 0
+    for digest in digests:
+        size = os.path.getsize(store.object_path(digest))
+        if batches[-1] and total + size > batch_bytes:
+            batches.append([])
+            total = 0
+        batches[-1].append((digest, size))
+        total += size
+    return [batch for batch in batches if batch]
+
+def replicate(
+    chain: SnapshotChain,
+    receiver: List[str],
+    layer_id: Optional[int] = None,
+    streams: int = DEFAULT_STREAMS,
+    workers: int = DEFAULT_WORKERS,
+    batch_bytes: int = BATCH_BYTES
+) -> Dict[str, Any]:
+    """
+    Copy a layer (memory, vmstate, drives, kernel) into the receiver's store and chain.
+
+    The receiver is asked which chunks it lacks and only those are sent,
+    spread over `streams` receiver processes. Chunks are stored on arrival
+    and verified against their hash, so a transfer that is cut off resumes
+    where it stopped when run again. Once everything is there the receiver
+    rebuilds the layer as a full base of its chain.
+    """
+    start = time.monotonic()
+    bundle = export_layer(chain, layer_id, workers)
+    exported = time.monotonic()
+    digests = sorted({digest for recipe in bundle["recipes"].values() for digest in recipe["chunks"] if digest})
+    transports = [PipeTransport(receiver) for _ in range(max(1, streams))]
+    sent = {"objects": 0, "bytes": 0}
+    lock = threading.Lock()
+    try:
+        missing: List[str] = []
+        for i in range(0, len(digests), QUERY_DIGESTS):
+            missing += transports[0].request({"op": "missing", "digests": digests[i:i + QUERY_DIGESTS]})["missing"]
+        work: "queue.Queue[List[Tuple[str, int]]]" = queue.Queue()
+        for batch in _batches(chain.store, missing, batch_bytes):
+            work.put(batch)
+
+        def pump(transport: PipeTransport) -> None:
+            while True:
+                try:
+                    batch = work.get_nowait()
+                except queue.Empty:
+                    return
+                payload = b"".join(chain.store.read_object(digest) for digest, _ in batch)
+                transport.request({"op": "objects", "objects": batch}, payload)
+                with lock:
+                    sent["objects"] += len(batch)
+                    sent["bytes"] += len(payload)
+
+        transferring = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(transports)) as pool:
+            # list() re-raises the first stream's failure.
+            list(pool.map(pump, transports))
+        transferred = time.monotonic()
+        reply = transports[0].request({"op": "commit", "bundle": bundle})
+    finally:
+        for transport in transports:
+            transport.close()
+    elapsed = time.monotonic() - start
+    return {
+        "chain": chain.name,
+        "layer": bundle["layer"]["id"],
+        "remote_layer": reply["layer"]["id"],
+        "added": reply["added"],
+        "objects": len(digests),
+        "missing": len(missing),
+        "sent_objects": sent["objects"],
+        "sent_bytes": sent["bytes"],
+        "logical_bytes": sum(recipe["size"] for recipe in bundle["recipes"].values()),
+        "streams": len(transports),
+        "export_s": exported - start,
+        "transfer_s": transferred - transferring,
+        "commit_s": time.monotonic() - transferred,
+        "elapsed_s": elapsed,
+        "throughput_mib_s": sent["bytes"] / 1048576 / max(transferred - transferring, 1e-9)
+    }
+
+def print_report(report: Dict[str, Any]) -> None:
+    print_color(
+        f"{report['chain']}/{report['layer']:04d} -> {report['chain']}/{report['remote_layer']:04d}"
+        f"{'' if report['added'] else ' (already there)'}",
+        Colors.HEADER
+    )
+    print(f"  Objects:    {report['missing']}/{report['objects']} missing on the receiver, {report['sent_objects']} sent")
+    print(
+        f"  Sent:       {report['sent_bytes'] / 1048576:.1f} MiB for {report['logical_bytes'] / 1048576:.1f} MiB of files "
+        f"over {report['streams']} stream(s) ({report['throughput_mib_s']:.0f} MiB/s)"
+    )
+    print(
+        f"  Time:       export {report['export_s']:.2f}s, transfer {report['transfer_s']:.2f}s, "
+        f"commit {report['commit_s']:.2f}s, total {report['elapsed_s']:.2f}s"
+    )
+
+def check_loopback(snapshot_dir: str, store: str, catalog: Optional[str], remote_dir: Optional[str],
+                   remote_store: Optional[str], remote_catalog: Optional[str], remote_cwd: str) -> None:
+    """
+    Refuse a local receiver that would import into the sender's own store.
+
+    Importing a layer into its source chain would drop the chain's history,
+    so without --host both remote paths must be given and must differ from
+    the sender's.
+
+    Raises:
+        ReplicationError: if a remote path is missing or is the sender's
+    """
+    if not remote_dir or not remote_store:
+        raise ReplicationError("a local receiver needs --remote-dir and --remote-store")
+
+    def same(local: str, remote: str) -> bool:
+        return os.path.realpath(local) == os.path.realpath(os.path.join(remote_cwd, remote))
+
+    if same(snapshot_dir, remote_dir):
+        raise ReplicationError(f"--remote-dir {remote_dir} is the sender's snapshot directory")
+    if same(store, remote_store):
+        raise ReplicationError(f"--remote-store {remote_store} is the sender's chunk store")
+    if same(catalog or os.path.join(snapshot_dir, "catalog.db"), remote_catalog or os.path.join(remote_dir, "catalog.db")):
+        raise ReplicationError("the receiver's catalog is the sender's")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replicate snapshot layers to another host's snapshot store",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--dir", default=DEFAULT_SNAPSHOT_DIR, help="Directory holding one subdirectory per chain")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="Chunk store")
+    parser.add_argument("--catalog", help="Snapshot catalog database (default: catalog.db in --dir)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="Hashing/compression threads")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    send = sub.add_parser("send", help="Send a layer to a receiver")
+    send.add_argument("--chain", default="default", help="Chain name")
+    send.add_argument("--layer", type=int, help="Layer id (default: newest)")
+    send.add_argument("--host", help="ssh destination of the receiver (default: a local receiver, for testing)")
+    send.add_argument("--remote-dir", help=f"Snapshot directory on the receiver (default with --host: {DEFAULT_SNAPSHOT_DIR}; required without)")
+    send.add_argument("--remote-store", help=f"Chunk store on the receiver (default with --host: {DEFAULT_STORE}; required without)")
+    send.add_argument("--remote-catalog", help="Catalog on the receiver (default: catalog.db in --remote-dir)")
+    send.add_argument("--remote-cwd", default=".", help="Directory on the host the remote paths are relative to")
+    send.add_argument("--remote-python", default="python3", help="Python interpreter on the host")
+    send.add_argument("--remote-script", default=os.path.join("tools", "vm_replicate.py"), help="This script on the host, relative to --remote-cwd")
+    send.add_argument("--streams", type=int, default=DEFAULT_STREAMS, help="Parallel receiver streams")
+    send.add_argument("--batch-mib", type=int, default=BATCH_BYTES // 1048576, help="Compressed MiB per request")
+    send.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    sub.add_parser("receive", help="Serve one sender over stdin/stdout (started by send)")
+
+    args = parser.parse_args()
+    catalog = Catalog(args.catalog or os.path.join(args.dir, "catalog.db"))
+    store = ChunkStore(args.store)
+
+    if args.command == "receive":
+        os.makedirs(args.dir, exist_ok=True)
+        # Replies own stdout; anything else printed would corrupt the stream.
+        out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+        os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+        serve(store, args.dir, catalog, sys.stdin.buffer, out, args.workers)
+        return
+
+    try:
+        if args.host:
+            args.remote_dir = args.remote_dir or DEFAULT_SNAPSHOT_DIR
+            args.remote_store = args.remote_store or DEFAULT_STORE
+        else:
+            check_loopback(args.dir, args.store, args.catalog, args.remote_dir, args.remote_store, args.remote_catalog, args.remote_cwd)
+        chain = SnapshotChain(os.path.join(args.dir, args.chain), catalog, store)
+        receiver = receiver_command(
+            args.remote_store, args.remote_dir, args.remote_catalog, args.host,
+            args.remote_python, args.remote_cwd, args.remote_script
+        )
+        report = replicate(chain, receiver, args.layer, args.streams, args.workers, args.batch_mib * 1048576)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print_report(report)
+    except (ReplicationError, SnapshotError, ChunkStoreError, CatalogError) as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1472 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import errno
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+import contextlib
+import signal
+import asyncio
+import argparse
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, asdict
+from typing import Optional, Dict, Any, List, Iterator, Tuple, Callable
+
+from firecracker_api import Colors, print_color, FirecrackerClient, FirecrackerAPIError, wait_for_api_socket, DEFAULT_API_SOCKET
+from vm_uffd import UffdError, WORKING_SET_FILE, start_page_server, load_working_set, prefetch_file
+from vm_chunkstore import DEFAULT_STORE, ChunkStore, ChunkStoreError, PutStats
+from vm_catalog import Catalog, CatalogError, SnapshotRecord
+from vm_launcher import DEFAULT_BASE_DIR, load_template, make_spec, launch_vm, list_workdirs, read_state, pid_alive
+from vm_mmds import guest_network
+from vm_ready import wait_for_vsock
+from vm_pool import percentile
+
+DEFAULT_SNAPSHOT_DIR = "snapshots"
+MANIFEST = "chain.json"
+VMSTATE_FILE = "vmstate"
+MEMORY_FILE = "memory"
+MATERIALIZED_DIR = "materialized"
+# Memory files are written here while the guest is paused, then moved into the chain.
+DEFAULT_STAGING = os.environ.get("FC_SNAPSHOT_STAGING", "/dev/shm/fc-snapshots")
+DISKS_DIR = "disks"
+KERNELS_DIR = ".kernels"
+DIGEST_INDEX = ".digests.json"
+DIGEST_INDEX_ENTRIES = 256
+COPY_CHUNK = 8 * 1024 * 1024
+
+# ioctl(dest, FICLONE, src) shares all of src's extents with dest (btrfs, XFS, bcachefs).
+FICLONE = 0x40049409
+NO_REFLINK = (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL)
+
+class SnapshotError(Exception):
+    pass
+
+@dataclass
+class Layer:
+    """One snapshot in a chain: a full memory image or the pages dirtied since the previous layer."""
+    id: int
+    kind: str
+    created_at: float
+    paused_s: float
+    bytes_written: int
+    mem_size: int
+    archived: bool = False
+    disks: Dict[str, str] = field(default_factory=dict)
+    disk_capture: str = ""
+    disk_s: float = 0.0
+    # Writable drives left out because they could not be reflinked (see `capture`).
+    disks_skipped: List[str] = field(default_factory=list)
+    kernel: Optional[str] = None
+    rootfs: Optional[str] = None
+    disk_bytes: int = 0
+    profile: Optional[str] = None
+    staged: bool = False
+    total_s: float = 0.0
+    # "<host>:<chain>/<id>@<created_at>" of the layer this one was replicated from.
+    origin: Optional[str] = None
+
+@dataclass
+class PendingLayer:
+    """A layer captured while the VM was paused, not yet committed to its chain."""
+    layer: Layer
+    source: str
+    kernel: Optional[str]
+    root_drive: Optional[str]
+    # Stat key of the root drive when it was captured, for the digest cache.
+    root_key: Optional[str]
+    staged: Optional[str]
+    started: float
+    # Full was asked for (--full), so the layers before it are discarded.
+    full: bool = False
+
+def data_extents(fd: int) -> Iterator[Tuple[int, int]]:
+    """Yield (offset, length) of the allocated ranges of a sparse file."""
+    end = os.fstat(fd).st_size
+    offset = 0
+    while offset < end:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError:
+            return
+        stop = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, stop - start
+        offset = stop
+
+def allocated_bytes(path: str) -> int:
+    """Bytes actually stored on disk for `path` (holes excluded)."""
+    return os.stat(path).st_blocks * 512
+
+def _copy_range(src: int, dst: int, offset: int, length: int) -> None:
+    while length > 0:
+        try:
+            copied = os.copy_file_range(src, dst, min(length, COPY_CHUNK), offset, offset)
+        except OSError:
+            copied = os.pwrite(dst, os.pread(src, min(length, COPY_CHUNK), offset), offset)
+        if copied <= 0:
+            raise SnapshotError(f"short copy at offset {offset}")
+        offset += copied
+        length -= copied
+
+def apply_diff(target_fd: int, diff_path: str) -> int:
+    """Write the pages present in a diff memory file over `target_fd`; returns bytes applied."""
+    applied = 0
+    with open(diff_path, "rb") as diff:
+        for offset, length in data_extents(diff.fileno()):
+            _copy_range(diff.fileno(), target_fd, offset, length)
+            applied += length
+    return applied
+
+def clone_file(source: str, dest: str) -> str:
+    """
+    Copy `source` to `dest`, as a reflink when the filesystem supports it.
+
+    Otherwise only the allocated extents are copied, so holes stay holes.
+    Returns "reflink" or "copy".
+    """
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return "reflink"
+        except OSError as e:
+            if e.errno not in NO_REFLINK:
+                raise
+        for offset, length in data_extents(src.fileno()):
+            _copy_range(src.fileno(), dst.fileno(), offset, length)
+        dst.truncate(os.fstat(src.fileno()).st_size)
+    return "copy"
+
+def reflink_supported(source: str, dest_dir: str) -> bool:
+    """Whether `source` can be reflinked into `dest_dir`, tried on a scratch file that is removed again."""
+    fd, scratch = tempfile.mkstemp(prefix=".reflink-", dir=dest_dir)
+    try:
+        with open(source, "rb") as src:
+            fcntl.ioctl(fd, FICLONE, src.fileno())
+        return True
+    except OSError as e:
+        if e.errno not in NO_REFLINK:
+            raise
+        return False
+    finally:
+        os.close(fd)
+        os.unlink(scratch)
+
+def move_file(source: str, dest: str) -> None:
+    """Move a file, across filesystems if need be: copied sparsely and synced before the source goes."""
+    try:
+        os.rename(source, dest)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    tmp = f"{dest}.tmp"
+    clone_file(source, tmp)
+    fd = os.open(tmp, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp, dest)
+    os.unlink(source)
+
+def sparse_copy(source: str, dest: str) -> None:
+    """Copy a memory file keeping its holes (and sharing extents where the filesystem can)."""
+    clone_file(source, dest)
+
+def file_digest(path: str) -> str:
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(COPY_CHUNK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def extent_digest(path: str) -> str:
+    """SHA-256 over the offsets and contents of a sparse file's allocated extents."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        digest.update(str(os.fstat(f.fileno()).st_size).encode())
+        for offset, length in data_extents(f.fileno()):
+            digest.update(f":{offset}:{length}:".encode())
+            while length > 0:
+                block = os.pread(f.fileno(), min(length, COPY_CHUNK), offset)
+                if not block:
+                    break
+                digest.update(block)
+                offset += len(block)
+                length -= len(block)
+    return digest.hexdigest()
+
+_digest_index_lock = threading.Lock()
+
+def stat_key(path: str) -> str:
+    """Device, inode, size and mtime of `path`: changes whenever its content may have."""
+    st = os.stat(path)
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+def cached_digest(index_path: str, key: str, compute: Callable[[], str], limit: int = 0) -> str:
+    """
+    Look `key` up in the JSON digest index at `index_path`, or `compute` and record it.
+
+    With `limit`, only the most recently added entries are kept.
+    """
+    with _digest_index_lock:
+        index: Dict[str, str] = {}
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+        if key in index:
+            return index[key]
+    digest = compute()
+    with _digest_index_lock:
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                index = json.load(f)
+        index[key] = digest
+        if limit and len(index) > limit:
+            index = dict(list(index.items())[-limit:])
+        fd, tmp = tempfile.mkstemp(prefix=".index-", dir=os.path.dirname(index_path) or ".")
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp, index_path)
+    return digest
+
+def store_kernel(path: str, kernels_dir: str) -> str:
+    """
+    Keep one copy of a kernel image per content hash under `kernels_dir`.
+
+    Hashes are cached by inode, size and mtime, so snapshotting a VM whose
+    kernel is already stored does not read the image again.
+    """
+    os.makedirs(kernels_dir, exist_ok=True)
+    digest = cached_digest(os.path.join(kernels_dir, "index.json"), stat_key(path), lambda: file_digest(path))
+    stored = os.path.join(kernels_dir, digest)
+    if not os.path.exists(stored):
+        clone_file(path, f"{stored}.tmp")
+        os.replace(f"{stored}.tmp", stored)
+    return digest
+
+def _vmm_identity(api_socket: str) -> str:
+    # A restarted VMM recreates its socket, so the inode tells VMM processes apart.
+    st = os.stat(api_socket)
+    return f"{st.st_dev}:{st.st_ino}"
+
+class SnapshotChain:
+    """
+    A base full snapshot followed by diff snapshots of the same VM.
+
+    Each layer lives in `<chain>/<id>/` with its own `vmstate` and `memory`
+    file. Diff memory files are sparse: only the pages dirtied since the
+    previous layer are allocated, so a snapshot costs I/O proportional to
+    what the guest touched. Restoring needs a full image, which
+    `materialize` builds by laying the diffs over the base in order.
+
+    Writable drives are captured into `<id>/disks/` while the VM is paused
+    (reflinked where the filesystem allows), and the kernel is stored once
+    per content hash in `.kernels/` next to the chains.
+
+    With a `catalog`, every layer added or dropped is mirrored into it;
+    with a `store`, dropping an archived layer also removes its recipe.
+    """
+
+    def __init__(self, path: str, catalog: Optional[Catalog] = None, store: Optional[ChunkStore] = None):
+        self.path = os.path.abspath(path)
+        self.catalog = catalog
+        self.store = store
+        self.name = os.path.basename(self.path)
+        self.layers: List[Layer] = []
+        self.source: Optional[str] = None
+        self.next_id = 0
+        if os.path.exists(self._manifest):
+            with open(self._manifest) as f:
+                data = json.load(f)
+            self.layers = [Layer(**layer) for layer in data["layers"]]
+            self.source = data.get("source")
+            self.next_id = data.get("next_id", len(self.layers))
+
+    @property
+    def _manifest(self) -> str:
+        return os.path.join(self.path, MANIFEST)
+
+    def save(self) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f"{self._manifest}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"layers": [asdict(l) for l in self.layers], "source": self.source, "next_id": self.next_id}, f, indent=2)
+        os.replace(tmp, self._manifest)
+
+    def layer_dir(self, layer_id: int) -> str:
+        return os.path.join(self.path, f"{layer_id:04d}")
+
+    def vmstate(self, layer_id: int) -> str:
+        return os.path.join(self.layer_dir(layer_id), VMSTATE_FILE)
+
+    def memory(self, layer_id: int) -> str:
+        return os.path.join(self.layer_dir(layer_id), MEMORY_FILE)
+
+    def disk(self, layer_id: int, drive_id: str) -> str:
+        return os.path.join(self.layer_dir(layer_id), DISKS_DIR, drive_id)
+
+    def workingset(self, layer_id: int) -> str:
+        return os.path.join(self.layer_dir(layer_id), WORKING_SET_FILE)
+
+    @property
+    def kernels_dir(self) -> str:
+        return os.path.join(os.path.dirname(self.path), KERNELS_DIR)
+
+    def _index(self, layer_id: Optional[int]) -> int:
+        if not self.layers:
+            raise SnapshotError(f"chain {self.name} has no snapshots")
+        if layer_id is None:
+            return len(self.layers) - 1
+        for i, layer in enumerate(self.layers):
+            if layer.id == layer_id:
+                return i
+        raise SnapshotError(f"chain {self.name} has no layer {layer_id} (merged by compaction?)")
+
+    def take(
+        self,
+        api_socket: str,
+        full: bool = False,
+        disks: bool = True,
+        staging: Optional[str] = None,
+        archive: Optional[ChunkStore] = None,
+        workers: int = 4,
+        resume: bool = True,
+        copy_disks: bool = False
+    ) -> Layer:
+        """
+        Snapshot the VM on `api_socket` into a new layer.
+
+        A diff is taken when the chain already holds a snapshot of this
+        same VMM process and the VM tracks dirty pages; anything else
+        (first snapshot, restarted VMM, tracking off, `full`) starts over
+        from a full snapshot. With `disks`, the VM's writable drives are
+        cloned before it resumes so they match the memory image, and the
+        kernel is added to the shared kernel store. See `capture` for
+        `staging`, `resume` and `copy_disks`, and `commit` for `archive`.
+        """
+        return self.commit(self.capture(api_socket, full, disks, staging, resume, copy_disks), archive, workers)
+
+    def capture(
+        self,
+        api_socket: str,
+        full: bool = False,
+        disks: bool = True,
+        staging: Optional[str] = None,
+        resume: bool = True,
+        copy_disks: bool = False
+    ) -> PendingLayer:
+        """
+        Pause the VM only for writing its state and disks, then resume it.
+
+        With `staging` (a tmpfs directory) the memory file and vmstate are
+        written there, so the pause lasts a memory-speed write instead of
+        one to the chain's disk. Staging is skipped when it lacks room for
+        the guest. With `resume` False the VM stays paused afterwards.
+
+        Drives are captured by reflink while the VM is paused. Drives on a
+        filesystem without reflinks are left out (listed in
+        `disks_skipped`), since copying them would make the pause grow with
+        the disk size; `copy_disks` copies them during the pause anyway. The
+        layer joins the chain when it is committed. Only a `full` capture
+        replaces the chain's layers; a full snapshot taken because the VMM
+        changed is appended after them.
+        """
+        started = time.monotonic()
+        source = _vmm_identity(api_socket)
+        layer = Layer(id=self.next_id, kind="Full", created_at=time.time(), paused_s=0.0, bytes_written=0, mem_size=0)
+        with FirecrackerClient(api_socket, timeout=300.0) as client:
+            machine = client.get_machine_config()
+            layer.profile = f"{machine.get('vcpu_count', 0)}vcpu-{machine.get('mem_size_mib', 0)}mib"
+            if self.layers and not full and machine.get("track_dirty_pages") and source == self.source:
+                layer.kind = "Diff"
+            config = client.get_vm_config() if disks else {}
+            root_drive = next((d["drive_id"] for d in config.get("drives", []) if d.get("is_root_device")), None)
+            drives = {
+                d["drive_id"]: os.path.abspath(d["path_on_host"]) for d in config.get("drives", [])
+                if d.get("path_on_host") and not d.get("is_read_only")
+            }
+            root_key: List[str] = []
+            if drives and not copy_disks:
+                # Probed before pausing: a fallback copy would run inside the pause.
+                os.makedirs(self.path, exist_ok=True)
+                layer.disks_skipped = [d for d, path in drives.items() if not reflink_supported(path, self.path)]
+                for drive_id in layer.disks_skipped:
+                    del drives[drive_id]
+
+            def capture_disks() -> None:
+                start = time.monotonic()
+                os.makedirs(os.path.join(self.layer_dir(layer.id), DISKS_DIR), exist_ok=True)
+                if root_drive in drives:
+                    root_key.append(stat_key(drives[root_drive]))
+                methods = {clone_file(path, self.disk(layer.id, drive_id)) for drive_id, path in drives.items()}
+                layer.disks = drives
+                layer.disk_capture = "copy" if "copy" in methods else "reflink"
+                layer.disk_s = time.monotonic() - start
+
+            os.makedirs(self.layer_dir(layer.id), exist_ok=True)
+            staged = None
+            if staging:
+                os.makedirs(staging, exist_ok=True)
+                if shutil.disk_usage(staging).free > machine.get("mem_size_mib", 0) << 20:
+                    staged = tempfile.mkdtemp(prefix=f"{self.name}-{layer.id:04d}-", dir=staging)
+            target = staged or self.layer_dir(layer.id)
+            try:
+                layer.paused_s = client.snapshot(
+                    os.path.join(target, VMSTATE_FILE), os.path.join(target, MEMORY_FILE), layer.kind,
+                    while_paused=capture_disks if drives else None, resume=resume
+                )
+            except Exception:
+                shutil.rmtree(self.layer_dir(layer.id), ignore_errors=True)
+                if staged:
+                    shutil.rmtree(staged, ignore_errors=True)
+                raise
+        self.next_id = layer.id + 1
+        layer.staged = staged is not None
+        kernel = config.get("boot-source", {}).get("kernel_image_path")
+        return PendingLayer(layer, source, kernel, root_drive, root_key[0] if root_key else None, staged, started, full)
+
+    def commit(self, pending: PendingLayer, archive: Optional[ChunkStore] = None, workers: int = 4) -> Layer:
+        """
+        Make a captured layer durable and add it to the chain.
+
+        Staged files are copied into the layer directory (keeping holes),
+        synced and removed from staging. Then the kernel is stored, the
+        root disk hashed and, with `archive`, the memory image compressed
+        and hashed into the chunk store. The guest is running throughout.
+
+        Firecracker cleared the VM's dirty bitmap when the layer was
+        captured, so if the commit fails the chain forgets its source VMM:
+        the next snapshot is then a full one instead of a diff that would
+        miss the pages dirtied before this capture.
+        """
+        try:
+            return self._commit(pending, archive, workers)
+        except BaseException:
+            if not any(layer.id == pending.layer.id for layer in self.layers):
+                shutil.rmtree(self.layer_dir(pending.layer.id), ignore_errors=True)
+            self.source = None
+            self.save()
+            raise
+        finally:
+            if pending.staged:
+                shutil.rmtree(pending.staged, ignore_errors=True)
+
+    def _commit(self, pending: PendingLayer, archive: Optional[ChunkStore], workers: int) -> Layer:
+        layer = pending.layer
+        if pending.staged:
+            for name in (VMSTATE_FILE, MEMORY_FILE):
+                move_file(os.path.join(pending.staged, name), os.path.join(self.layer_dir(layer.id), name))
+        if pending.kernel and os.path.exists(pending.kernel):
+            layer.kernel = store_kernel(pending.kernel, self.kernels_dir)
+        layer.bytes_written = allocated_bytes(self.memory(layer.id)) + os.path.getsize(self.vmstate(layer.id))
+        layer.mem_size = os.path.getsize(self.memory(layer.id))
+        layer.disk_bytes = sum(allocated_bytes(self.disk(layer.id, drive_id)) for drive_id in layer.disks)
+        if self.catalog and pending.root_drive in layer.disks:
+            # Keyed by the source drive as it was while the VM was paused, so an
+            # unchanged root disk is not read again on every snapshot.
+            disk = self.disk(layer.id, pending.root_drive)
+            layer.rootfs = cached_digest(
+                os.path.join(os.path.dirname(self.path), DIGEST_INDEX), pending.root_key or stat_key(disk),
+                lambda: extent_digest(disk), DIGEST_INDEX_ENTRIES
+            )
+        if pending.full:
+            self._drop(self.layers)
+            self.layers = []
+        self.layers.append(layer)
+        self.source = pending.source
+        self.save()
+        if self.catalog:
+            self._record(layer, self.layers[-2] if len(self.layers) > 1 and layer.kind == "Diff" else None)
+        if archive:
+            self.archive(archive, workers)
+        layer.total_s = time.monotonic() - pending.started
+        self.save()
+        return layer
+
+    def _record(self, layer: Layer, parent: Optional[Layer], chunks: Optional[List[Optional[str]]] = None) -> None:
+        if layer.kernel:
+            kernel = os.path.join(self.kernels_dir, layer.kernel)
+            self.catalog.add_artifact(layer.kernel, "kernel", kernel, os.path.getsize(kernel) if os.path.exists(kernel) else 0)
+        if layer.rootfs:
+            self.catalog.add_artifact(layer.rootfs, "rootfs", None, layer.disk_bytes)
+        self.catalog.add(SnapshotRecord(
+            id=self.recipe_name(layer.id),
+            chain=self.name,
+            layer=layer.id,
+            parent=self.recipe_name(parent.id) if parent else None,
+            kind=layer.kind,
+            profile=layer.profile,
+            kernel=layer.kernel,
+            rootfs=layer.rootfs,
+            mem_size=layer.mem_size,
+            bytes_written=layer.bytes_written,
+            disk_bytes=layer.disk_bytes,
+            created_at=layer.created_at,
+            recipe=self.recipe_name(layer.id) if layer.archived else None
+        ), chunks or ())
+
+    def materialize(self, layer_id: Optional[int] = None, out: Optional[str] = None) -> str:
+        """
+        Return a full memory image of the state after `layer_id` (default: latest).
+
+        A full layer is used in place; otherwise the nearest full layer
+        before it is copied sparsely and every diff up to the layer is
+        applied on top. Results are cached
+        under `materialized/` until the chain is compacted or restarted, or
+        `prune_materialized` drops them.
+        """
+        index = self._index(layer_id)
+        layer = self.layers[index]
+        if layer.kind == "Full" and out is None:
+            return self.memory(layer.id)
+        if out is None:
+            out = os.path.join(self.path, MATERIALIZED_DIR, f"{layer.id:04d}.mem")
+            if os.path.exists(out):
+                return out
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        tmp = f"{out}.tmp"
+        base = max(i for i in range(index + 1) if self.layers[i].kind == "Full")
+        sparse_copy(self.memory(self.layers[base].id), tmp)
+        with open(tmp, "r+b") as f:
+            for diff in self.layers[base + 1:index + 1]:
+                apply_diff(f.fileno(), self.memory(diff.id))
+            f.truncate(layer.mem_size)
+        os.replace(tmp, out)
+        return out
+
+    def prune_materialized(self, keep: Optional[int] = None) -> int:
+        """
+        Remove the images cached by `materialize` for every layer but `keep`.
+
+        A VM restored from an image maps it MAP_PRIVATE, so unlinking it
+        only frees the space once that VM exits. Images still being written
+        are left alone. Returns the number of bytes removed.
+        """
+        directory = os.path.join(self.path, MATERIALIZED_DIR)
+        kept = () if keep is None else (f"{keep:04d}.mem", f"{keep:04d}.store.mem")
+        removed = 0
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return 0
+        for name in names:
+            if name in kept or not name.endswith(".mem"):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                size = allocated_bytes(path)
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+            removed += size
+        return removed
+
+    def compact(self, keep: int = 0) -> int:
+        """
+        Merge the base and all but the newest `keep` diffs into one full layer.
+
+        The merged image is written to a new file rather than over the base,
+        because a VM restored from the base maps it MAP_PRIVATE and would see
+        pages change under it. The merged layer keeps the id and vmstate of
+        the newest diff folded in. Returns the number of layers removed.
+        """
+        merge_to = len(self.layers) - 1 - keep
+        if merge_to <= 0:
+            return 0
+        target = self.layers[merge_to]
+        merged_memory = f"{self.memory(target.id)}.merged"
+        self.materialize(target.id, out=merged_memory)
+        os.replace(merged_memory, self.memory(target.id))
+        merged = self.layers[:merge_to]
+        target.kind = "Full"
+        self.layers = self.layers[merge_to:]
+        self.save()
+        self._drop(merged)
+        if self.catalog:
+            self.catalog.update(self.recipe_name(target.id), kind="Full", parent=None)
+        return len(merged)
+
+    def recipe_name(self, layer_id: int) -> str:
+        return f"{self.name}/{layer_id:04d}"
+
+    def sidecars(self, layer_id: int) -> List[str]:
+        """Store recipes of a layer's other files (`<recipe>.vmstate`, `<recipe>.disk.<drive>`)."""
+        if not self.store:
+            return []
+        prefix = f"{self.recipe_name(layer_id)}."
+        return [name for name in self.store.recipes() if name.startswith(prefix)]
+
+    def archive(self, store: ChunkStore, workers: int = 4) -> List[PutStats]:
+        """
+        Add the full memory image of every layer not yet archived to `store`.
+
+        Consecutive layers share most chunks, so each one only adds the
+        chunks its diff changed.
+        """
+        results = []
+        for layer in self.layers:
+            if layer.archived:
+                continue
+            name = self.recipe_name(layer.id)
+            with self.catalog.lock() if self.catalog else contextlib.nullcontext():
+                results.append(store.put_file(self.materialize(layer.id), name, workers=workers))
+                if self.catalog:
+                    self.catalog.set_recipe(name, name, store.recipe(name).chunks)
+            layer.archived = True
+            self.save()
+        return results
+
+    def _drop(self, layers: List[Layer]) -> None:
+        for layer in layers:
+            name = self.recipe_name(layer.id)
+            chunks: List[Optional[str]] = []
+            if layer.archived and self.store:
+                try:
+                    chunks = self.store.recipe(name).chunks
+                    self.store.remove(name)
+                except ChunkStoreError:
+                    pass
+                for sidecar in self.sidecars(layer.id):
+                    # vmstate and disk recipes added for replication, each counted on its own.
+                    if self.catalog:
+                        self.catalog.ref_chunks(self.store.recipe(sidecar).chunks, -1)
+                    self.store.remove(sidecar)
+            if self.catalog:
+                self.catalog.remove(name, chunks)
+            shutil.rmtree(self.layer_dir(layer.id), ignore_errors=True)
+        shutil.rmtree(os.path.join(self.path, MATERIALIZED_DIR), ignore_errors=True)
+
+    def delete(self) -> None:
+        """Remove the whole chain, its catalog entries and archived recipes."""
+        self._drop(self.layers)
+        self.layers = []
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def restore(
+        self,
+        api_socket: str,
+        layer_id: Optional[int] = None,
+        firecracker_bin: str = "firecracker",
+        console: Optional[str] = None,
+        resume: bool = True,
+        timeout: float = 10.0,
+        backend: str = "file",
+        readahead: int = 1,
+        store: Optional[ChunkStore] = None,
+        disks: bool = True,
+        record: float = 0.0,
+        prefetch: bool = True
+    ) -> Dict[str, Any]:
+        """
+        Start an empty firecracker on `api_socket` and load a layer into it.
+
+        With the "file" backend guest memory is mapped from the memory file;
+        with "uffd" a vm_uffd.py page server (listening on
+        `<api_socket>.uffd`) hands pages to the guest as it faults them in,
+        so the load does not depend on guest size. Restoring the newest
+        layer continues the chain: the next snapshot of the restored VM is
+        a diff against it. With `store`, guest memory comes from the layer's
+        archived recipe instead of the chain directory. With `disks`, the
+        drives captured with the layer are cloned back to the paths the
+        snapshot references.
+
+        With `record` (seconds, uffd only) the page server saves the pages
+        the guest touches in that window as the layer's working set. Later
+        restores with `prefetch` load that set ahead of the guest: the page
+        server copies it in between faults, or for the File backend the
+        kernel reads it into the page cache while the VMM starts.
+        """
+        index = self._index(layer_id)
+        layer = self.layers[index]
+        if record and backend != "uffd":
+            raise SnapshotError("recording a working set needs the uffd backend")
+        workingset = self.workingset(layer.id)
+        prefetching = prefetch and not record and os.path.exists(workingset)
+        start = time.monotonic()
+        if store is None:
+            memory = self.materialize(layer.id)
+        elif backend == "file":
+            memory = os.path.join(self.path, MATERIALIZED_DIR, f"{layer.id:04d}.store.mem")
+            if not os.path.exists(memory):
+                os.makedirs(os.path.dirname(memory), exist_ok=True)
+                store.restore_file(self.recipe_name(layer.id), memory)
+        else:
+            store.recipe(self.recipe_name(layer.id))
+            memory = None
+        materialized = time.monotonic()
+        if prefetching and backend == "file":
+            prefetch_file(memory, load_working_set(workingset)["extents"])
+        if disks:
+            for drive_id, path in layer.disks.items():
+                # Replace rather than overwrite: a VM still running on the old image keeps its inode.
+                clone_file(self.disk(layer.id, drive_id), f"{path}.restore")
+                os.replace(f"{path}.restore", path)
+        disks_restored = time.monotonic()
+        if os.path.exists(api_socket):
+            os.unlink(api_socket)
+        out = open(console, "ab") if console else subprocess.DEVNULL
+        try:
+            process = subprocess.Popen(
+                [firecracker_bin, "--api-sock", api_socket, "--id", f"{self.name}-{layer.id}"],
+                stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT, start_new_session=True
+            )
+        finally:
+            if console:
+                out.close()
+        if not wait_for_api_socket(api_socket, timeout):
+            process.kill()
+            raise SnapshotError(f"firecracker API socket {api_socket} did not appear within {timeout}s")
+        page_server = None
+        try:
+            if backend == "uffd":
+                page_server = start_page_server(
+                    f"{api_socket}.uffd", mem_file=memory, readahead=readahead,
+                    recipe=None if store is None else self.recipe_name(layer.id),
+                    chunk_store=None if store is None else store.path,
+                    stats_path=f"{api_socket}.uffd.json", log_path=console,
+                    record_path=workingset if record else None, record_window=record,
+                    prefetch_path=workingset if prefetching else None
+                )
+                mem_backend = {"backend_type": "Uffd", "backend_path": f"{api_socket}.uffd"}
+            else:
+                mem_backend = {"backend_type": "File", "backend_path": memory}
+            loading = time.monotonic()
+            with FirecrackerClient(api_socket, timeout=300.0) as client:
+                client.load_snapshot(self.vmstate(layer.id), mem_backend=mem_backend, enable_diff_snapshots=True, resume_vm=resume)
+        except Exception:
+            process.kill()
+            if page_server:
+                page_server.kill()
+            raise
+        if index == len(self.layers) - 1:
+            self.source = _vmm_identity(api_socket)
+            self.save()
+        return {
+            "chain": self.name,
+            "layer": layer.id,
+            "pid": process.pid,
+            "backend": backend,
+            "page_server_pid": page_server.pid if page_server else None,
+            "workingset": "record" if record else "prefetch" if prefetching else None,
+            "materialize_s": materialized - start,
+            "disks_s": disks_restored - materialized,
+            "load_s": time.monotonic() - loading
+        }
+
+class SnapshotPipeline:
+    """
+    Snapshot VMs with the guest paused only for the staged write.
+
+    `submit` captures in the caller's thread: the VM pauses while its
+    memory goes to `staging` and resumes right away. Committing (the copy
+    to durable storage, hashing, and with `archive` compression into the
+    chunk store) runs on `workers` background threads. At most
+    `max_staged` captures wait for their commit, which bounds the RAM
+    staging uses; `submit` blocks beyond that. Snapshots of one chain are
+    committed in order.
+    """
+
+    def __init__(
+        self,
+        staging: Optional[str] = DEFAULT_STAGING,
+        workers: int = 2,
+        max_staged: Optional[int] = None,
+        archive: Optional[ChunkStore] = None,
+        archive_workers: int = 2
+    ):
+        self.staging = staging
+        self.archive = archive
+        self.archive_workers = archive_workers
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="snapshot-commit")
+        self._slots = threading.BoundedSemaphore(max_staged or max(1, workers) * 2)
+        self._inflight: Dict[str, Future] = {}
+
+    def submit(self, chain: SnapshotChain, api_socket: str, full: bool = False, disks: bool = True, copy_disks: bool = False) -> Future:
+        """Capture now and return a future resolving to the committed layer."""
+        previous = self._inflight.get(chain.path)
+        if previous:
+            # The next layer's kind depends on the previous one being in the chain.
+            wait([previous])
+            if previous.exception() is not None:
+                # A failed commit lost the pages dirtied before its capture:
+                # start over with a full layer, keeping the earlier ones.
+                chain.source = None
+        self._slots.acquire()
+        try:
+            pending = chain.capture(api_socket, full, disks, self.staging, copy_disks=copy_disks)
+        except BaseException:
+            self._slots.release()
+            raise
+        future = self._executor.submit(self._commit, chain, pending)
+        self._inflight[chain.path] = future
+        return future
+
+    def _commit(self, chain: SnapshotChain, pending: PendingLayer) -> Layer:
+        try:
+            return chain.commit(pending, self.archive, self.archive_workers)
+        finally:
+            self._slots.release()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> "SnapshotPipeline":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+def list_chains(base_dir: str) -> List[SnapshotChain]:
+    if not os.path.isdir(base_dir):
+        return []
+    return [
+        SnapshotChain(os.path.join(base_dir, name)) for name in sorted(os.listdir(base_dir))
+        if os.path.exists(os.path.join(base_dir, name, MANIFEST))
+    ]
+
+def _tree_bytes(path: str) -> int:
+    return sum(
+        allocated_bytes(os.path.join(root, name))
+        for root, _, names in os.walk(path) for name in names
+        if not os.path.islink(os.path.join(root, name))
+    )
+
+def reindex(base_dir: str, catalog: Catalog, store: ChunkStore) -> int:
+    """
+    Rebuild the catalog from the chain manifests and the store's recipes.
+
+    Every recipe counts towards its chunks, including recipes added to the
+    store outside a chain. Objects that no recipe uses are registered with
+    no references, so the next `gc` deletes them. Returns the number of
+    snapshots indexed.
+    """
+    indexed = 0
+    with catalog.lock():
+        catalog.clear()
+        for chain in list_chains(base_dir):
+            chain.catalog = catalog
+            for i, layer in enumerate(chain.layers):
+                chain._record(layer, chain.layers[i - 1] if i and layer.kind == "Diff" else None)
+                indexed += 1
+        for name in store.recipes():
+            catalog.ref_chunks(store.recipe(name).chunks)
+        known = set(catalog.known_chunks())
+        catalog.ref_chunks((digest for digest in store.objects() if digest not in known), 0)
+    return indexed
+
+def gc(
+    base_dir: str,
+    catalog: Catalog,
+    store: ChunkStore,
+    max_age_days: Optional[float] = None,
+    keep_chains: Optional[int] = None,
+    dry_run: bool = False
+) -> Dict[str, Any]:
+    """
+    Apply retention, then delete the chunks and kernels nothing references.
+
+    Chains are the unit of retention because every diff depends on the
+    layers before it (use `compact` to shorten a chain). A chain expires
+    when its newest snapshot is older than `max_age_days` or it is not
+    among the `keep_chains` most recently used. The sweep only visits
+    rows whose reference count reached zero, so its cost follows the
+    garbage, not the number of snapshots.
+    """
+    now = time.time()
+    expired = [
+        name for i, (name, _, newest) in enumerate(catalog.chains())
+        if (keep_chains is not None and i >= keep_chains)
+        or (max_age_days is not None and newest < now - max_age_days * 86400)
+    ]
+    report: Dict[str, Any] = {"chains": expired, "snapshots": 0, "chunks": 0, "kernels": 0, "freed_bytes": 0}
+    if dry_run:
+        report["snapshots"] = sum(len(catalog.chain_ids(name)) for name in expired)
+        report["chunks"] = len(catalog.unreferenced_chunks())
+        return report
+    with catalog.lock():
+        for name in expired:
+            chain = SnapshotChain(os.path.join(base_dir, name), catalog, store)
+            report["snapshots"] += len(chain.layers)
+            report["freed_bytes"] += _tree_bytes(chain.path)
+            chain.delete()
+            for snapshot_id in catalog.chain_ids(name):
+                # Rows whose chain directory had already been removed by hand.
+                catalog.remove(snapshot_id)
+                report["snapshots"] += 1
+        garbage = catalog.unreferenced_chunks()
+        for digest in garbage:
+            try:
+                report["freed_bytes"] += os.path.getsize(store.object_path(digest))
+                os.unlink(store.object_path(digest))
+            except FileNotFoundError:
+                pass
+        catalog.forget_chunks(garbage)
+        report["chunks"] = len(garbage)
+        artifacts = catalog.unreferenced_artifacts()
+        for artifact in artifacts:
+            if artifact["kind"] == "kernel" and artifact["path"] and os.path.exists(artifact["path"]):
+                report["freed_bytes"] += allocated_bytes(artifact["path"])
+                os.unlink(artifact["path"])
+                report["kernels"] += 1
+        catalog.forget_artifacts([artifact["hash"] for artifact in artifacts])
+    return report
+
+def take_all(
+    vms_dir: str,
+    snapshot_dir: str,
+    catalog: Optional[Catalog] = None,
+    store: Optional[ChunkStore] = None,
+    workers: int = 2,
+    max_staged: Optional[int] = None,
+    staging: Optional[str] = DEFAULT_STAGING,
+    archive: bool = False,
+    full: bool = False,
+    disks: bool = True,
+    copy_disks: bool = False
+) -> Dict[str, Any]:
+    """
+    Snapshot every running VM under `vms_dir` into a chain named after it.
+
+    VMs are paused one after another, each only for its staged write,
+    while earlier snapshots are committed in the background.
+    """
+    start = time.monotonic()
+    layers: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    futures: Dict[str, Future] = {}
+    with SnapshotPipeline(staging, workers, max_staged, store if archive else None) as pipeline:
+        for workdir in list_workdirs(vms_dir):
+            state = read_state(workdir)
+            spec = state["spec"]
+            if not pid_alive(state.get("pid"), spec["api_socket"]):
+                continue
+            chain = SnapshotChain(os.path.join(snapshot_dir, spec["vm_id"]), catalog, store)
+            try:
+                futures[spec["vm_id"]] = pipeline.submit(chain, spec["api_socket"], full, disks, copy_disks)
+            except (SnapshotError, FirecrackerAPIError, OSError) as e:
+                errors[spec["vm_id"]] = str(e)
+        for vm_id, future in futures.items():
+            try:
+                layers[vm_id] = future.result()
+            except Exception as e:
+                errors[vm_id] = str(e)
+    paused = [layer.paused_s for layer in layers.values()]
+    return {
+        "snapshots": {vm_id: asdict(layer) for vm_id, layer in layers.items()},
+        "errors": errors,
+        "paused_p50_s": percentile(paused, 50),
+        "paused_max_s": max(paused) if paused else None,
+        "total_s": time.monotonic() - start
+    }
+
+def print_take_all(report: Dict[str, Any]) -> None:
+    for vm_id, layer in report["snapshots"].items():
+        print(
+            f"  {vm_id:<12} {layer['kind']:<5} paused {layer['paused_s'] * 1000:7.1f} ms  "
+            f"total {layer['total_s'] * 1000:8.1f} ms{'  staged' if layer['staged'] else ''}"
+        )
+        if layer["disks_skipped"]:
+            print_color(f"  {vm_id:<12} no reflink support, skipped {', '.join(layer['disks_skipped'])} (--copy-disks)", Colors.WARNING)
+    for vm_id, error in report["errors"].items():
+        print_color(f"  {vm_id}: {error}", Colors.FAIL)
+    if report["snapshots"]:
+        print_color(
+            f"{len(report['snapshots'])} snapshot(s) in {report['total_s']:.2f}s; "
+            f"guest pause p50 {report['paused_p50_s'] * 1000:.1f} ms, max {report['paused_max_s'] * 1000:.1f} ms",
+            Colors.OKGREEN
+        )
+
+def print_chain(chain: SnapshotChain) -> None:
+    print_color(f"{chain.name}: {len(chain.layers)} layer(s)", Colors.HEADER)
+    for layer in chain.layers:
+        share = layer.bytes_written / layer.mem_size * 100 if layer.mem_size else 0.0
+        print(
+            f"  {layer.id:04d} {layer.kind:<5} {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(layer.created_at))} "
+            f"paused {layer.paused_s * 1000:7.1f} ms  wrote {layer.bytes_written / 1048576:9.1f} MiB ({share:5.1f}% of guest)"
+            + (f"  {len(layer.disks)} disk(s) by {layer.disk_capture} in {layer.disk_s * 1000:.1f} ms" if layer.disks else "")
+        )
+
+async def _responsive(
+    api_socket: str,
+    vsock_path: Optional[str],
+    address: Optional[str],
+    pid: int,
+    vsock_port: Optional[int],
+    probe: Optional[str],
+    timeout: float
+) -> Tuple[bool, str]:
+    """
+    Wait until the guest answers on `vsock_port` or `probe` exits 0, or
+    without either until the API reports the VM running.
+    """
+    if vsock_port:
+        result = await wait_for_vsock(vsock_path, vsock_port, timeout, pid)
+        return result.ready, result.detail
+    deadline = time.monotonic() + timeout
+    if probe:
+        env = dict(os.environ, FC_API_SOCKET=api_socket, **({"FC_GUEST_ADDRESS": address} if address else {}))
+        while time.monotonic() < deadline:
+            if subprocess.run(probe, shell=True, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0:
+                return True, ""
+            await asyncio.sleep(0.01)
+        return False, f"probe did not succeed within {timeout}s"
+    with FirecrackerClient(api_socket) as client:
+        while time.monotonic() < deadline:
+            if client.describe_instance().get("state") == "Running":
+                return True, ""
+            await asyncio.sleep(0.001)
+    return False, f"VM not running after {timeout}s"
+
+def _kill(pid: Optional[int]) -> None:
+    if not pid:
+        return
+    try:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass
+
+def _summary(samples: List[float]) -> Dict[str, Any]:
+    return {
+        "samples": len(samples),
+        "p50_s": percentile(samples, 50),
+        "p90_s": percentile(samples, 90),
+        "min_s": min(samples) if samples else None,
+        "max_s": max(samples) if samples else None
+    }
+
+def benchmark(
+    template_path: str,
+    base_dir: str,
+    iterations: int = 5,
+    backends: Tuple[str, ...] = ("file", "uffd"),
+    firecracker_bin: str = "firecracker",
+    vsock_port: Optional[int] = None,
+    probe: Optional[str] = None,
+    setup_tap: bool = False,
+    ready_timeout: float = 60.0
+) -> Dict[str, Any]:
+    """
+    Compare restore-to-responsive latency against a cold boot of the same VM.
+
+    A first, unmeasured boot creates the VM's disk and a full snapshot of
+    the ready guest. Each cold boot is then timed from spawning firecracker
+    until the guest is responsive, and each restore from spawning an empty
+    VMM until the restored guest is. "Responsive" is the guest answering on
+    `vsock_port` or `probe` exiting 0, the same guest-side check for both:
+    the console marker and the API's Running state are not comparable, so
+    one of the two is required.
+
+    Raises:
+        SnapshotError: without `vsock_port` or `probe`, or if a start fails
+    """
+    if not (vsock_port or probe):
+        raise SnapshotError("bench needs --vsock-port or --probe to tell when the guest is responsive")
+    template = load_template(template_path)
+    template_dir = os.path.dirname(os.path.abspath(template_path))
+    spec = make_spec(0, base_dir, "rb")
+    address = guest_network(spec.index)["address"].split("/")[0]
+    chain = SnapshotChain(os.path.join(os.path.abspath(base_dir), "chain"))
+
+    async def cold_boot(take_snapshot: bool) -> float:
+        instance = await launch_vm(spec, template, template_dir, firecracker_bin, setup_tap, wait_ready=False)
+        try:
+            if instance.error:
+                raise SnapshotError(f"cold boot failed: {instance.error}")
+            start = time.monotonic()
+            ready, detail = await _responsive(
+                spec.api_socket, spec.vsock_path, address, instance.pid, vsock_port, probe, ready_timeout
+            )
+            if not ready:
+                raise SnapshotError(f"cold boot not responsive: {detail}")
+            elapsed = instance.api_ready_s + time.monotonic() - start
+            if take_snapshot:
+                chain.take(spec.api_socket, full=True)
+            return elapsed
+        finally:
+            if instance.process and instance.process.returncode is None:
+                instance.process.kill()
+                await instance.process.wait()
+
+    def restore(backend: str) -> float:
+        if os.path.exists(spec.vsock_path):
+            os.unlink(spec.vsock_path)
+        start = time.monotonic()
+        result = chain.restore(spec.api_socket, firecracker_bin=firecracker_bin, timeout=ready_timeout, backend=backend)
+        try:
+            ready, detail = asyncio.run(
+                _responsive(spec.api_socket, spec.vsock_path, address, result["pid"], vsock_port, probe, ready_timeout)
+            )
+            if not ready:
+                raise SnapshotError(f"{backend} restore not responsive: {detail}")
+            return time.monotonic() - start
+        finally:
+            _kill(result["pid"])
+            _kill(result["page_server_pid"])
+
+    asyncio.run(cold_boot(take_snapshot=True))
+    report: Dict[str, Any] = {
+        "iterations": iterations,
+        "mem_size_mib": chain.layers[-1].mem_size >> 20,
+        "probe": f"vsock:{vsock_port}" if vsock_port else probe,
+        "cold": _summary([asyncio.run(cold_boot(take_snapshot=False)) for _ in range(iterations)])
+    }
+    for backend in backends:
+        report[backend] = _summary([restore(backend) for _ in range(iterations)])
+        cold_p50, restore_p50 = report["cold"]["p50_s"], report[backend]["p50_s"]
+        report[backend]["speedup"] = cold_p50 / restore_p50 if cold_p50 and restore_p50 else None
+    return report
+
+def print_benchmark(report: Dict[str, Any]) -> None:
+    def s(value: Optional[float]) -> str:
+        return f"{value * 1000:.1f} ms" if value is not None else "n/a"
+
+    print_color(
+        f"{report['iterations']} run(s) each, {report['mem_size_mib']} MiB guest, responsive = {report['probe']}:",
+        Colors.HEADER
+    )
+    print(f"{'start':<13} {'p50':>12} {'p90':>12} {'min':>12} {'max':>12} {'speedup':>8}")
+    for name in ["cold"] + [k for k in ("file", "uffd") if k in report]:
+        r = report[name]
+        speedup = f"{r['speedup']:.1f}x" if r.get("speedup") else ""
+        label = "cold boot" if name == "cold" else f"restore {name}"
+        print(f"{label:<13} {s(r['p50_s']):>12} {s(r['p90_s']):>12} {s(r['min_s']):>12} {s(r['max_s']):>12} {speedup:>8}")
+
+def _major_faults(pid: int) -> int:
+    with open(f"/proc/{pid}/stat") as f:
+        return int(f.read().rsplit(")", 1)[1].split()[9])
+
+def _reap(pid: int, timeout: float) -> None:
+    """Wait for a child that exits on its own, killing it after `timeout`."""
+    deadline = time.monotonic() + timeout
+    try:
+        while os.waitpid(pid, os.WNOHANG) == (0, 0):
+            if time.monotonic() > deadline:
+                _kill(pid)
+                return
+            time.sleep(0.01)
+    except ChildProcessError:
+        pass
+
+def working_set_benchmark(
+    chain: SnapshotChain,
+    api_socket: str,
+    layer_id: Optional[int] = None,
+    iterations: int = 5,
+    backend: str = "uffd",
+    record_window: float = 5.0,
+    firecracker_bin: str = "firecracker",
+    vsock_port: Optional[int] = None,
+    vsock_path: Optional[str] = None,
+    address: Optional[str] = None,
+    probe: Optional[str] = None,
+    timeout: float = 60.0
+) -> Dict[str, Any]:
+    """
+    Compare faults per restore and time to first job with and without
+    prefetching the layer's working set.
+
+    A first restore with the uffd backend records the working set,
+    replacing any earlier one. Every measured restore starts with the
+    memory file dropped from the page cache. Time to first job runs from
+    spawning the VMM until the guest is responsive; faults are the page
+    server's for uffd and the VMM's major faults for the File backend.
+    """
+    layer = chain.layers[chain._index(layer_id)]
+    memory = chain.materialize(layer.id)
+    stats_path = f"{api_socket}.uffd.json"
+
+    def run(record: bool, prefetch: bool) -> Tuple[float, int, int]:
+        fd = os.open(memory, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+        for path in (stats_path, vsock_path):
+            if path and os.path.exists(path):
+                os.unlink(path)
+        start = time.monotonic()
+        result = chain.restore(
+            api_socket, layer.id, firecracker_bin, timeout=timeout, backend="uffd" if record else backend,
+            record=record_window if record else 0.0, prefetch=prefetch
+        )
+        faults = 0
+        try:
+            ready, detail = asyncio.run(_responsive(api_socket, vsock_path, address, result["pid"], vsock_port, probe, timeout))
+            if not ready:
+                raise SnapshotError(f"restored VM not responsive: {detail}")
+            elapsed = time.monotonic() - start
+            if record:
+                time.sleep(max(0.0, start + record_window - time.monotonic()))
+            elif not result["page_server_pid"]:
+                faults = _major_faults(result["pid"])
+        finally:
+            _kill(result["pid"])
+            if result["page_server_pid"]:
+                # The page server writes its statistics once the VMM is gone.
+                _reap(result["page_server_pid"], 10.0)
+        if result["page_server_pid"]:
+            with open(stats_path) as f:
+                stats = json.load(f)
+            return elapsed, stats["faults"], stats["prefetched_pages"]
+        return elapsed, faults, 0
+
+    run(record=True, prefetch=False)
+    workingset = load_working_set(chain.workingset(layer.id))
+    report: Dict[str, Any] = {
+        "iterations": iterations,
+        "backend": backend,
+        "window_s": record_window,
+        "workingset_pages": workingset["pages"],
+        "workingset_mib": workingset["pages"] * workingset["page_size"] / 1048576
+    }
+    for mode in ("cold", "prefetch"):
+        samples = [run(record=False, prefetch=mode == "prefetch") for _ in range(iterations)]
+        report[mode] = dict(
+            _summary([elapsed for elapsed, _, _ in samples]),
+            faults_p50=percentile([faults for _, faults, _ in samples], 50),
+            faults_p90=percentile([faults for _, faults, _ in samples], 90),
+            prefetched_pages=max(prefetched for _, _, prefetched in samples)
+        )
+    return report
+
+def print_working_set_benchmark(report: Dict[str, Any]) -> None:
+    print_color(
+        f"{report['iterations']} {report['backend']} restore(s) each; working set {report['workingset_pages']} page(s), "
+        f"{report['workingset_mib']:.1f} MiB from a {report['window_s']:g}s window:",
+        Colors.HEADER
+    )
+    print(f"{'restore':<10} {'faults p50':>11} {'faults p90':>11} {'first job p50':>14} {'first job p90':>14} {'prefetched':>11}")
+    for mode in ("cold", "prefetch"):
+        r = report[mode]
+        print(
+            f"{mode:<10} {r['faults_p50']:>11.0f} {r['faults_p90']:>11.0f} "
+            f"{r['p50_s'] * 1000:>11.1f} ms {r['p90_s'] * 1000:>11.1f} ms {r['prefetched_pages']:>11}"
+        )
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Full and diff snapshot chains for Firecracker MicroVMs",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--dir", default=DEFAULT_SNAPSHOT_DIR, help="Directory holding one subdirectory per chain")
+    parser.add_argument("--store", default=DEFAULT_STORE, help="Chunk store used by archive and restore --from-store")
+    parser.add_argument("--catalog", help="Snapshot catalog database (default: catalog.db in --dir)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    take = sub.add_parser("take", help="Snapshot a running VM into a chain (diff when possible)")
+    take.add_argument("--socket", default=os.environ.get("FC_API_SOCKET", DEFAULT_API_SOCKET), help="API socket of the VM")
+    take.add_argument("--chain", default="default", help="Chain name")
+    take.add_argument("--full", action="store_true", help="Start the chain over with a full snapshot")
+    take.add_argument("--max-chain", type=int, default=0, help="Compact when the chain grows past this many layers (0 = never)")
+    take.add_argument("--no-disks", action="store_true", help="Do not capture the VM's writable drives")
+    take.add_argument("--copy-disks", action="store_true", help="Copy drives that cannot be reflinked, inside the pause")
+    take.add_argument("--staging", default=DEFAULT_STAGING, help="tmpfs directory the memory file is written to while paused")
+    take.add_argument("--no-staging", action="store_true", help="Write the memory file straight into the chain")
+    take.add_argument("--archive", action="store_true", help="Also compress and hash the memory image into the chunk store")
+    take.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Hashing/compression threads for --archive")
+
+    take_all_parser = sub.add_parser("take-all", help="Snapshot every running VM under --vms-dir, committing in the background")
+    take_all_parser.add_argument("--vms-dir", default=DEFAULT_BASE_DIR, help="Directory of VMs started with vm_launcher.py")
+    take_all_parser.add_argument("--workers", type=int, default=2, help="Snapshots committed concurrently")
+    take_all_parser.add_argument("--max-staged", type=int, help="Captured snapshots allowed to wait in staging (default: 2 x --workers)")
+    take_all_parser.add_argument("--staging", default=DEFAULT_STAGING, help="tmpfs directory memory files are written to while paused")
+    take_all_parser.add_argument("--no-staging", action="store_true", help="Write memory files straight into the chains")
+    take_all_parser.add_argument("--archive", action="store_true", help="Also compress and hash the memory images into the chunk store")
+    take_all_parser.add_argument("--full", action="store_true", help="Start every chain over with a full snapshot")
+    take_all_parser.add_argument("--no-disks", action="store_true", help="Do not capture the VMs' writable drives")
+    take_all_parser.add_argument("--copy-disks", action="store_true", help="Copy drives that cannot be reflinked, inside the pause")
+    take_all_parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    sub.add_parser("list", help="Show chains and their layers")
+
+    mat = sub.add_parser("materialize", help="Write the full memory image of a layer")
+    mat.add_argument("--chain", default="default", help="Chain name")
+    mat.add_argument("--layer", type=int, help="Layer id (default: newest)")
+    mat.add_argument("--out", help="Output file (default: cached inside the chain)")
+
+    compact = sub.add_parser("compact", help="Merge the base and older diffs into one full layer")
+    compact.add_argument("--chain", default="default", help="Chain name")
+    compact.add_argument("--keep", type=int, default=0, help="Newest diffs to leave unmerged")
+
+    archive = sub.add_parser("archive", help="Add the chain's memory images to the deduplicating chunk store")
+    archive.add_argument("--chain", default="default", help="Chain name")
+    archive.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Hashing/compression threads")
+
+    restore = sub.add_parser("restore", help="Start a VMM and load a layer with the File memory backend")
+    restore.add_argument("--socket", default=os.environ.get("FC_API_SOCKET", DEFAULT_API_SOCKET), help="API socket for the restored VM")
+    restore.add_argument("--chain", default="default", help="Chain name")
+    restore.add_argument("--layer", type=int, help="Layer id (default: newest)")
+    restore.add_argument("--firecracker", default="firecracker", help="Firecracker binary")
+    restore.add_argument("--console", help="File receiving the VMM's console output")
+    restore.add_argument("--paused", action="store_true", help="Leave the VM paused after loading")
+    restore.add_argument("--backend", choices=("file", "uffd"), default="file", help="Guest memory backend")
+    restore.add_argument("--readahead", type=int, default=1, help="Pages the UFFD page server copies per fault")
+    restore.add_argument("--from-store", action="store_true", help="Read guest memory from the chunk store")
+    restore.add_argument("--keep-disks", action="store_true", help="Leave the drives as they are instead of restoring the captured ones")
+    restore.add_argument("--record", type=float, default=0.0, help="Save the pages touched in this many seconds as the layer's working set (uffd)")
+    restore.add_argument("--no-prefetch", action="store_true", help="Do not prefetch the layer's recorded working set")
+
+    ws_bench = sub.add_parser("ws-bench", help="Compare restores with and without working-set prefetch")
+    ws_bench.add_argument("--socket", default=os.environ.get("FC_API_SOCKET", DEFAULT_API_SOCKET), help="API socket for the restored VM")
+    ws_bench.add_argument("--chain", default="default", help="Chain name")
+    ws_bench.add_argument("--layer", type=int, help="Layer id (default: newest)")
+    ws_bench.add_argument("--iterations", type=int, default=5, help="Restores with and without prefetch")
+    ws_bench.add_argument("--backend", choices=("file", "uffd"), default="uffd", help="Guest memory backend")
+    ws_bench.add_argument("--record-window", type=float, default=5.0, help="Seconds of guest activity the working set covers")
+    ws_bench.add_argument("--firecracker", default="firecracker", help="Firecracker binary")
+    ws_bench.add_argument("--vsock-port", type=int, help="Guest vsock port that answers once the first job can run")
+    ws_bench.add_argument("--vsock-path", help="Host side of the VM's vsock device (with --vsock-port)")
+    ws_bench.add_argument("--probe", help="Shell command that exits 0 once the first job has run (gets FC_GUEST_ADDRESS)")
+    ws_bench.add_argument("--address", help="Guest address passed to --probe")
+    ws_bench.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for the guest")
+    ws_bench.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    bench = sub.add_parser("bench", help="Compare restore-to-responsive latency with a cold boot")
+    bench.add_argument("--template", default="vm-config.json", help="Firecracker config used as template")
+    bench.add_argument("--base-dir", default="vms/restore-bench", help="Working directory for the benchmark VM")
+    bench.add_argument("--iterations", type=int, default=5, help="Cold boots and restores per backend")
+    bench.add_argument("--backend", action="append", choices=("file", "uffd"), help="Restore backend (repeatable, default: both)")
+    bench.add_argument("--firecracker", default="firecracker", help="Firecracker binary")
+    bench.add_argument("--vsock-port", type=int, help="Guest vsock port that answers once the guest is responsive (this or --probe is required)")
+    bench.add_argument("--probe", help="Shell command that exits 0 once the guest is responsive (gets FC_GUEST_ADDRESS)")
+    bench.add_argument("--setup-tap", action="store_true", help="Create the VM's tap device")
+    bench.add_argument("--ready-timeout", type=float, default=60.0, help="Seconds to wait for the guest")
+    bench.add_argument("--json", action="store_true", help="Print the report as JSON")
+
+    gc_parser = sub.add_parser("gc", help="Expire old chains and delete unreferenced chunks and kernels")
+    gc_parser.add_argument("--max-age-days", type=float, help="Expire chains whose newest snapshot is older than this")
+    gc_parser.add_argument("--keep-chains", type=int, help="Keep only this many most recently used chains")
+    gc_parser.add_argument("--dry-run", action="store_true", help="Only report what would be deleted")
+
+    sub.add_parser("reindex", help="Rebuild the catalog from the chains and the chunk store")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "bench":
+            report = benchmark(
+                args.template, args.base_dir, args.iterations, tuple(args.backend or ("file", "uffd")),
+                args.firecracker, args.vsock_port, args.probe, args.setup_tap, args.ready_timeout
+            )
+            if args.json:
+                print(json.dumps(report, indent=2))
+            else:
+                print_benchmark(report)
+            return
+        if args.command == "list":
+            for chain in list_chains(args.dir):
+                print_chain(chain)
+            return
+        catalog = Catalog(args.catalog or os.path.join(args.dir, "catalog.db"))
+        store = ChunkStore(args.store)
+        if args.command == "reindex":
+            print_color(f"Indexed {reindex(args.dir, catalog, store)} snapshot(s).", Colors.OKGREEN)
+            return
+        if args.command == "gc":
+            report = gc(args.dir, catalog, store, args.max_age_days, args.keep_chains, args.dry_run)
+            verb = "Would expire" if args.dry_run else "Expired"
+            print_color(
+                f"{verb} {len(report['chains'])} chain(s) ({report['snapshots']} snapshot(s)); "
+                f"{report['chunks']} unreferenced chunk(s), {report['kernels']} kernel(s), "
+                f"{report['freed_bytes'] / 1048576:.1f} MiB freed",
+                Colors.OKGREEN
+            )
+            return
+        if args.command == "take-all":
+            report = take_all(
+                args.vms_dir, args.dir, catalog, store, args.workers, args.max_staged,
+                None if args.no_staging else args.staging, args.archive, args.full, not args.no_disks,
+                args.copy_disks
+            )
+            if args.json:
+                print(json.dumps(report, indent=2))
+            else:
+                print_take_all(report)
+            if report["errors"]:
+                sys.exit(1)
+            return
+        chain = SnapshotChain(os.path.join(args.dir, args.chain), catalog, store)
+        if args.command == "take":
+            layer = chain.take(
+                args.socket, args.full, disks=not args.no_disks, staging=None if args.no_staging else args.staging,
+                archive=store if args.archive else None, workers=args.workers, copy_disks=args.copy_disks
+            )
+            print_color(
+                f"{layer.kind} snapshot {chain.name}/{layer.id:04d}: paused {layer.paused_s * 1000:.1f} ms"
+                f"{' (staged)' if layer.staged else ''}, total {layer.total_s * 1000:.1f} ms, "
+                f"wrote {layer.bytes_written / 1048576:.1f} MiB of a {layer.mem_size / 1048576:.0f} MiB guest",
+                Colors.OKGREEN
+            )
+            if layer.disks:
+                print_color(
+                    f"Captured {', '.join(layer.disks)} by {layer.disk_capture} in {layer.disk_s * 1000:.1f} ms"
+                    + (f"; kernel {layer.kernel[:12]}" if layer.kernel else ""),
+                    Colors.OKBLUE
+                )
+            if layer.disks_skipped:
+                print_color(
+                    f"Skipped {', '.join(layer.disks_skipped)}: no reflink support, and a copy would keep "
+                    "the guest paused until it finished (--copy-disks copies anyway)",
+                    Colors.WARNING
+                )
+            if args.max_chain and len(chain.layers) > args.max_chain:
+                removed = chain.compact(keep=args.max_chain - 1)
+                print_color(f"Compacted {removed} layer(s) into the base.", Colors.OKBLUE)
+        elif args.command == "materialize":
+            start = time.monotonic()
+            path = chain.materialize(args.layer, args.out)
+            print_color(f"{path} ({time.monotonic() - start:.2f}s)", Colors.OKGREEN)
+        elif args.command == "archive":
+            for stats in chain.archive(store, args.workers):
+                print_color(
+                    f"{stats.name}: {stats.new_chunks} new chunk(s), {stats.new_bytes / 1048576:.1f} MiB stored "
+                    f"({stats.zero_chunks}/{stats.chunks} zero) in {stats.elapsed_s:.2f}s",
+                    Colors.OKGREEN
+                )
+        elif args.command == "compact":
+            print_color(f"Compacted {chain.compact(args.keep)} layer(s) of {chain.name}.", Colors.OKGREEN)
+        elif args.command == "restore":
+            result = chain.restore(
+                args.socket, args.layer, args.firecracker, args.console, not args.paused,
+                backend=args.backend, readahead=args.readahead,
+                store=store if args.from_store else None, disks=not args.keep_disks,
+                record=args.record, prefetch=not args.no_prefetch
+            )
+            print_color(
+                f"Restored {result['chain']}/{result['layer']:04d} as pid {result['pid']} with the {result['backend']} backend "
+                f"(materialize {result['materialize_s'] * 1000:.1f} ms, load {result['load_s'] * 1000:.1f} ms)",
+                Colors.OKGREEN
+            )
+            if result["workingset"]:
+                print_color(
+                    f"Recording the working set for {args.record:g}s" if args.record else "Prefetching the recorded working set",
+                    Colors.OKBLUE
+                )
+        elif args.command == "ws-bench":
+            if args.vsock_port and not args.vsock_path:
+                raise SnapshotError("--vsock-port needs --vsock-path")
+            report = working_set_benchmark(
+                chain, args.socket, args.layer, args.iterations, args.backend, args.record_window,
+                args.firecracker, args.vsock_port, args.vsock_path, args.address, args.probe, args.timeout
+            )
+            if args.json:
+                print(json.dumps(report, indent=2))
+            else:
+                print_working_set_benchmark(report)
+    except (SnapshotError, UffdError, ChunkStoreError, CatalogError) as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+    except (OSError, FirecrackerAPIError) as e:
+        print_color(f"Error: {getattr(e, 'fault', None) or e}", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
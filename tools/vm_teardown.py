@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+import os
+import time
+import signal
+import asyncio
+import argparse
+from dataclasses import dataclass
+from typing import Optional, List, Dict
+
+from firecracker_api import Colors, print_color, FirecrackerClient, FirecrackerAPIError
+
+@dataclass
+class TeardownTarget:
+    """A firecracker process to stop and the resources to clean up after it."""
+    pid: int
+    name: str = ""
+    api_socket: Optional[str] = None
+    vsock_path: Optional[str] = None
+    tap: Optional[str] = None
+    # Set when the VM is an asyncio child of this process; its exit status is the loop's to collect.
+    process: Optional[asyncio.subprocess.Process] = None
+
+@dataclass
+class TeardownResult:
+    """How a VM was stopped and how long it took."""
+    target: TeardownTarget
+    method: str
+    elapsed: float
+    detail: str = ""
+    # False when the VMM was still running after SIGKILL.
+    exited: bool = True
+
+def _cmdline(pid: int) -> List[str]:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            return [a.decode(errors="replace") for a in f.read().split(b"\0") if a]
+    except OSError:
+        return []
+
+def _comm(pid: int) -> str:
+    try:
+        with open(f"/proc/{pid}/comm") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+def _option(argv: List[str], name: str) -> Optional[str]:
+    for i, arg in enumerate(argv):
+        if arg == name and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith(name + "="):
+            return arg.split("=", 1)[1]
+    return None
+
+def discover_firecracker() -> List[TeardownTarget]:
+    """Find running firecracker processes with one pass over /proc."""
+    targets = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        pid = int(entry)
+        argv = _cmdline(pid)
+        if not argv:
+            continue
+        if _comm(pid) != "firecracker" and os.path.basename(argv[0]) != "firecracker":
+            continue
+        api_socket = _option(argv, "--api-sock")
+        cwd = None
+        try:
+            cwd = os.readlink(f"/proc/{pid}/cwd")
+        except OSError:
+            pass
+        if api_socket and cwd and not os.path.isabs(api_socket):
+            api_socket = os.path.join(cwd, api_socket)
+        targets.append(TeardownTarget(pid=pid, name=_option(argv, "--id") or str(pid), api_socket=api_socket))
+    return targets
+
+def find_by_socket(api_socket: str) -> Optional[TeardownTarget]:
+    """Find the firecracker process serving `api_socket`."""
+    wanted = os.path.abspath(api_socket)
+    for target in discover_firecracker():
+        if target.api_socket and os.path.abspath(target.api_socket) == wanted:
+            return target
+    return None
+
+def _alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _reap(pid: int) -> None:
+    # Collect the exit status when the VM is our own child. Never call this for
+    # asyncio children: their Process.wait() would then report 255.
+    if pid <= 0:
+        return
+    try:
+        os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        pass
+
+async def wait_for_exit(pid: int, timeout: float, process: Optional[asyncio.subprocess.Process] = None) -> bool:
+    """
+    Wait until `pid` exits; False on timeout.
+
+    Uses a pidfd so the wait is a single readiness event rather than a
+    polling loop; falls back to polling on kernels without pidfd_open.
+    An asyncio child is passed as `process` and awaited instead, leaving
+    its exit status to whoever else waits on it.
+    """
+    if process is not None:
+        try:
+            await asyncio.wait_for(asyncio.shield(process.wait()), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    _reap(pid)
+    if not _alive(pid):
+        return True
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        pidfd = None
+
+    if pidfd is not None:
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(True))
+        try:
+            await asyncio.wait_for(exited, timeout)
+            _reap(pid)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        _reap(pid)
+        if not _alive(pid):
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+def _request_shutdown(api_socket: str) -> None:
+    with FirecrackerClient(api_socket, timeout=2.0) as client:
+        # A paused guest never sees the key press.
+        if client.describe_instance().get("state") == "Paused":
+            client.resume()
+        client.send_ctrl_alt_del()
+
+def _signal(pid: int, sig: int) -> bool:
+    try:
+        os.kill(pid, sig)
+        return True
+    except ProcessLookupError:
+        return False
+
+async def _cleanup(target: TeardownTarget, remove_taps: bool) -> None:
+    for path in (target.api_socket, target.vsock_path):
+        if path and os.path.exists(path):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+    if remove_taps and target.tap and os.path.exists(f"/sys/class/net/{target.tap}"):
+        cmd = ["ip", "link", "delete", target.tap]
+        if os.geteuid() != 0:
+            cmd = ["sudo"] + cmd
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+        )
+        await proc.wait()
+
+async def shutdown_vm(
+    target: TeardownTarget,
+    timeout: float = 10.0,
+    term_timeout: float = 3.0,
+    remove_taps: bool = False
+) -> TeardownResult:
+    """
+    Stop one VM as gently as its deadline allows.
+
+    Sends Ctrl+Alt+Del through the API so the guest can sync and unmount
+    its filesystems, waits up to `timeout` seconds for the VMM to exit, then
+    escalates to SIGTERM and finally SIGKILL.
+    """
+    start = time.monotonic()
+    method, detail, exited = "ctrl-alt-del", "", True
+
+    if not _alive(target.pid) or (target.process is not None and target.process.returncode is not None):
+        method = "already-exited"
+    else:
+        requested = False
+        if target.api_socket and os.path.exists(target.api_socket):
+            try:
+                await asyncio.to_thread(_request_shutdown, target.api_socket)
+                requested = True
+            except (OSError, FirecrackerAPIError) as e:
+                detail = f"API shutdown failed: {e}"
+        if not requested or not await wait_for_exit(target.pid, timeout, target.process):
+            method = "sigterm"
+            if _signal(target.pid, signal.SIGTERM) and not await wait_for_exit(target.pid, term_timeout, target.process):
+                method = "sigkill"
+                _signal(target.pid, signal.SIGKILL)
+                exited = await wait_for_exit(target.pid, term_timeout, target.process)
+                if not exited:
+                    detail = "still running after SIGKILL"
+
+    await _cleanup(target, remove_taps)
+    return TeardownResult(target, method, time.monotonic() - start, detail, exited)
+
+async def teardown_many(
+    targets: List[TeardownTarget],
+    timeout: float = 10.0,
+    term_timeout: float = 3.0,
+    remove_taps: bool = False,
+    concurrency: int = 0
+) -> List[TeardownResult]:
+    """Stop VMs concurrently; total time is bounded by the slowest guest."""
+    limit = asyncio.Semaphore(concurrency if concurrency > 0 else max(1, len(targets)))
+
+    async def bounded(target: TeardownTarget) -> TeardownResult:
+        async with limit:
+            return await shutdown_vm(target, timeout, term_timeout, remove_taps)
+
+    return await asyncio.gather(*(bounded(t) for t in targets))
+
+def print_results(results: List[TeardownResult], elapsed: float) -> None:
+    """Print per-VM teardown results and a summary."""
+    counts: Dict[str, int] = {}
+    for result in results:
+        counts[result.method] = counts.get(result.method, 0) + 1
+        if not result.exited:
+            color = Colors.FAIL
+        elif result.method in ("ctrl-alt-del", "already-exited"):
+            color = Colors.OKGREEN
+        else:
+            color = Colors.WARNING
+        line = f"{result.target.name:<12} pid {result.target.pid:<8} {result.method:<15} {result.elapsed:.2f}s"
+        if result.detail:
+            line += f"  ({result.detail})"
+        print_color(line, color)
+    summary = ", ".join(f"{n} {m}" for m, n in sorted(counts.items()))
+    print_color(f"Stopped {len(results)} VM(s) in {elapsed:.2f}s ({summary or 'nothing to do'})", Colors.OKGREEN)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Gracefully stop one, some or all Firecracker MicroVMs in parallel",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument("--socket", action="append", default=[], help="Stop the VM serving this API socket (repeatable)")
+    parser.add_argument("--pid", type=int, action="append", default=[], help="Stop the firecracker process with this PID (repeatable)")
+    parser.add_argument("--all", action="store_true", help="Stop every firecracker process on the host")
+    parser.add_argument("--timeout", type=float, default=10.0, help="Seconds to wait for a clean guest shutdown")
+    parser.add_argument("--term-timeout", type=float, default=3.0, help="Seconds to wait after SIGTERM before SIGKILL")
+    parser.add_argument("--concurrency", type=int, default=0, help="Maximum shutdowns in flight (0 = all)")
+    args = parser.parse_args()
+
+    targets: List[TeardownTarget] = []
+    if args.all:
+        targets = discover_firecracker()
+    else:
+        known = {t.pid: t for t in discover_firecracker()}
+        for pid in args.pid:
+            if pid in known:
+                targets.append(known[pid])
+            else:
+                print_color(f"PID {pid} is not a firecracker process; leaving it alone.", Colors.WARNING)
+        for path in args.socket:
+            target = find_by_socket(path)
+            if target:
+                target.api_socket = os.path.abspath(path)
+                targets.append(target)
+            else:
+                print_color(f"No firecracker process is serving {path}.", Colors.WARNING)
+                if os.path.exists(path):
+                    os.unlink(path)
+        if not args.pid and not args.socket:
+            parser.error("select VMs with --socket, --pid or --all")
+
+    start = time.monotonic()
+    results = asyncio.run(teardown_many(targets, args.timeout, args.term_timeout, concurrency=args.concurrency))
+    print_results(results, time.monotonic() - start)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import mmap
+import time
+import errno
+import fcntl
+import ctypes
+import select
+import socket
+import struct
+import bisect
+import argparse
+import subprocess
+from collections import deque
+from dataclasses import dataclass, asdict
+from typing import Optional, Dict, Any, List, Iterable
+
+from firecracker_api import Colors, print_color
+from vm_chunkstore import DEFAULT_STORE, ChunkStore, ChunkStoreError
+
+# struct uffd_msg: event, three reserved fields, then a 24-byte union
+UFFD_MSG = struct.Struct("=BBHIQQQ")
+UFFD_EVENT_PAGEFAULT = 0x12
+UFFD_EVENT_REMOVE = 0x15
+# struct uffdio_copy {dst, src, len, mode, copy} and uffdio_zeropage {start, len, mode, zeropage}
+UFFDIO_COPY_ARG = struct.Struct("=QQQQq")
+UFFDIO_ZEROPAGE_ARG = struct.Struct("=QQQq")
+UFFDIO_COPY = 0xC028AA03
+UFFDIO_ZEROPAGE = 0xC020AA04
+UFFDIO_WAKE = 0x8010AA02
+UFFDIO_RANGE = struct.Struct("=QQ")
+
+# Pages a restored VM touched in its first seconds, stored next to the snapshot.
+WORKING_SET_FILE = "workingset.json"
+# Prefetch copies at most this much per UFFDIO_COPY, checking for faults in between.
+PREFETCH_BLOCK = 2 * 1024 * 1024
+
+class UffdError(Exception):
+    pass
+
+@dataclass
+class GuestRegion:
+    """A guest memory region as Firecracker describes it in the UFFD handshake."""
+    base: int
+    size: int
+    offset: int
+    page_size: int
+
+@dataclass
+class FaultStats:
+    faults: int = 0
+    pages_copied: int = 0
+    zero_pages: int = 0
+    bytes_copied: int = 0
+    removed_bytes: int = 0
+    handshake_s: Optional[float] = None
+    first_fault_s: Optional[float] = None
+    busy_s: float = 0.0
+    prefetched_pages: int = 0
+    prefetch_s: Optional[float] = None
+    recorded_pages: int = 0
+
+class FileSource:
+    """Serve pages straight from a full memory file (mapped once, copied by the kernel)."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self.size = os.fstat(self._file.fileno()).st_size
+        # MAP_PRIVATE + PROT_WRITE only so ctypes can take the address; nothing is written.
+        self._map = mmap.mmap(self._file.fileno(), self.size, mmap.MAP_PRIVATE, mmap.PROT_READ | mmap.PROT_WRITE)
+        self._base = ctypes.addressof(ctypes.c_char.from_buffer(self._map))
+
+    def limit(self, offset: int) -> int:
+        return self.size
+
+    def locate(self, offset: int, length: int) -> Optional[int]:
+        return self._base + offset
+
+def open_source(
+    mem_file: Optional[str] = None,
+    recipe: Optional[str] = None,
+    chunk_store: Optional[str] = None
+):
+    if recipe:
+        return ChunkStore(chunk_store or DEFAULT_STORE).open(recipe)
+    if mem_file:
+        return FileSource(mem_file)
+    raise UffdError("need a memory file or a chunk store to serve pages from")
+
+def page_extents(offsets: Iterable[int], page_size: int) -> List[List[int]]:
+    """Merge page offsets into sorted [offset, length] runs."""
+    extents: List[List[int]] = []
+    for offset in sorted(set(offsets)):
+        if extents and extents[-1][0] + extents[-1][1] == offset:
+            extents[-1][1] += page_size
+        else:
+            extents.append([offset, page_size])
+    return extents
+
+def save_working_set(path: str, offsets: Iterable[int], page_size: int, window: float) -> int:
+    """Write the memory-file offsets of touched pages as sorted extents; returns the page count."""
+    extents = page_extents(offsets, page_size)
+    pages = sum(length for _, length in extents) // page_size
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"page_size": page_size, "window_s": window, "pages": pages, "extents": extents}, f)
+    os.replace(tmp, path)
+    return pages
+
+def load_working_set(path: str) -> Dict[str, Any]:
+    with open(path) as f:
+        return json.load(f)
+
+def prefetch_file(path: str, extents: List[List[int]]) -> int:
+    """
+    Start reading the working set of a memory file into the page cache.
+
+    For the File backend: the reads are queued in offset order and run
+    while the VM loads and resumes, so its first touches of those pages
+    are minor faults. Returns the number of bytes requested.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        for offset, length in extents:
+            os.posix_fadvise(fd, offset, length, os.POSIX_FADV_WILLNEED)
+    finally:
+        os.close(fd)
+    return sum(length for _, length in extents)
+
+class PageServer:
+    """
+    Userfaultfd page-fault handler for one restored VM.
+
+    Firecracker connects to `socket_path` during /snapshot/load with the
+    Uffd backend and passes the userfaultfd plus a JSON list of its guest
+    memory regions. From then on every first touch of a guest page traps
+    here and is resolved with UFFDIO_COPY from `source`, so the load
+    returns without reading guest memory at all. Pages the balloon
+    removed are zero-filled on their next fault.
+
+    With `record_path`, the pages faulted during the first `record_window`
+    seconds are saved as a working set. With `prefetch` (extents of such a
+    set), those pages are copied in in large sorted blocks right after the
+    handshake, between faults, so the guest stops stalling on them.
+    """
+
+    def __init__(
+        self,
+        socket_path: str,
+        source,
+        readahead: int = 1,
+        record_path: Optional[str] = None,
+        record_window: float = 5.0,
+        prefetch: Optional[List[List[int]]] = None
+    ):
+        self.socket_path = socket_path
+        self.source = source
+        self.readahead = max(1, readahead)
+        self.record_path = record_path
+        self.record_window = record_window
+        self.prefetch = prefetch or []
+        self.stats = FaultStats()
+        self._touched: set = set()
+        self._record_deadline: Optional[float] = None
+        self.regions: List[GuestRegion] = []
+        self._bases: List[int] = []
+        self._removed: Dict[int, int] = {}
+        self._uffd = -1
+        self._conn: Optional[socket.socket] = None
+        self._zero: Optional[ctypes.Array] = None
+        self._started = time.monotonic()
+
+    def listen(self) -> socket.socket:
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen(1)
+        return server
+
+    def accept(self, server: socket.socket) -> None:
+        """Take the userfaultfd and region layout from Firecracker."""
+        self._conn, _ = server.accept()
+        self._started = time.monotonic()
+        payload = b""
+        while True:
+            data, fds, _, _ = socket.recv_fds(self._conn, 65536, 1)
+            payload += data
+            if fds:
+                self._uffd = fds[0]
+            if self._uffd >= 0 and payload:
+                try:
+                    mappings = json.loads(payload)
+                    break
+                except ValueError:
+                    pass
+            if not data and not fds:
+                raise UffdError("firecracker closed the UFFD socket before sending the userfaultfd")
+        for m in mappings:
+            page_size = m.get("page_size") or m.get("page_size_kib", 4) * 1024
+            self.regions.append(GuestRegion(m["base_host_virt_addr"], m["size"], m["offset"], page_size))
+        self.regions.sort(key=lambda r: r.base)
+        self._bases = [r.base for r in self.regions]
+        self.stats.handshake_s = time.monotonic() - self._started
+        if self.record_path:
+            self._record_deadline = self._started + self.record_window
+
+    def _region(self, address: int) -> GuestRegion:
+        region = self.regions[bisect.bisect_right(self._bases, address) - 1]
+        if not region.base <= address < region.base + region.size:
+            raise UffdError(f"fault at {address:#x} outside guest memory")
+        return region
+
+    def _zeropage(self, address: int, length: int, page_size: int) -> bool:
+        if page_size == mmap.PAGESIZE:
+            arg = bytearray(UFFDIO_ZEROPAGE_ARG.pack(address, length, 0, 0))
+            done = self._ioctl(UFFDIO_ZEROPAGE, arg)
+        else:
+            # hugetlbfs has no zeropage; copy from a zeroed buffer instead
+            if self._zero is None or len(self._zero) < length:
+                self._zero = ctypes.create_string_buffer(length)
+            done = self._copy(address, ctypes.addressof(self._zero), length)
+        self.stats.zero_pages += length // page_size
+        return done
+
+    def _fill(self, address: int, src: Optional[int], length: int, page_size: int) -> bool:
+        if src is None:
+            return self._zeropage(address, length, page_size)
+        return self._copy(address, src, length)
+
+    def _copy(self, address: int, src: int, length: int) -> bool:
+        return self._ioctl(UFFDIO_COPY, bytearray(UFFDIO_COPY_ARG.pack(address, src, length, 0, 0)))
+
+    def _ioctl(self, request: int, arg: bytearray) -> bool:
+        """Returns False when part of the range was already populated."""
+        for _ in range(100):
+            try:
+                fcntl.ioctl(self._uffd, request, arg, True)
+                return True
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    # Already populated (a concurrent fault on the same page); nothing to do.
+                    return False
+                if e.errno != errno.EAGAIN:
+                    raise
+        raise UffdError("userfaultfd kept returning EAGAIN")
+
+    def fault(self, address: int) -> None:
+        """Resolve one page fault, pulling in up to `readahead` neighbouring pages with it."""
+        region = self._region(address)
+        page_size = region.page_size
+        page = address & ~(page_size - 1)
+        if self._record_deadline is not None and time.monotonic() <= self._record_deadline:
+            self._touched.add(region.offset + (page - region.base))
+        if self._removed.pop(page, None):
+            self._zeropage(page, page_size, page_size)
+            return
+        block = page_size * self.readahead
+        start = max(region.base, page - (page - region.base) % block)
+        offset = region.offset + (start - region.base)
+        length = min(block, region.base + region.size - start, self.source.limit(offset) - offset)
+        if not start <= page < start + length or any(start <= p < start + length for p in self._removed):
+            start, offset, length = page, region.offset + (page - region.base), page_size
+        src = self.source.locate(offset, length)
+        filled = self._fill(start, src, length, page_size)
+        if not filled and length > page_size:
+            # Part of the block was already filled (by prefetch or an earlier
+            # fault), so the kernel copied nothing; fill just the faulting page.
+            src = None if src is None else src + (page - start)
+            start, length = page, page_size
+            filled = self._fill(start, src, length, page_size)
+        if not filled:
+            # Filled in the meantime without waking this fault.
+            fcntl.ioctl(self._uffd, UFFDIO_WAKE, UFFDIO_RANGE.pack(page, page_size))
+            return
+        if src is not None:
+            self.stats.pages_copied += length // page_size
+            self.stats.bytes_copied += length
+
+    def _prefetch_next(self, pending: deque) -> None:
+        """Copy in the next block of the working set."""
+        offset, length = pending[0]
+        region = next((r for r in self.regions if r.offset <= offset < r.offset + r.size), None)
+        chunk = 0 if region is None else min(
+            length, PREFETCH_BLOCK, region.offset + region.size - offset, self.source.limit(offset) - offset
+        )
+        if chunk <= 0:
+            pending.popleft()
+            return
+        if chunk == length:
+            pending.popleft()
+        else:
+            pending[0] = (offset + chunk, length - chunk)
+        page_size = region.page_size
+        address = region.base + (offset - region.offset)
+        if any(address <= p < address + chunk for p in self._removed):
+            return
+        src = self.source.locate(offset, chunk)
+        if self._fill(address, src, chunk, page_size):
+            self.stats.prefetched_pages += chunk // page_size
+            return
+        # The guest already faulted part of the block in; fill in the rest page by page.
+        for page in range(0, chunk, page_size):
+            filled = self._fill(address + page, None if src is None else src + page, page_size, page_size)
+            self.stats.prefetched_pages += int(filled)
+
+    def _finish(self) -> FaultStats:
+        if self._record_deadline is not None:
+            page_size = self.regions[0].page_size if self.regions else mmap.PAGESIZE
+            self.stats.recorded_pages = save_working_set(self.record_path, self._touched, page_size, self.record_window)
+            self._record_deadline = None
+        return self.stats
+
+    def _remove(self, start: int, end: int) -> None:
+        page_size = self._region(start).page_size
+        for page in range(start, end, page_size):
+            self._removed[page] = 1
+        self.stats.removed_bytes += end - start
+
+    def serve(self) -> FaultStats:
+        """Handle faults until the VM exits."""
+        poller = select.poll()
+        poller.register(self._uffd, select.POLLIN)
+        poller.register(self._conn.fileno(), select.POLLHUP | select.POLLERR)
+        pending = deque((offset, length) for offset, length in self.prefetch)
+        while True:
+            if pending:
+                timeout = 0
+            elif self._record_deadline is not None:
+                timeout = max(0, int((self._record_deadline - time.monotonic()) * 1000))
+            else:
+                timeout = None
+            ready = poller.poll(timeout)
+            if not ready:
+                if pending:
+                    self._prefetch_next(pending)
+                    if not pending:
+                        self.stats.prefetch_s = time.monotonic() - self._started
+                elif self._record_deadline is not None and time.monotonic() > self._record_deadline:
+                    self._finish()
+                continue
+            for fd, events in ready:
+                if fd == self._conn.fileno() or events & (select.POLLHUP | select.POLLERR):
+                    return self._finish()
+                try:
+                    data = os.read(self._uffd, UFFD_MSG.size * 64)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    return self._finish()
+                busy = time.monotonic()
+                for i in range(0, len(data), UFFD_MSG.size):
+                    event, _, _, _, arg0, arg1, _ = UFFD_MSG.unpack_from(data, i)
+                    if event == UFFD_EVENT_PAGEFAULT:
+                        if self.stats.first_fault_s is None:
+                            self.stats.first_fault_s = busy - self._started
+                        self.stats.faults += 1
+                        self.fault(arg1)
+                    elif event == UFFD_EVENT_REMOVE:
+                        self._remove(arg0, arg1)
+                self.stats.busy_s += time.monotonic() - busy
+
+def start_page_server(
+    socket_path: str,
+    mem_file: Optional[str] = None,
+    recipe: Optional[str] = None,
+    chunk_store: Optional[str] = None,
+    readahead: int = 1,
+    stats_path: Optional[str] = None,
+    log_path: Optional[str] = None,
+    timeout: float = 5.0,
+    record_path: Optional[str] = None,
+    record_window: float = 5.0,
+    prefetch_path: Optional[str] = None
+) -> subprocess.Popen:
+    """Run `vm_uffd.py serve` as a detached process and wait until it listens on `socket_path`."""
+    tool = os.path.abspath(__file__)
+    cmd = [sys.executable, tool, "serve", "--socket", socket_path, "--readahead", str(readahead)]
+    if recipe:
+        cmd += ["--recipe", recipe] + (["--chunk-store", chunk_store] if chunk_store else [])
+    else:
+        cmd += ["--mem-file", mem_file]
+    if stats_path:
+        cmd += ["--stats", stats_path]
+    if record_path:
+        cmd += ["--record", record_path, "--record-window", str(record_window)]
+    elif prefetch_path:
+        cmd += ["--prefetch", prefetch_path]
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    log = open(log_path, "ab") if log_path else subprocess.DEVNULL
+    try:
+        process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    finally:
+        if log_path:
+            log.close()
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(socket_path):
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            raise UffdError(f"page server did not start listening on {socket_path}")
+        time.sleep(0.005)
+    return process
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Userfaultfd page server for lazily restored Firecracker snapshots",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="Serve guest memory for one VM restored with the Uffd backend")
+    serve.add_argument("--socket", required=True, help="Socket given to /snapshot/load as backend_path")
+    source = serve.add_mutually_exclusive_group(required=True)
+    source.add_argument("--mem-file", help="Full memory file of the snapshot")
+    source.add_argument("--recipe", help="Memory file recipe in the deduplicating chunk store (vm_chunkstore.py)")
+    serve.add_argument("--chunk-store", help="Chunk store holding --recipe (default: FC_CHUNK_STORE or snapshots/.store)")
+    serve.add_argument("--readahead", type=int, default=1, help="Pages copied per fault (aligned block)")
+    serve.add_argument("--stats", help="Write fault statistics as JSON here when the VM exits")
+    working_set = serve.add_mutually_exclusive_group()
+    working_set.add_argument("--record", help="Save the pages faulted after the handshake as a working set here")
+    working_set.add_argument("--prefetch", help="Copy in the pages of this working set ahead of faults")
+    serve.add_argument("--record-window", type=float, default=5.0, help="Seconds of faults --record captures")
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == "serve":
+            server = PageServer(
+                args.socket,
+                open_source(args.mem_file, args.recipe, args.chunk_store),
+                args.readahead,
+                record_path=args.record,
+                record_window=args.record_window,
+                prefetch=load_working_set(args.prefetch)["extents"] if args.prefetch else None
+            )
+            listener = server.listen()
+            server.accept(listener)
+            listener.close()
+            os.unlink(args.socket)
+            stats = server.serve()
+            if args.stats:
+                with open(args.stats, "w") as f:
+                    json.dump(asdict(stats), f, indent=2)
+    except (UffdError, ChunkStoreError, OSError, ValueError, KeyError) as e:
+        print_color(f"Error: {e}", Colors.FAIL)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
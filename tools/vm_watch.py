@@ -0,0 +1,224 @@
+import os
+import re
+import time
+import signal
+import asyncio
+from typing import Optional, Dict, Any, Set, Callable
+
+from vm_ready import DEFAULT_PATTERN, Inotify, open_inotify, IN_CREATE, IN_DELETE, IN_MODIFY, IN_MOVED_TO
+
+WATCHED_FILES = {
+    "firecracker.socket": "api-socket",
+    "vsock.sock": "vsock-socket"
+}
+# Output files followed with IN_MODIFY; each append is published as "<kind>-output".
+WATCHED_LOGS = {
+    "console.log": "console",
+    "firecracker.log": "log"
+}
+# Bytes of new output read per event; a burst beyond this is skipped, not queued.
+MAX_OUTPUT_READ = 65536
+READY_RE = re.compile(DEFAULT_PATTERN)
+PANIC_RE = re.compile(r"Kernel panic|Oops:|BUG:")
+
+class EventBus:
+    """Fan-out of lifecycle events to any number of asyncio subscribers."""
+
+    def __init__(self, queue_size: int = 1024):
+        self.queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        """Deliver `event` to every subscriber, dropping the oldest on overflow."""
+        event.setdefault("ts", time.time())
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+class VMWatcher:
+    """
+    Event-driven tracking of firecracker processes and their files.
+
+    Child processes are awaited through asyncio (pidfd-backed where the
+    child watcher supports it); processes adopted from a previous daemon
+    run are tracked with a pidfd registered on the event loop. Each VM's
+    working directory is watched with inotify so socket creation and
+    removal are reported the moment they happen, and so is output appended
+    to its console and firecracker log. Nothing is ever polled.
+    """
+
+    def __init__(self, bus: EventBus, on_exit: Optional[Callable[[str, Optional[int]], None]] = None):
+        self.bus = bus
+        self.on_exit = on_exit
+        self._pidfds: Dict[str, int] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._inotify: Optional[Inotify] = None
+        self._dir_watches: Dict[str, int] = {}
+        self._dir_owner: Dict[str, str] = {}
+        self._log_watches: Dict[str, int] = {}
+        self._log_offsets: Dict[str, int] = {}
+
+    def start(self) -> None:
+        """Register the inotify descriptor with the running loop."""
+        self._inotify = open_inotify()
+        if self._inotify:
+            asyncio.get_running_loop().add_reader(self._inotify.fileno(), self._on_inotify)
+
+    def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        for vm_id in list(self._pidfds):
+            self._drop_pidfd(vm_id)
+        for task in self._tasks.values():
+            task.cancel()
+        if self._inotify:
+            loop.remove_reader(self._inotify.fileno())
+            self._inotify.close()
+            self._inotify = None
+
+    # Processes
+
+    def watch_process(self, vm_id: str, process: asyncio.subprocess.Process) -> None:
+        """Track a firecracker child started by this process."""
+        self._tasks[vm_id] = asyncio.create_task(self._await_child(vm_id, process))
+
+    def watch_pid(self, vm_id: str, pid: int) -> bool:
+        """Track a firecracker process that is not our child. False if it is already gone."""
+        try:
+            pidfd = os.pidfd_open(pid)
+        except ProcessLookupError:
+            self._exited(vm_id, pid, None)
+            return False
+        self._pidfds[vm_id] = pidfd
+        asyncio.get_running_loop().add_reader(pidfd, self._on_pidfd, vm_id, pid)
+        return True
+
+    async def _await_child(self, vm_id: str, process: asyncio.subprocess.Process) -> None:
+        code = await process.wait()
+        self._tasks.pop(vm_id, None)
+        self._exited(vm_id, process.pid, code)
+
+    def _on_pidfd(self, vm_id: str, pid: int) -> None:
+        self._drop_pidfd(vm_id)
+        self._exited(vm_id, pid, None)
+
+    def _drop_pidfd(self, vm_id: str) -> None:
+        pidfd = self._pidfds.pop(vm_id, None)
+        if pidfd is not None:
+            asyncio.get_running_loop().remove_reader(pidfd)
+            os.close(pidfd)
+
+    def _exited(self, vm_id: str, pid: int, code: Optional[int]) -> None:
+        event: Dict[str, Any] = {"type": "exit", "vm_id": vm_id, "pid": pid, "exit_code": code}
+        if code is not None and code < 0:
+            event["signal"] = signal.Signals(-code).name
+        # firecracker exits 0 after a guest reboot/poweroff; anything else is a crash.
+        event["crashed"] = code not in (0, None)
+        self.bus.publish(event)
+        if self.on_exit:
+            self.on_exit(vm_id, code)
+
+    # Files
+
+    def watch_dir(self, vm_id: str, workdir: str) -> None:
+        """Report socket creation and removal and new console and log output in a VM's working directory."""
+        if not self._inotify or workdir in self._dir_watches:
+            return
+        try:
+            wd = self._inotify.add_watch(workdir, IN_CREATE | IN_DELETE | IN_MOVED_TO)
+        except OSError:
+            return
+        self._dir_watches[workdir] = wd
+        self._dir_owner[workdir] = vm_id
+        for name in WATCHED_LOGS:
+            self._watch_log(os.path.join(workdir, name))
+
+    def unwatch_dir(self, workdir: str) -> None:
+        wd = self._dir_watches.pop(workdir, None)
+        self._dir_owner.pop(workdir, None)
+        if wd is not None and self._inotify:
+            self._inotify.rm_watch(wd)
+        for name in WATCHED_LOGS:
+            self._unwatch_log(os.path.join(workdir, name))
+
+    def _watch_log(self, path: str, created: bool = False) -> None:
+        # Output already in an existing file is not replayed; a file the
+        # directory watch saw being created is followed from its start.
+        if path in self._log_watches:
+            return
+        try:
+            offset = 0 if created else os.path.getsize(path)
+            self._log_watches[path] = self._inotify.add_watch(path, IN_MODIFY)
+        except OSError:
+            return
+        self._log_offsets[path] = offset
+        if created:
+            self._publish_output(path)
+
+    def _unwatch_log(self, path: str) -> None:
+        wd = self._log_watches.pop(path, None)
+        self._log_offsets.pop(path, None)
+        if wd is not None and self._inotify:
+            self._inotify.rm_watch(wd)
+
+    def _on_inotify(self) -> None:
+        modified = []
+        for path, mask, name in self._inotify.read_events():
+            if mask & IN_MODIFY and path in self._log_watches:
+                if path not in modified:
+                    modified.append(path)
+                continue
+            vm_id = self._dir_owner.get(path)
+            if not vm_id:
+                continue
+            if name in WATCHED_LOGS:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._unwatch_log(os.path.join(path, name))
+                    self._watch_log(os.path.join(path, name), created=True)
+                elif mask & IN_DELETE:
+                    self._unwatch_log(os.path.join(path, name))
+                continue
+            kind = WATCHED_FILES.get(name)
+            if not kind:
+                continue
+            action = "created" if mask & (IN_CREATE | IN_MOVED_TO) else "deleted"
+            self.bus.publish({"type": f"{kind}-{action}", "vm_id": vm_id, "path": os.path.join(path, name)})
+        for path in modified:
+            self._publish_output(path)
+
+    def _publish_output(self, path: str) -> None:
+        """Publish what was appended to a watched console or log since the last event."""
+        workdir, name = os.path.split(path)
+        vm_id = self._dir_owner.get(workdir)
+        offset = self._log_offsets.get(path, 0)
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                if size < offset:
+                    offset = 0  # truncated
+                skipped = max(0, size - offset - MAX_OUTPUT_READ)
+                f.seek(offset + skipped)
+                data = f.read(size - offset - skipped)
+        except OSError:
+            return
+        self._log_offsets[path] = offset + skipped + len(data)
+        if not data or not vm_id:
+            return
+        text = data.decode(errors="replace")
+        self.bus.publish({
+            "type": f"{WATCHED_LOGS[name]}-output",
+            "vm_id": vm_id,
+            "path": path,
+            "text": text,
+            "skipped_bytes": skipped,
+            "ready": bool(READY_RE.search(text)),
+            "panic": bool(PANIC_RE.search(text))
+        })